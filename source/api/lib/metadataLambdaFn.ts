@@ -111,6 +111,19 @@ function getBatteryData(event: any) {
   });
 }
 
+/**
+ * Reads the battery summary index of a pipeline, or the record of one battery
+ * @param event
+ */
+async function getSummary(event: any) {
+  const Key = `${event.queryStringParameters["key"]}/${event.queryStringParameters["uuid"]}/summary.json`;
+  const getObjectCommand = new GetObjectCommand({ Bucket: process.env.BUCKET, Key });
+  const resp: any = await s3.send(getObjectCommand);
+  const summary = JSON.parse(await resp.Body.transformToString());
+  const battery = event.queryStringParameters.battery;
+  return battery ? summary.batteries[battery] ?? null : summary;
+}
+
 async function copyDataset(event: any) {
   const isPlugin = event.queryStringParameters.plugin === 'Y';
   const s3Uri = event.queryStringParameters.uri;
@@ -170,6 +183,8 @@ export async function handler(event?: any, context?: any) {
       data = await getMetadata(event);
     } else if (action === "GBD") {
       data = await getBatteryData(event);
+    } else if (action === "GS") {
+      data = await getSummary(event);
     } else if (action === "CD") {
       data = await copyDataset(event);
     }
@@ -70,6 +70,8 @@ export async function handler(event?: any, context?: any) {
         DefaultArguments: {
           "--s3_bucket": bucket,
           "--raw_dataset_key": file["key"],
+          "--extra-py-files": process.env.PIPELINE_LIBRARY!,
+          "--frequency": process.env.DATASET_FREQUENCY!,
         },
         GlueVersion: "3.0",
       })
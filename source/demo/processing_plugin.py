@@ -11,19 +11,26 @@
 # express or implied. See the License for the specific language governing
 # permissions and limitations under the License.
 
+import logging
 import sys
 from awsglue.transforms import *
 from awsglue.utils import getResolvedOptions
 from pyspark.context import SparkContext
 from awsglue.context import GlueContext
 from awsglue.job import Job
-from awsglue.dynamicframe import DynamicFrameCollection
-from awsglue.dynamicframe import DynamicFrame
-from pyspark.sql.functions import col, udf
-from pyspark.sql.types import StringType
-from datetime import datetime, date, timedelta
-from random import sample
-import boto3
+
+# Shared pipeline library, passed to the job with --extra-py-files
+from instrumentation import InstrumentedBackend
+from pipeline_core import (
+    LOCATIONS_KEY,
+    PipelineConfig,
+    get_optional_args,
+    parse_keys,
+    run_pipelines,
+    run_processing,
+)
+from s3_finalize import FINALIZE_WORKERS
+from spark_backend import SparkBackend
 
 # Parameter for removing sparsely timed data
 # Useful only when data has varied timeseries lengths
@@ -34,17 +41,85 @@ QUANTILE_CUTOFF = 0.5
 # Arbitrarily initialized year for converting cycle_no to timestamp
 INIT_YEAR = 2000
 
+# Time step between cycles, has to match the Forecast dataset frequency
+FREQUENCY = 'D'
+
 # Number of days into the future to generate forecasts for
 FORECAST_HORIZON = 30
 
 # Cells we want to generate forecasts while testing
 CELLS_PER_BATTERY = 5
 
+# Sample CELLS_PER_BATTERY test cells of each battery instead of using every
+# eligible cell. The same dataset and seed always give the same test cells.
+SAMPLING = False
+SAMPLING_SEED = 0
+
+# Only process cycles added since the previous run, tracked per cell in
+# <pipeline>/manifest.csv. Has to be set for both jobs from the first run on.
+INCREMENTAL = False
+
+# Write a stage level run report under <pipeline>/reports/, and label the
+# Spark jobs of every stage in the Spark UI and event log. COUNT_ROWS adds
+# the rows and partitions of every stage's input and output to the report.
+# Each count is a Spark job of its own that recomputes uncached frames, so
+# it can cost as much as the stage itself.
+INSTRUMENT = False
+STAGE_MARKERS = False
+COUNT_ROWS = False
+
+# Format of the plot outputs, 'csv' or 'parquet' (partitioned by battery,
+# typed columns). Has to be the same for both jobs of a pipeline.
+OUTPUT_FORMAT = 'csv'
+
+# Check the raw cells before conversion: bad rows are dropped, bad cells
+# quarantined to <pipeline>/quarantine.csv, see <pipeline>/quality_report.csv.
+# Gaps of up to REPAIR_GAPS missing cycles are filled by interpolation.
+VALIDATION = True
+REPAIR_GAPS = 0
+
+# Also forecast the test cells with the built-in damped trend baseline, to
+# <pipeline>/baseline_forecast/ in the layout of a Forecast export
+BASELINE_FORECAST = False
+
+# Roll capacity and SOH up per cycle to battery, site and fleet level, in
+# <pipeline>/rollups/. Sites come from the battery location table.
+ROLLUPS = True
+
+# Flag cells whose fade rate over this many trailing cycles, or whose
+# capacity loss, stands out from their battery's, to <pipeline>/anomalies.csv
+# and <pipeline>/module_warnings.json. 0 to skip.
+ANOMALY_WINDOW = 50
+
+# raw_dataset_key may list the raw datasets of several pipelines, comma
+# separated. Up to PIPELINE_WORKERS of them are processed at once in this
+# job's Spark session, each writing under its own pipeline prefix.
+PIPELINE_WORKERS = 4
+
 args = getResolvedOptions(sys.argv, [
     'JOB_NAME',
     's3_bucket',
     'raw_dataset_key'
 ])
+args.update(get_optional_args(sys.argv, {
+    'init_year': INIT_YEAR,
+    'frequency': FREQUENCY,
+    'finalize_workers': FINALIZE_WORKERS,
+    'incremental': INCREMENTAL,
+    'sampling': SAMPLING,
+    'sampling_seed': SAMPLING_SEED,
+    'instrument': INSTRUMENT,
+    'stage_markers': STAGE_MARKERS,
+    'count_rows': COUNT_ROWS,
+    'output_format': OUTPUT_FORMAT,
+    'validation': VALIDATION,
+    'repair_gaps': REPAIR_GAPS,
+    'baseline_forecast': BASELINE_FORECAST,
+    'rollups': ROLLUPS,
+    'anomaly_window': ANOMALY_WINDOW,
+    'locations_key': LOCATIONS_KEY,
+    'pipeline_workers': PIPELINE_WORKERS,
+}))
 
 sc = SparkContext.getOrCreate()
 glueContext = GlueContext(sc)
@@ -52,191 +127,43 @@ spark = glueContext.spark_session
 job = Job(glueContext)
 job.init(args['JOB_NAME'], args)
 
-s3 = boto3.client('s3')
-bucket = args['s3_bucket']
-base = args['raw_dataset_key'].rsplit('/', 1)[0]
-
-def get_cutoff(df):
-    return df.approxQuantile(['cycle_life'], [QUANTILE_CUTOFF], 0)[0][0]
-
-
-# Treat int as day number offset from starting date of Jan 1, 2000
-def day_num_to_date(day_num):
-    # Initializing start date
-    start_date = datetime(INIT_YEAR, 1, 1, 0, 0, 0)
-    # converting to date
-    res_date = start_date + timedelta(days=int(day_num) - 1)
-    # Forecast expects yyyy-MM-dd HH:mm:ss by default
-    return res_date.strftime("%Y-%m-%d %H:%M:%S")
-
-
-# Randomly sample cells that have data spanning the forecast horizon
-def get_test_set(df, cutoff, sampling=False):
-    trunc_df = df[df['cycle_no'] == (cutoff + FORECAST_HORIZON)]
-    poss_cells = [r[0] for r in trunc_df.select('battery_name').distinct().collect()]
-    
-    if not sampling:
-        return poss_cells
-    
-    poss_batts  = {}
-    for cell in poss_cells:
-        pre = cell[:2]
-        if pre not in poss_batts:
-            poss_batts[pre] = []
-        poss_batts[pre].append(cell)
-
-    test_cells = []
-    for cell_set in poss_batts.values():
-        test_cells.extend(sample(cell_set, CELLS_PER_BATTERY))
-    
-    return test_cells
-
-
-# Replace Spark autogen key with expected filename for all objects in directory
-def rename_files(s3_path):
-    files = s3.list_objects(
-        Bucket=bucket,
-        Prefix=s3_path,
-    )
-
-    for f in files["Contents"]:
-        f_name = f["Key"]
-        p_name = f_name.rsplit('/', 1)[0]
-
-        if '=' in p_name:
-            cell_id = p_name.split('=', 1)[1]
-            p_name = f"{p_name.rsplit('/', 1)[0]}/{cell_id}.csv"
-
-        s3.copy_object(Bucket=bucket, CopySource=f"{bucket}/{f_name}", Key=p_name)
-        s3.delete_object(Bucket=bucket, Key=f_name)
-    
-
-# Script generated for ConvertTS Transform
-def ConvertTS_Transform(glueContext, dynamicFrame) -> DynamicFrame:
-    df = dynamicFrame.toDF()
-    
-    # Cast columns to ensure numerical sorting
-    df = df.withColumn('cycle_no', df['cycle_no'].cast('int')) \
-           .withColumn('cycle_life', df['cycle_life'].cast('int')) \
-           .withColumn('qd', df['QD'].cast('float'))
-
-    # Sort values by cycle_no (timestamp) to adhere to Forecast expectations
-    df = df.sort(['cycle_no', 'battery_name'])
-    
-    # Change cycle_no to fake incremental days. Ex: day_num_to_date("1") -> 2000-01-01
-    toDateUDF = udf(lambda i: day_num_to_date(i), StringType()) 
-    df = df.withColumn('date', toDateUDF(df['cycle_no']))
-
-    return DynamicFrame.fromDF(df, glueContext, "timeseries_set")
-
-
-# Script generated for ExtractTrain Transform
-def ExtractTrain_Transform(glueContext, dynamicFrame, plotData) -> DynamicFrame:
-    df = dynamicFrame.toDF()
-    cutoff = get_cutoff(df)
-    test_set = get_test_set(df, cutoff)
-    
-    if plotData:
-        df = df[df['battery_name'].isin(test_set)]
-
-    df_train = df[df['cycle_no'] <= cutoff]
-    
-    ts_column = 'cycle_no' if plotData else 'date'
-    df_train = df_train[[ts_column, 'battery_name', 'qd']]
-    return DynamicFrame.fromDF(df_train, glueContext, "training_set")
-
-
-# Script generated for ExtractTest Transform
-# Option to get all possible test cells, or only a sub-sample
-def ExtractTest_Transform(glueContext, dynamicFrame, plotData) -> DynamicFrame:
-    df = dynamicFrame.toDF()
-    cutoff = get_cutoff(df)
-    test_set = get_test_set(df, cutoff)
-    
-    df_test = df[df['battery_name'].isin(test_set)]
-    df_test = df_test[df_test['cycle_no'] > cutoff]
-    df_test = df_test[df_test['cycle_no'] <= (cutoff + FORECAST_HORIZON)]
-
-    # DF should exactly span the forecast horizon for each test cell
-    assert df_test.count() == FORECAST_HORIZON * len(test_set)
-    
-    ts_column = 'cycle_no' if plotData else 'date'
-    df_test = df_test[[ts_column, 'battery_name', 'qd']]
-    return DynamicFrame.fromDF(df_test, glueContext, "testing_set")
-
-
-# Script generated for ExtractTestIds Transform
-# Needed by Forecast to generate a sub-sample for given IDs
-def ExtractIds_Transform(glueContext, dynamicFrame) -> DynamicFrame:
-    df = dynamicFrame.toDF()
-    df_ids = df[['battery_name']].drop_duplicates()
-    return DynamicFrame.fromDF(df_ids, glueContext, "cell_ids")
-
-
-# Script generated for SaveData Transform
-def SaveData_Transform(input_node, s3_path, partition_key=None):
-    header = True if partition_key else False
-    partition_key = [partition_key] if partition_key else []
-    
-    glueContext.write_dynamic_frame.from_options(
-        frame=input_node.coalesce(1),
-        connection_type="s3",
-        format="csv",
-        format_options={
-            "quoteChar": -1,
-            "writeHeader": header
-        }, 
-        connection_options={
-            "path": f"s3://{bucket}/{s3_path}",
-            "partitionKeys": partition_key
-        },
-    )
-    
-    rename_files(s3_path)
-    
-
-# Import raw dataset from S3 bucket
-InputRaw_Node = glueContext.create_dynamic_frame.from_options(
-    format_options={
-        "quoteChar": '"',
-        "withHeader": True,
-        "separator": ",",
-        "optimizePerformance": True,
-    },
-    connection_type="s3",
-    format="csv",
-    connection_options={
-        "paths": [f"s3://{bucket}/{args['raw_dataset_key']}"],
-        "recurse": True,
-    }
+# Pipeline progress and failures go to the driver log
+logging.basicConfig(level=logging.INFO)
+
+config = PipelineConfig(
+    quantile_cutoff=QUANTILE_CUTOFF,
+    init_year=args['init_year'],
+    frequency=args['frequency'],
+    forecast_horizon=FORECAST_HORIZON,
+    cells_per_battery=CELLS_PER_BATTERY,
+    sampling=args['sampling'],
+    sampling_seed=args['sampling_seed'],
+    incremental=args['incremental'],
+    output_format=args['output_format'],
+    validation=args['validation'],
+    repair_gaps=args['repair_gaps'],
+    baseline_forecast=args['baseline_forecast'],
+    rollups=args['rollups'],
+    anomaly_window=args['anomaly_window'],
+    locations_key=args['locations_key'],
 )
 
 
-# Preprocessing to get timestamps from TS data
-ConvertTS_Node = ConvertTS_Transform(glueContext, InputRaw_Node)
-
-
-# Extract and save training dataset w timestamp as single file for Forecast
-Train_ByTime_Node = ExtractTrain_Transform(glueContext, ConvertTS_Node, False)
-SaveData_Transform(Train_ByTime_Node, f"{base}/train_dataset.csv")
-
-# Extract and save training dataset w cycle_no split by cell IDs for UI
-Train_ByCycle_Node = ExtractTrain_Transform(glueContext, ConvertTS_Node, True)
-SaveData_Transform(Train_ByCycle_Node, f"{base}/plot/past/", "battery_name")
-
-
-# Extract and save testing dataset w timestamp as single file for Forecast
-Test_ByTime_Node = ExtractTest_Transform(glueContext, ConvertTS_Node, False)
-SaveData_Transform(Test_ByTime_Node, f"{base}/test_dataset.csv")
+# Every pipeline gets its own backend, so run reports stay separate
+def process(raw_dataset_key):
+    backend = SparkBackend(glueContext, args['s3_bucket'], finalize_workers=args['finalize_workers'])
+    if args['instrument']:
+        backend = InstrumentedBackend(backend, count_rows=args['count_rows'], markers=args['stage_markers'])
 
-# Extract and save testing dataset w cycle_no split by cell IDs for UI
-Test_ByCycle_Node = ExtractTest_Transform(glueContext, ConvertTS_Node, True)
-SaveData_Transform(Test_ByCycle_Node, f"{base}/plot/actual/", "battery_name")
+    # Steps are defined in pipeline_core.run_processing, the same steps can be
+    # run without Glue through local_backend.py
+    run_processing(backend, raw_dataset_key, config)
 
+    if args['instrument']:
+        backend.write_report(raw_dataset_key.rsplit('/', 1)[0], 'processing_plugin', config)
 
-# Extract and save test cell IDs for Forecast to generate predictions.
-Test_Ids_Node = ExtractIds_Transform(glueContext, Test_ByTime_Node)
-SaveData_Transform(Test_Ids_Node, f"{base}/test_ids.csv")
 
+run_pipelines(process, parse_keys(args['raw_dataset_key']), lambda key: key.rsplit('/', 1)[0],
+              args['pipeline_workers'])
 
 job.commit()
\ No newline at end of file
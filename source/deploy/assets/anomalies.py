@@ -0,0 +1,107 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# Degradation anomalies of cells (battery modules) against their peers.
+#
+# Every cell gets two features at its last cycle: its fade rate, the
+# least squares slope of qd / qd_orig over a trailing window, and its
+# capacity loss, 1 - qd / qd_orig. Window sums of all cells come from
+# cumulative sums over the (cells x cycles) matrix, so missing cycles are
+# simply left out. Each feature is scored with a robust z-score against
+# the median and MAD of the cells of the same battery; only the degrading
+# side (faster fade, larger loss) is flagged. A median and MAD over a handful
+# of cells say little, batteries with fewer than MIN_PEERS scored cells are
+# left unscored.
+
+import numpy as np
+import pandas as pd
+
+# Module statuses, from the worst
+ATTENTION = 'attention'
+WARNING = 'warning'
+OK = 'ok'
+NOT_SCORED = 'not_scored'
+
+# Fewest cells with both features in a battery for its cells to be scored
+MIN_PEERS = 5
+
+# z-scores from which a module is under warning or needs attention
+WARNING_Z = 3.0
+ATTENTION_Z = 5.0
+
+# MAD to standard deviation of a normal distribution
+MAD_SCALE = 1.4826
+
+# Smallest peer spread of each feature, so near identical peers don't turn
+# measurement noise into anomalies
+MIN_SPREAD = {'fade': 1e-5, 'loss': 0.005}
+
+ANOMALY_COLUMNS = ['batt', 'cell', 'module', 'modules', 'cycle', 'fade', 'loss', 'fade_z', 'loss_z', 'status']
+
+
+# Least squares slope of every row of y over its trailing window of
+# columns ending at column end, NaN with fewer than 2 values in it
+def window_slope(y, end, window):
+    valid = ~np.isnan(y)
+    x = np.where(valid, np.arange(y.shape[1], dtype=np.float64), 0.0)
+    v = np.where(valid, y, 0.0)
+    sums = [np.cumsum(np.concatenate([np.zeros((len(y), 1)), s], axis=1), axis=1)
+            for s in (valid.astype(np.float64), x, v, x*v, x*x)]
+
+    rows = np.arange(len(y))
+    start = np.maximum(end + 1 - window, 0)
+    n, sx, sy, sxy, sxx = (s[rows, end + 1] - s[rows, start] for s in sums)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(n >= 2, (n*sxy - sx*sy)/(n*sxx - sx*sx), np.nan)
+
+
+# Robust z-score of a feature against the other cells of each battery
+def peer_z(values, batt, min_spread):
+    median = values.groupby(batt).transform('median')
+    mad = (values - median).abs().groupby(batt).transform('median')
+    return (values - median)/np.maximum(MAD_SCALE*mad, min_spread)
+
+
+# Anomalies (ANOMALY_COLUMNS) of a pandas frame of cell series with batt,
+# cell, module, modules, cycle and qd columns, one row per cell
+def module_anomalies(df, window):
+    df = df.drop_duplicates(['cell', 'cycle'])
+    codes, cells = pd.factorize(df['cell'], sort=True)
+    if not len(cells):
+        return pd.DataFrame({c: [] for c in ANOMALY_COLUMNS})
+    cycle = df['cycle'].to_numpy(np.int64)
+    start = cycle.min()
+
+    y = np.full((len(cells), cycle.max() - start + 1), np.nan)
+    y[codes, cycle - start] = df['qd'].to_numpy(np.float64)
+    valid = ~np.isnan(y)
+    rows = np.arange(len(cells))
+    first = np.argmax(valid, axis=1)
+    last = y.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    ratio = y/y[rows, first][:, None]
+
+    keys = df.groupby('cell', sort=True)[['batt', 'module', 'modules']].first()
+    out = keys.reset_index().assign(
+        cycle=start + last,
+        fade=-window_slope(ratio, last, window),
+        loss=1 - ratio[rows, last],
+    )
+    scored = out[['fade', 'loss']].notna().all(axis=1)
+    scored &= scored.groupby(out['batt']).transform('sum') >= MIN_PEERS
+    peers = out[scored]
+    out['fade_z'] = peer_z(peers['fade'], peers['batt'], MIN_SPREAD['fade']).round(2)
+    out['loss_z'] = peer_z(peers['loss'], peers['batt'], MIN_SPREAD['loss']).round(2)
+    score = out[['fade_z', 'loss_z']].max(axis=1)
+    out['status'] = np.select([~scored, score >= ATTENTION_Z, score >= WARNING_Z], [NOT_SCORED, ATTENTION, WARNING], OK)
+    out = out.round({'fade': 8, 'loss': 6})
+    return out[ANOMALY_COLUMNS].astype({'module': np.int64, 'modules': np.int64, 'cycle': np.int64})
@@ -0,0 +1,116 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# Forecast accuracy of the test cells: the Forecast export against the
+# actual split, and a rolling origin backtest of the baseline forecaster.
+#
+# The baseline forecasts of every origin come out of one smoothing pass
+# over the (cells x cycles) matrix of past and actual. The errors of all
+# (model, origin, cell) groups are then reduced with one set of grouped
+# sums, and battery rows pool the sums of their cells.
+
+import numpy as np
+import pandas as pd
+
+from baseline_forecast import damped_trend_origins
+from health_metrics import FIT_RUL_MODEL, RUL_MODEL, calc_eol
+
+# Models evaluated, the Forecast export and baseline_forecast.py
+FORECAST_MODEL = 'forecast'
+BASELINE_MODEL = 'baseline'
+
+BACKTEST_COLUMNS = ['model', 'origin', 'batt', 'cell', 'points', 'wape', 'rmse', 'mape', 'eol_error']
+
+
+# End of life cycle implied by the RUL model at (cycle, qd), NaN while no
+# decay is seen
+def _eol_cycle(qd, cycle, qd_orig, rul_model):
+    return calc_eol(qd, cycle, qd_orig, RUL_MODEL if rul_model == FIT_RUL_MODEL else rul_model)
+
+
+# Metrics (BACKTEST_COLUMNS) of a pandas frame of cell series with split,
+# batt, cell, cycle and qd columns. Each cell is scored from its cutoff, the
+# last cycle of its past split: Forecast predictions from there, the
+# baseline from there and the origins - 1 origins before it, horizon cycles
+# apart. Battery rows have no cell, and their eol_error is the mean of
+# their cells'.
+def backtest_metrics(df, horizon, origins, rul_model=RUL_MODEL):
+    history = df[df['split'] != 'predictions'].drop_duplicates(['cell', 'cycle'])
+    codes, cells = pd.factorize(history['cell'], sort=True)
+    cutoffs = df[df['split'] == 'past'].groupby('cell')['cycle'].max().reindex(cells).to_numpy(np.float64)
+    if not len(cells) or np.isnan(cutoffs).all():
+        return pd.DataFrame({c: [] for c in BACKTEST_COLUMNS})
+    cycle = history['cycle'].to_numpy(np.int64)
+    start, end = cycle.min(), max(cycle.max(), int(np.nanmax(cutoffs)) + horizon)
+
+    y = np.full((len(cells), end - start + 1), np.nan)
+    y[codes, cycle - start] = history['qd'].to_numpy(np.float64)
+    first = history.sort_values('cycle', kind='stable').groupby('cell')['qd'].first()
+    qd_orig = first.reindex(cells).to_numpy(np.float64)
+
+    # Baseline rows of every origin, for the cells sharing a cutoff:
+    # (model, origin, cell, cycle, actual, pred)
+    steps = np.arange(1, horizon + 1)
+    parts = []
+    for cutoff in np.unique(cutoffs[~np.isnan(cutoffs)]):
+        group = np.flatnonzero(cutoffs == cutoff)
+        stops = [o for o in (int(cutoff) - k*horizon for k in range(origins)) if o >= start]
+        for origin, (p50, _) in zip(stops, damped_trend_origins(y[group], [o - start for o in stops], horizon)):
+            parts.append((BASELINE_MODEL, origin, np.repeat(group, horizon), np.tile(origin + steps, len(group)),
+                          y[group][:, origin - start + steps].ravel(), p50.ravel()))
+
+    # Forecast export rows, scored against the actual cycles
+    pred = df[(df['split'] == 'predictions') & df['cell'].isin(cells)
+              & (df['cycle'] > start) & (df['cycle'] <= end)]
+    pred_codes = cells.get_indexer(pred['cell'])
+    pred_cycle = pred['cycle'].to_numpy(np.int64)
+    parts.append((FORECAST_MODEL, cutoffs[pred_codes], pred_codes, pred_cycle, y[pred_codes, pred_cycle - start],
+                  pred['qd'].to_numpy(np.float64)))
+
+    rows = pd.DataFrame({
+        'model': np.concatenate([np.full(len(p[2]), p[0], dtype=object) for p in parts]),
+        'origin': np.concatenate([np.full(len(p[2]), p[1]) for p in parts]),
+        'code': np.concatenate([p[2] for p in parts]),
+        'cycle': np.concatenate([p[3] for p in parts]),
+        'actual': np.concatenate([p[4] for p in parts]),
+        'pred': np.concatenate([p[5] for p in parts]),
+    }).dropna()
+    err = rows['pred'] - rows['actual']
+    rows = rows.assign(abs_error=err.abs(), abs_actual=rows['actual'].abs(), sq_error=err*err,
+                       ape=err.abs()/rows['actual'].abs())
+
+    # Sums and last scored cycle of every (model, origin, cell)
+    keys = ['model', 'origin', 'code']
+    sums = rows.groupby(keys)[['abs_error', 'abs_actual', 'sq_error', 'ape']].sum()
+    last = rows.sort_values('cycle', kind='stable').groupby(keys)[['cycle', 'actual', 'pred']].last()
+    sums = sums.join(last).assign(points=rows.groupby(keys).size()).reset_index()
+    orig = qd_orig[sums['code']]
+    sums['eol_error'] = np.abs(_eol_cycle(sums['pred'], sums['cycle'], orig, rul_model)
+                               - _eol_cycle(sums['actual'], sums['cycle'], orig, rul_model))
+    sums['cell'] = np.asarray(cells, dtype=object)[sums['code']]
+    sums['batt'] = sums['cell'].map(history.drop_duplicates('cell').set_index('cell')['batt'])
+
+    batteries = sums.groupby(['model', 'origin', 'batt'], as_index=False).agg(
+        abs_error=('abs_error', 'sum'), abs_actual=('abs_actual', 'sum'), sq_error=('sq_error', 'sum'),
+        ape=('ape', 'sum'), points=('points', 'sum'), eol_error=('eol_error', 'mean'),
+    ).assign(cell=None)
+
+    out = pd.concat([sums, batteries], ignore_index=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = out.assign(
+            wape=(out['abs_error']/out['abs_actual']).round(6),
+            rmse=np.sqrt(out['sq_error']/out['points']).round(6),
+            mape=(out['ape']/out['points']).round(6),
+            eol_error=out['eol_error'].round(1),
+        )
+    return out[BACKTEST_COLUMNS].astype({'origin': np.int64, 'points': np.int64})
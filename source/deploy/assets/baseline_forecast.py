@@ -0,0 +1,107 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# Baseline forecaster of the test cells, a stand-in for Amazon Forecast.
+#
+# Holt's damped trend exponential smoothing runs on all series at once:
+# series are the rows of a (cells x cycles) matrix, and every smoothing
+# step is one vectorized update of all of them for every candidate
+# (alpha, beta) pair. Each cell keeps the pair with the lowest one step
+# ahead error. Missing cycles are stepped over with the model's own
+# forecast. p10 and p90 come from the one step errors, widened with the
+# square root of the horizon.
+
+import numpy as np
+import pandas as pd
+
+# Candidate level and trend smoothing parameters, every pair is tried
+SMOOTHING_LEVELS = (0.1, 0.3, 0.5, 0.8)
+SMOOTHING_TRENDS = (0.01, 0.05, 0.1, 0.3)
+
+# Damping of the trend per step, 1 is Holt's linear trend
+DAMPING = 0.98
+
+# Standard normal quantile of p90, p10 is its opposite
+P90_Z = 1.2815515655446004
+
+
+# p50 (series x horizon) and one step error (series) of the best
+# smoothing pair per series. y holds the series as rows, NaN where a cycle
+# is missing, and every row has at least one value.
+def damped_trend_forecast(y, horizon, levels=SMOOTHING_LEVELS, trends=SMOOTHING_TRENDS, damping=DAMPING):
+    y = np.asarray(y, dtype=np.float64)
+    return damped_trend_origins(y, [y.shape[1] - 1], horizon, levels, trends, damping)[0]
+
+
+# damped_trend_forecast from several origins in one smoothing pass: each
+# origin is a column of y, forecasts from it only see the columns up to it.
+# Series without a value up to an origin get NaN forecasts from it.
+def damped_trend_origins(y, origins, horizon, levels=SMOOTHING_LEVELS, trends=SMOOTHING_TRENDS,
+                         damping=DAMPING):
+    y = np.asarray(y, dtype=np.float64)
+    n = y.shape[0]
+    alpha = np.repeat(levels, len(trends))[:, None]
+    beta = np.tile(trends, len(levels))[:, None]
+
+    # Series start at their first value with no trend
+    valid = ~np.isnan(y)
+    first = np.where(valid.any(axis=1), np.argmax(valid, axis=1), y.shape[1])
+    level = np.tile(y[np.arange(n), np.minimum(first, y.shape[1] - 1)], (len(alpha), 1))
+    trend = np.zeros_like(level)
+    sse = np.zeros_like(level)
+    seen = np.zeros(n)
+
+    steps = np.cumsum(damping**np.arange(1, horizon + 1))
+    rows = np.arange(n)
+    stops = set(origins)
+    results = {}
+    for j in range(max(origins) + 1):
+        if j:
+            observed = valid[:, j] & (j > first)
+            pred = level + damping*trend
+            err = np.where(observed, y[:, j] - pred, 0.0)
+            level = pred + alpha*err
+            trend = damping*trend + alpha*beta*err
+            sse += err*err
+            seen += observed
+        if j in stops:
+            best = np.argmin(sse, axis=0)
+            p50 = level[best, rows][:, None] + trend[best, rows][:, None]*steps[None, :]
+            p50[first > j] = np.nan
+            results[j] = (p50, np.sqrt(sse[best, rows]/np.maximum(seen, 1)))
+    return [results[j] for j in origins]
+
+
+# Forecast rows (item_id, cycle, p10, p50, p90) of a pandas frame with
+# item_id, cycle and qd columns. Forecasts start after cycle end, the last
+# cycle of the dataset unless given, like those of Amazon Forecast.
+def forecast_frame(df, horizon, end=None):
+    if not len(df):
+        return pd.DataFrame({'item_id': [], 'cycle': [], 'p10': [], 'p50': [], 'p90': []})
+    codes, items = pd.factorize(df['item_id'])
+    cycle = df['cycle'].to_numpy(np.int64)
+    start = cycle.min()
+    end = cycle.max() if end is None else int(end)
+
+    y = np.full((len(items), end - start + 1), np.nan)
+    y[codes, cycle - start] = df['qd'].to_numpy(np.float64)
+    p50, sigma = damped_trend_forecast(y, horizon)
+
+    spread = P90_Z*sigma[:, None]*np.sqrt(np.arange(1, horizon + 1))[None, :]
+    return pd.DataFrame({
+        'item_id': np.repeat(np.asarray(items, dtype=object), horizon),
+        'cycle': np.tile(end + np.arange(1, horizon + 1), len(items)),
+        'p10': (p50 - spread).ravel(),
+        'p50': p50.ravel(),
+        'p90': (p50 + spread).ravel(),
+    })
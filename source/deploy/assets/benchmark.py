@@ -0,0 +1,188 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# Benchmark of the processing plugin and post processor steps on synthetic
+# fleets of increasing size, run with the local backend:
+#
+#   python benchmark.py --rows 10000 100000 1000000 --out bench.json
+#   python benchmark.py --rows 10000 100000 --baseline bench.json
+#
+# Every size runs in its own process so the peak memory is its own. The
+# Forecast export is stood in for by the test dataset itself. With
+# --baseline, a stage slower than the baseline by more than the tolerance
+# is reported and the exit code is 1.
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from instrumentation import InstrumentedBackend
+from local_backend import LocalBackend
+from pipeline_core import OUTPUT_FORMAT, OUTPUT_FORMATS, PipelineConfig, run_post_processing, run_processing
+from synthetic_fleet import fleet_for_rows
+
+BENCH_ROWS = [10_000, 100_000, 1_000_000]
+BENCH_CELLS = 8
+BENCH_CYCLES = 1000
+
+# Slowdown accepted before a stage counts as a regression
+TOLERANCE = 0.25
+
+# Stages faster than this are too noisy to compare
+MIN_STAGE_SECONDS = 0.05
+
+# Key of the raw dataset under the benchmark root
+RAW_KEY = 'bench/pipeline/raw_dataset.csv'
+
+
+# Stand-in for the Forecast export: p50 is the actual qd of the test dataset
+def write_forecast_export(root, base):
+    test = pd.read_csv(os.path.join(root, base, 'test_dataset.csv'), header=None, names=['date', 'item_id', 'qd'])
+    target = os.path.join(root, base, 'plot', 'predictions')
+    os.makedirs(target, exist_ok=True)
+    pd.DataFrame({
+        'item_id': test['item_id'],
+        'date': test['date'].str.replace(' ', 'T') + 'Z',
+        'p10': test['qd'] - 0.01,
+        'p50': test['qd'],
+        'p90': test['qd'] + 0.01,
+    }).to_csv(os.path.join(target, 'forecast_export_part0.csv'), index=False)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024*1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+# Both jobs on the raw dataset under root, in the current process
+def run_once(root, config):
+    base = RAW_KEY.rsplit('/', 1)[0]
+    backend = InstrumentedBackend(LocalBackend(root))
+
+    start = time.perf_counter()
+    run_processing(backend, RAW_KEY, config)
+    processing = time.perf_counter() - start
+
+    write_forecast_export(root, base)
+
+    start = time.perf_counter()
+    run_post_processing(backend, f"{base}/plot/predictions", config)
+    post = time.perf_counter() - start
+
+    return {
+        'processing_seconds': round(processing, 4),
+        'post_processing_seconds': round(post, 4),
+        'wall_seconds': round(processing + post, 4),
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': backend.summary(),
+    }
+
+
+# Generate a fleet of about rows rows, then benchmark it in a child process
+def run_size(rows, cells, cycles, seed, extra_args):
+    batteries = fleet_for_rows(rows, cells, cycles)
+    with tempfile.TemporaryDirectory() as root:
+        raw = os.path.join(root, RAW_KEY)
+        os.makedirs(os.path.dirname(raw))
+
+        here = os.path.dirname(os.path.abspath(__file__))
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(here, 'synthetic_fleet.py'),
+                        '--batteries', str(batteries), '--cells', str(cells), '--cycles', str(cycles),
+                        '--seed', str(seed), '--out', raw], check=True, stdout=subprocess.DEVNULL)
+        generated = time.perf_counter() - start
+
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-once', root] + extra_args,
+                               check=True, capture_output=True, text=True)
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+
+        with open(raw) as f:
+            actual_rows = sum(1 for _ in f) - 1
+
+    return {
+        'rows': actual_rows,
+        'batteries': batteries,
+        'cells': batteries*cells,
+        'mean_cycles': cycles,
+        'generate_seconds': round(generated, 4),
+        **result,
+    }
+
+
+# Stages and totals slower than in baseline, matched on the requested size
+def find_regressions(results, baseline, tolerance=TOLERANCE):
+    previous = {r['requested_rows']: r for r in baseline}
+    regressions = []
+    for res in results:
+        old = previous.get(res['requested_rows'])
+        if old is None:
+            continue
+        timings = [('wall', old['wall_seconds'], res['wall_seconds'])]
+        timings += [(name, old['stages'][name]['seconds'], stage['seconds'])
+                    for name, stage in res['stages'].items() if name in old['stages']]
+        for name, before, after in timings:
+            if max(before, after) >= MIN_STAGE_SECONDS and after > before*(1 + tolerance):
+                regressions.append(f"{res['requested_rows']} rows: {name} {before}s -> {after}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks both pipeline jobs on synthetic fleets")
+    parser.add_argument("--rows", type=int, nargs="+", default=BENCH_ROWS, help="approximate dataset sizes")
+    parser.add_argument("--cells", type=int, default=BENCH_CELLS, help="cells per battery")
+    parser.add_argument("--cycles", type=int, default=BENCH_CYCLES, help="mean cycle life")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the generator")
+    parser.add_argument("--single-pass", action="store_true", help="post process all splits in one pass")
+    parser.add_argument("--output-format", default=OUTPUT_FORMAT, choices=OUTPUT_FORMATS, help="format of the plot outputs")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="accepted slowdown, 0.25 = 25%%")
+    parser.add_argument("--run-once", metavar="ROOT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    extra_args = (['--single-pass'] if args.single_pass else []) + ['--output-format', args.output_format]
+    if args.run_once:
+        config = PipelineConfig(single_pass=args.single_pass, output_format=args.output_format)
+        result = run_once(args.run_once, config)
+        print(json.dumps(result))
+        return
+
+    results = []
+    for rows in args.rows:
+        res = {'requested_rows': rows, **run_size(rows, args.cells, args.cycles, args.seed, extra_args)}
+        print(f"{res['rows']} rows: {res['wall_seconds']}s, peak {res['peak_rss_mb']} MB")
+        results.append(res)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
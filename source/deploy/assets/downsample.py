@@ -0,0 +1,87 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# Largest-triangle-three-buckets (LTTB) downsampling of many series at once.
+#
+# Each series keeps its first and last point, and one point per bucket in
+# between: the one forming the largest triangle with the point kept in the
+# previous bucket and the average of the next bucket. Buckets are walked in
+# order, every step is vectorized over all series. Series with at most
+# n_out points are kept whole.
+
+import numpy as np
+
+
+# Indices of the points kept, for series stored one after the other in x
+# and y with the given lengths. x has to be sorted within each series.
+def lttb_indices(lengths, x, y, n_out):
+    lengths = np.asarray(lengths, dtype=np.int64)
+    starts = np.cumsum(lengths) - lengths
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+
+    short = lengths <= max(n_out, 2)
+    kept = [np.repeat(starts[short], lengths[short]) + _ranks(lengths[short])]
+
+    start, length = starts[~short], lengths[~short]
+    if len(start) and n_out > 2:
+        kept.extend(_lttb_long(start, length, x, y, n_out))
+    elif len(start):
+        kept.extend([start, start + length - 1])
+    return np.sort(np.concatenate(kept))
+
+
+# 0..n-1 for each length n, concatenated
+def _ranks(lengths):
+    total = int(lengths.sum())
+    return np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+
+def _lttb_long(start, length, x, y, n_out):
+    # Prefix sums for the bucket averages
+    csx = np.concatenate([[0.0], np.cumsum(x)])
+    csy = np.concatenate([[0.0], np.cumsum(y)])
+
+    # Edges of the n_out - 2 buckets between the first and last points
+    k = np.arange(n_out - 1)
+    edges = start[:, None] + 1 + (k[None, :]*(length[:, None] - 2)) // (n_out - 2)
+    last = start + length - 1
+    rows = np.arange(len(start))
+
+    prev = start
+    kept = [start]
+    for b in range(n_out - 2):
+        lo, hi = edges[:, b], edges[:, b + 1]
+        if b < n_out - 3:
+            nlo, nhi = edges[:, b + 1], edges[:, b + 2]
+        else:
+            nlo, nhi = last, last + 1
+        cx = (csx[nhi] - csx[nlo]) / (nhi - nlo)
+        cy = (csy[nhi] - csy[nlo]) / (nhi - nlo)
+
+        idx = lo[:, None] + np.arange((hi - lo).max())[None, :]
+        valid = idx < hi[:, None]
+        idx = np.where(valid, idx, lo[:, None])
+        ax, ay = x[prev][:, None], y[prev][:, None]
+        area = np.abs((ax - cx[:, None])*(y[idx] - ay) - (ax - x[idx])*(cy[:, None] - ay))
+        prev = idx[rows, np.argmax(np.where(valid, area, -1.0), axis=1)]
+        kept.append(prev)
+
+    kept.append(last)
+    return kept
+
+
+# Rows of a pandas frame kept by LTTB on (x, y), per value of key
+def downsample_frame(df, key, n_out, x='cycle', y='qd'):
+    df = df.sort_values([key, x], kind='stable')
+    lengths = df.groupby(key, sort=False).size().to_numpy()
+    return df.iloc[lttb_indices(lengths, df[x].to_numpy(), df[y].to_numpy(), n_out)]
@@ -0,0 +1,251 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# State of health (SOH) and remaining useful life (RUL) computed on whole
+# columns. The same formulas are available as NumPy kernels (plain pandas,
+# Arrow batches, pandas UDFs) and as native Spark column expressions.
+
+import numpy as np
+
+# Share of the original capacity left when a battery is considered dead
+EOL_FRACTION = 0.8
+
+# Decay model used for RUL, one of RUL_MODELS or FIT_RUL_MODEL
+RUL_MODEL = 'linear'
+
+# RUL read off the end of life cycle of each battery's fitted fade curve
+FIT_RUL_MODEL = 'fit'
+
+# Fade models of the capacity ratio r = qd/qd_orig over cycle n. Each one
+# is a straight line y = c0 + c1*x in its own coordinates, so every cell
+# of a fleet is fitted at once out of per group sums:
+#   linear       r = c0 + c1*n          x = n      y = r
+#   exponential  r = exp(c0 + c1*n)     x = n      y = ln(r)
+#   power        1 - r = exp(c0)*n^c1   x = ln(n)  y = ln(1 - r)
+FADE_MODELS = ('linear', 'exponential', 'power')
+
+
+def calc_soh(qd, qd_orig):
+    qd, qd_orig = np.asarray(qd, dtype=np.float64), np.asarray(qd_orig, dtype=np.float64)
+    return np.round(np.minimum(qd*100/qd_orig, 100.0), 2)
+
+
+# calculated assuming constant decay
+# Qd = Qd_orig - J*cycle
+def calc_rul(qd, cycle, qd_orig):
+    qd, cycle, qd_orig = _as_float(qd, cycle, qd_orig)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c_dead = cycle*(EOL_FRACTION*qd_orig - qd)/(qd - qd_orig)
+        rul = (c_dead - cycle)*100/c_dead
+    return np.where(qd == qd_orig, 100.0, np.round(np.minimum(rul, 100.0), 2))
+
+
+# calculated assuming logarithmic decay
+# Qd = Qd_orig * J^cycle
+def calc_rul2(qd, cycle, qd_orig):
+    qd, cycle, qd_orig = _as_float(qd, cycle, qd_orig)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c_dead = cycle*np.log(EOL_FRACTION*qd_orig/qd)/np.log(qd/qd_orig)
+        rul = (c_dead - cycle)*100/c_dead
+    return np.where(qd == qd_orig, 100.0, np.round(np.minimum(rul, 100.0), 2))
+
+
+# Cycle at which qd reaches EOL_FRACTION*qd_orig under a decay model, NaN
+# while no decay is seen:
+#   linear  cycle*(1 - EOL_FRACTION)*qd_orig/(qd_orig - qd)
+#   log     cycle*ln(EOL_FRACTION)/ln(qd/qd_orig)
+def calc_eol(qd, cycle, qd_orig, model=RUL_MODEL):
+    get_rul_model(model)
+    qd, cycle, qd_orig = _as_float(qd, cycle, qd_orig)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if model == 'linear':
+            eol = cycle*(1 - EOL_FRACTION)*qd_orig/(qd_orig - qd)
+        else:
+            eol = cycle*np.log(EOL_FRACTION)/np.log(qd/qd_orig)
+    return np.where(qd < qd_orig, eol, np.nan)
+
+
+# End of life cycle of a summary record: from its SOH (qd/qd_orig in %) for
+# the decay models, the fitted one for FIT_RUL_MODEL. Never before cycle.
+# None while no decay is seen, or once SOH is down to end of life.
+def calc_eol_cycle(cycle, soh, model=RUL_MODEL, fitted=None):
+    if soh is None or not np.isfinite(soh) or soh <= EOL_FRACTION*100 or soh >= 100:
+        return None
+    eol = fitted if model == FIT_RUL_MODEL else float(calc_eol(soh, cycle, 100.0, model))
+    if eol is None or not np.isfinite(eol):
+        return None
+    return int(round(max(eol, cycle)))
+
+
+RUL_MODELS = {
+    'linear': calc_rul,
+    'log': calc_rul2,
+}
+
+
+def _as_float(*arrays):
+    return [np.asarray(a, dtype=np.float64) for a in arrays]
+
+
+def get_rul_model(model):
+    if model not in RUL_MODELS:
+        raise ValueError(f"Unknown RUL model {model}, expected one of {list(RUL_MODELS) + [FIT_RUL_MODEL]}")
+    return RUL_MODELS[model]
+
+
+# RUL at cycle out of a fitted end of life cycle, 100 while no decay is seen
+def calc_fitted_rul(eol_cycle, cycle):
+    eol_cycle, cycle = _as_float(eol_cycle, cycle)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rul = (eol_cycle - cycle)*100/eol_cycle
+    return np.where(np.isnan(eol_cycle), 100.0, np.round(np.minimum(rul, 100.0), 2))
+
+
+# x, y and weights of a model's straight line. Log residuals are relative
+# ones, weighted by the squared value they are taken of so the fit stays
+# close to a least squares fit of the ratio itself.
+def _fade_coords(model, cycle, ratio):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if model == 'linear':
+            return cycle, ratio, np.ones_like(ratio)
+        if model == 'exponential':
+            return cycle, np.log(ratio), ratio*ratio
+        return np.log(cycle), np.log(1 - ratio), (1 - ratio)*(1 - ratio)
+
+
+# Capacity ratio of fitted fade models at cycle, element wise
+def fade_ratio(model, c0, c1, cycle):
+    model = np.asarray(model)
+    c0, c1, cycle = _as_float(c0, c1, cycle)
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        return np.select([model == 'linear', model == 'exponential'],
+                         [c0 + c1*cycle, np.exp(c0 + c1*cycle)], 1 - np.exp(c0)*cycle**c1)
+
+
+# Cycle at which fitted fade models reach EOL_FRACTION, NaN without decay
+def fade_eol_cycle(model, c0, c1):
+    model = np.asarray(model)
+    c0, c1 = _as_float(c0, c1)
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        eol = np.select([model == 'linear', model == 'exponential'],
+                        [(EOL_FRACTION - c0)/c1, (np.log(EOL_FRACTION) - c0)/c1],
+                        np.exp((np.log(1 - EOL_FRACTION) - c0)/c1))
+        decays = np.where(model == 'power', c1 > 0, c1 < 0) & (eol > 0) & np.isfinite(eol)
+    return np.where(decays, eol, np.nan)
+
+
+# Weighted least squares fit of every fade model to every group at once,
+# group holding codes 0..n_groups-1. Per model (c0, c1, rmse) arrays with
+# one entry per group, rmse measured on the ratio over all rows of a group.
+def fit_fade_models(group, cycle, ratio, n_groups):
+    group = np.asarray(group, dtype=np.int64)
+    cycle, ratio = _as_float(cycle, ratio)
+    rows = np.bincount(group, minlength=n_groups)
+
+    fits = {}
+    for model in FADE_MODELS:
+        x, y, w = _fade_coords(model, cycle, ratio)
+        ok = np.isfinite(x) & np.isfinite(y)
+        g, x, y, w = group[ok], x[ok], y[ok], w[ok]
+        n = np.bincount(g, w, n_groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Centered sums, cycles in the thousands would cancel otherwise
+            mx = np.bincount(g, w*x, n_groups)/n
+            my = np.bincount(g, w*y, n_groups)/n
+            dx, dy = x - mx[g], y - my[g]
+            c1 = np.bincount(g, w*dx*dy, n_groups)/np.bincount(g, w*dx*dx, n_groups)
+            c0 = my - c1*mx
+            resid = ratio - fade_ratio(model, c0[group], c1[group], cycle)
+            sse = np.bincount(group, np.nan_to_num(resid*resid, nan=np.inf, posinf=np.inf), n_groups)
+            fits[model] = (c0, c1, np.sqrt(sse/rows))
+    return fits
+
+
+# Model with the lowest rmse per group: (model, c0, c1, rmse, eol_cycle)
+def best_fade_fits(group, cycle, ratio, n_groups):
+    fits = fit_fade_models(group, cycle, ratio, n_groups)
+    rmse = np.stack([fits[m][2] for m in FADE_MODELS])
+    best = np.argmin(np.where(np.isnan(rmse), np.inf, rmse), axis=0)
+    c0, c1, rmse = [np.choose(best, [fits[m][i] for m in FADE_MODELS]) for i in range(3)]
+    model = np.array(FADE_MODELS, dtype=object)[best]
+    return model, c0, c1, rmse, fade_eol_cycle(model, c0, c1)
+
+
+# Fade fits of every cell and of every battery's average curve, as one
+# pandas frame with an empty cell on battery rows. Takes batt, cell,
+# cycle, qd, qd_orig (of the cell) and batt_qd_orig, for a whole fleet or
+# the cells of one battery in a grouped pandas UDF.
+def fade_fits(df):
+    import pandas as pd
+
+    batteries = df.groupby(['batt', 'cycle'], as_index=False).agg(qd=('qd', 'mean'), qd_orig=('batt_qd_orig', 'first'))
+    frames = []
+    for keys, frame in ((['batt', 'cell'], df), (['batt'], batteries)):
+        codes, groups = pd.MultiIndex.from_frame(frame[keys]).factorize()
+        ratio = frame['qd'].to_numpy(np.float64)/frame['qd_orig'].to_numpy(np.float64)
+        model, c0, c1, rmse, eol = best_fade_fits(codes, frame['cycle'], ratio, len(groups))
+        frames.append(groups.to_frame(index=False, name=keys).assign(
+            model=model, c0=c0, c1=c1, rmse=rmse, eol_cycle=eol,
+            points=np.bincount(codes, minlength=len(groups)).astype(np.int32),
+        ))
+    fits = pd.concat(frames, ignore_index=True)
+    fits['cell'] = fits['cell'].astype(object).where(fits['cell'].notna(), None)
+    return fits[['batt', 'cell', 'model', 'c0', 'c1', 'rmse', 'eol_cycle', 'points']]
+
+
+# Add soh and rul columns to a pandas frame with qd, cycle and qd_orig,
+# and eol_cycle for FIT_RUL_MODEL
+def add_health_metrics(df, model=RUL_MODEL):
+    if model == FIT_RUL_MODEL:
+        rul = calc_fitted_rul(df['eol_cycle'], df['cycle'])
+    else:
+        rul = get_rul_model(model)(df['qd'], df['cycle'], df['qd_orig'])
+    return df.assign(soh=calc_soh(df['qd'], df['qd_orig']), rul=rul)
+
+
+# Native Spark expressions for soh and rul, evaluated in the JVM
+def health_columns(qd, cycle, qd_orig, model=RUL_MODEL, eol_cycle=None):
+    from pyspark.sql import functions as F
+
+    soh = F.round(F.least(qd*100/qd_orig, F.lit(100.0)), 2)
+    if model == FIT_RUL_MODEL:
+        rul = F.round(F.least((eol_cycle - cycle)*100/eol_cycle, F.lit(100.0)), 2)
+        return soh, F.when(eol_cycle.isNull(), F.lit(100.0)).otherwise(rul)
+
+    get_rul_model(model)
+    qd_dead = EOL_FRACTION*qd_orig
+    if model == 'linear':
+        c_dead = cycle*(qd_dead - qd)/(qd - qd_orig)
+    else:
+        c_dead = cycle*F.log(qd_dead/qd)/F.log(qd/qd_orig)
+    rul = F.round(F.least((c_dead - cycle)*100/c_dead, F.lit(100.0)), 2)
+    rul = F.when(qd == qd_orig, F.lit(100.0)).otherwise(rul)
+    return soh, rul
+
+
+# Vectorized (Arrow batch) UDFs, for callers that prefer the NumPy kernels
+def health_pandas_udfs(model=RUL_MODEL):
+    from pyspark.sql.functions import pandas_udf
+    import pandas as pd
+
+    calc = get_rul_model(model)
+
+    @pandas_udf('double')
+    def soh_udf(qd: pd.Series, qd_orig: pd.Series) -> pd.Series:
+        return pd.Series(calc_soh(qd, qd_orig))
+
+    @pandas_udf('double')
+    def rul_udf(qd: pd.Series, cycle: pd.Series, qd_orig: pd.Series) -> pd.Series:
+        return pd.Series(calc(qd, cycle, qd_orig))
+
+    return soh_udf, rul_udf
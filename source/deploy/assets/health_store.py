@@ -0,0 +1,412 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# Read library over the post processed plot outputs of a pipeline.
+#
+# Battery (cycle, soh, rul, qd) and cell (cycle, qd) series are read by
+# battery, cell and cycle range, from CSV or Parquet outputs. Decoded
+# arrays are kept in a size bounded LRU cache. Every entry records the
+# version (ETag or mtime) of the objects it was decoded from, and the
+# listing of a split is refreshed after LISTING_TTL seconds, so outputs
+# rewritten by a pipeline are read again. Given the number of points a
+# viewport shows, series are read from the smallest downsampled level
+# holding at least that many points in the cycle range. Works against S3 or a local
+# directory standing in for the bucket, also as a small HTTP service:
+#
+#   python health_store.py --root ./bucket battery user/123 past b1 --start 100 --end 200
+#   python health_store.py --root ./bucket cell user/123 actual b1c1 --points 500
+#   python health_store.py --root ./bucket serve --port 8080
+#   curl 'localhost:8080/battery?pipeline=user/123&split=past&battery=b1&start=100&end=200&points=800'
+
+import argparse
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from pipeline_core import CELL_IDS_KEY, CELLS_PREFIX, LEVELS_PREFIX, SPLITS, STATS_PREFIX
+
+# Bytes of decoded arrays kept in memory
+CACHE_BYTES = 256*1024*1024
+
+# Seconds a split listing is trusted before objects are checked for changes
+LISTING_TTL = 5.0
+
+BATTERY_COLUMNS = ('cycle', 'soh', 'rul', 'qd')
+CELL_COLUMNS = ('cycle', 'qd')
+
+
+# Objects of a local directory standing in for the bucket
+class LocalSource:
+
+    def __init__(self, root):
+        self.root = root
+
+    # {key: version} of the objects under prefix, or of the object at it
+    def list(self, prefix):
+        versions = {}
+        target = os.path.join(self.root, prefix)
+        if os.path.isfile(target):
+            st = os.stat(target)
+            return {prefix: (st.st_mtime_ns, st.st_size)}
+        for dirpath, _, filenames in os.walk(target):
+            for f in filenames:
+                path = os.path.join(dirpath, f)
+                st = os.stat(path)
+                versions[os.path.relpath(path, self.root).replace(os.sep, '/')] = (st.st_mtime_ns, st.st_size)
+        return versions
+
+    def read(self, key):
+        with open(os.path.join(self.root, key), 'rb') as f:
+            return f.read()
+
+
+class S3Source:
+
+    def __init__(self, s3, bucket):
+        self.s3 = s3
+        self.bucket = bucket
+
+    def list(self, prefix):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        return {f['Key']: f['ETag'] for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix)
+                for f in page.get('Contents', [])}
+
+    def read(self, key):
+        return self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+
+# LRU cache of decoded arrays, bounded by their total size
+class ArrayCache:
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, arrays):
+        nbytes = sum(a.nbytes for a in arrays.values())
+        with self.lock:
+            self._drop(key)
+            if nbytes > self.max_bytes:
+                return
+            self.entries[key] = (version, arrays, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    # Drop the entries under prefix, and the dataset entries holding it
+    def invalidate(self, prefix=''):
+        with self.lock:
+            for key in [k for k in self.entries if k.startswith(prefix) or prefix.startswith(k)]:
+                self._drop(key)
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses}
+
+
+# Arrays of a CSV object, sorted by cycle. Cell files written by the
+# processing plugin name their cycle column cycle_no.
+def decode_csv(data, columns):
+    import pandas as pd
+
+    df = pd.read_csv(io.BytesIO(data)).rename(columns={'cycle_no': 'cycle'})
+    return sort_arrays({c: df[c].to_numpy() for c in columns if c in df.columns})
+
+
+def decode_parquet(blobs, columns):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.concat_tables([pq.read_table(io.BytesIO(data), columns=list(columns)) for data in blobs])
+    arrays = {c: table[c].to_numpy() for c in columns}
+    if 'cell' in arrays:
+        arrays['cell'] = arrays['cell'].astype(str)
+    return sort_arrays(arrays)
+
+
+# Cell names and battery IDs of a cell ID lookup, read as strings so IDs
+# like 01 keep their leading zero
+def decode_cell_ids(data):
+    import pandas as pd
+
+    df = pd.read_csv(io.BytesIO(data), usecols=['battery_name', 'batt'], dtype=str)
+    return {c: df[c].to_numpy() for c in ('battery_name', 'batt')}
+
+
+def sort_arrays(arrays):
+    cycle = arrays['cycle']
+    if len(cycle) and not np.all(cycle[:-1] <= cycle[1:]):
+        order = np.argsort(cycle, kind='stable')
+        arrays = {c: a[order] for c, a in arrays.items()}
+    return arrays
+
+
+# Rows with start <= cycle <= end, by binary search on the sorted cycles
+def cycle_range(arrays, start=None, end=None):
+    cycle = arrays['cycle']
+    lo = 0 if start is None else np.searchsorted(cycle, start, side='left')
+    hi = len(cycle) if end is None else np.searchsorted(cycle, end, side='right')
+    return {c: a[lo:hi] for c, a in arrays.items()}
+
+
+class HealthStore:
+
+    def __init__(self, source, max_bytes=CACHE_BYTES, listing_ttl=LISTING_TTL):
+        self.source = source
+        self.cache = ArrayCache(max_bytes)
+        self.listing_ttl = listing_ttl
+        self.listings = {}
+        self.lock = threading.Lock()
+
+    # {key: version} under the split, listed at most once per listing_ttl.
+    # Entries of objects gone from a fresh listing are dropped.
+    def _listing(self, pipeline, split):
+        if split not in SPLITS:
+            raise ValueError(f"Unknown split {split}, expected one of {SPLITS}")
+        prefix = f"{pipeline}/plot/{split}/"
+        with self.lock:
+            listed = self.listings.get(prefix)
+        if listed is not None and time.monotonic() - listed[0] < self.listing_ttl:
+            return prefix, listed[1]
+
+        versions = self.source.list(prefix)
+        with self.lock:
+            previous = self.listings.get(prefix)
+            self.listings[prefix] = (time.monotonic(), versions)
+        if previous is not None:
+            for key in set(previous[1]) - set(versions):
+                self.cache.invalidate(key)
+        return prefix, versions
+
+    # Battery ID of a cell in the pipeline's cell ID lookup, None if it is
+    # not in it. The lookup is listed at most once per listing_ttl.
+    def _cell_battery(self, pipeline, cell):
+        key = f"{pipeline}/{CELL_IDS_KEY}"
+        with self.lock:
+            listed = self.listings.get(key)
+        if listed is None or time.monotonic() - listed[0] >= self.listing_ttl:
+            listed = (time.monotonic(), self.source.list(key))
+            with self.lock:
+                self.listings[key] = listed
+        if key not in listed[1]:
+            return None
+
+        lookup = self.cache.get(key, listed[1][key])
+        if lookup is None:
+            lookup = decode_cell_ids(self.source.read(key))
+            self.cache.put(key, listed[1][key], lookup)
+        batt = lookup['batt'][lookup['battery_name'] == cell]
+        return batt[0] if len(batt) else None
+
+    # Decoded arrays of the objects under the first existing layout, cached
+    # under the layout's key with the versions of its objects
+    def _load(self, versions, csv_key, parquet_prefix, columns):
+        parts = sorted(k for k in versions if k.startswith(parquet_prefix) and k.endswith('.parquet'))
+        if parts:
+            version = tuple(versions[k] for k in parts)
+            arrays = self.cache.get(parquet_prefix, version)
+            if arrays is None:
+                arrays = decode_parquet([self.source.read(k) for k in parts], columns)
+                self.cache.put(parquet_prefix, version, arrays)
+            return arrays
+
+        if csv_key not in versions:
+            return None
+        arrays = self.cache.get(csv_key, versions[csv_key])
+        if arrays is None:
+            arrays = decode_csv(self.source.read(csv_key), columns)
+            self.cache.put(csv_key, versions[csv_key], arrays)
+        return arrays
+
+    # Battery IDs with SOH/RUL outputs in the split
+    def batteries(self, pipeline, split):
+        prefix, versions = self._listing(pipeline, split)
+        found = set()
+        for key in versions:
+            name = key[len(prefix):]
+            if name.startswith(f"{STATS_PREFIX}/batt="):
+                found.add(name.split('/')[1].split('=', 1)[1])
+            # Battery IDs have 2 characters, longer names are cell files
+            elif '/' not in name and name.endswith('.csv') and len(name) == len('b1.csv'):
+                found.add(name[:-len('.csv')])
+        return sorted(found)
+
+    # Downsampled levels of the split, as ascending numbers of points
+    def levels(self, pipeline, split):
+        prefix, versions = self._listing(pipeline, split)
+        level_prefix = f"{prefix}{LEVELS_PREFIX}/"
+        return sorted({int(k[len(level_prefix):].split('/', 1)[0]) for k in versions if k.startswith(level_prefix)})
+
+    # Range of the smallest level with at least points rows in it, or that
+    # kept the whole series. Full resolution when none does. Level CSV files
+    # sit in the dataset directory, those of the split do not.
+    def _resolve(self, pipeline, split, read, dataset, start, end, points):
+        prefix, versions = self._listing(pipeline, split)
+        if points is not None:
+            for n_out in self.levels(pipeline, split):
+                level = f"{prefix}{LEVELS_PREFIX}/{n_out}/"
+                arrays = read(versions, level, f"{level}{dataset}/")
+                if arrays is None:
+                    continue
+                selected = cycle_range(arrays, start, end)
+                if len(selected['cycle']) >= points or len(arrays['cycle']) < n_out:
+                    return selected
+        arrays = read(versions, prefix, prefix)
+        return None if arrays is None else cycle_range(arrays, start, end)
+
+    # {cycle, soh, rul, qd} of a battery, None if it has no outputs
+    def battery(self, pipeline, split, battery, start=None, end=None, points=None):
+        def read(versions, base, csv_dir):
+            return self._load(versions, f"{csv_dir}{battery}.csv", f"{base}{STATS_PREFIX}/batt={battery}/",
+                              BATTERY_COLUMNS)
+        return self._resolve(pipeline, split, read, STATS_PREFIX, start, end, points)
+
+    # {cycle, qd} of a cell, None if the split has no cell data for it.
+    # Parquet cells are partitioned by the battery of the cell ID lookup.
+    def cell(self, pipeline, split, cell, start=None, end=None, points=None):
+        def read(versions, base, csv_dir):
+            cells = f"{base}{CELLS_PREFIX}/"
+            batt = self._cell_battery(pipeline, cell) if any(k.startswith(cells) for k in versions) else None
+            arrays = self._load(versions, f"{csv_dir}{cell}.csv", f"{cells}batt={batt}/",
+                                CELL_COLUMNS + ('cell',))
+            if arrays is not None and 'cell' in arrays:
+                mask = arrays['cell'] == cell
+                arrays = {c: a[mask] for c, a in arrays.items() if c != 'cell'}
+            return arrays if arrays is not None and len(arrays['cycle']) else None
+        return self._resolve(pipeline, split, read, CELLS_PREFIX, start, end, points)
+
+    # Forget the listings and arrays under prefix, after a pipeline rewrote it
+    def invalidate(self, prefix=''):
+        with self.lock:
+            for key in [k for k in self.listings if k.startswith(prefix) or prefix.startswith(k)]:
+                del self.listings[key]
+        self.cache.invalidate(prefix)
+
+
+# JSON friendly copy of an arrays dict, NaN as null
+def to_json(arrays):
+    if arrays is None:
+        return None
+    return {c: [None if isinstance(v, float) and not np.isfinite(v) else v for v in a.tolist()]
+            for c, a in arrays.items()}
+
+
+def make_handler(store):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, code, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            q = {k: v[0] for k, v in parse_qs(url.query).items()}
+            try:
+                cycles = [int(q[k]) if k in q else None for k in ('start', 'end', 'points')]
+                if url.path == '/battery':
+                    body = to_json(store.battery(q['pipeline'], q['split'], q['battery'], *cycles))
+                elif url.path == '/cell':
+                    body = to_json(store.cell(q['pipeline'], q['split'], q['cell'], *cycles))
+                elif url.path == '/batteries':
+                    body = store.batteries(q['pipeline'], q['split'])
+                elif url.path == '/levels':
+                    body = store.levels(q['pipeline'], q['split'])
+                elif url.path == '/stats':
+                    body = store.cache.stats()
+                else:
+                    return self._send(404, {'error': f"Unknown path {url.path}"})
+            except (KeyError, ValueError) as err:
+                return self._send(400, {'error': str(err)})
+            self._send(200 if body is not None else 404, body)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/invalidate':
+                return self._send(404, {'error': f"Unknown path {url.path}"})
+            prefix = parse_qs(url.query).get('prefix', [''])[0]
+            store.invalidate(prefix)
+            self._send(200, {'invalidated': prefix})
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reads battery and cell series of post processed pipelines")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--root", help="directory standing in for the S3 bucket")
+    source.add_argument("--bucket", help="S3 bucket holding the pipelines")
+    parser.add_argument("--cache-mb", type=int, default=CACHE_BYTES // (1024*1024), help="size of the array cache")
+    parser.add_argument("--listing-ttl", type=float, default=LISTING_TTL, help="seconds a listing is trusted")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("battery", "cell"):
+        query = sub.add_parser(name, help=f"print the series of a {name}")
+        query.add_argument("pipeline")
+        query.add_argument("split", choices=SPLITS)
+        query.add_argument("id")
+        query.add_argument("--start", type=int, help="first cycle")
+        query.add_argument("--end", type=int, help="last cycle")
+        query.add_argument("--points", type=int, help="points shown, read from a downsampled level if enough")
+    serve = sub.add_parser("serve", help="serve queries over HTTP")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    if args.root:
+        src = LocalSource(args.root)
+    else:
+        import boto3
+        src = S3Source(boto3.client('s3'), args.bucket)
+    store = HealthStore(src, args.cache_mb*1024*1024, args.listing_ttl)
+
+    if args.command == "serve":
+        server = ThreadingHTTPServer((args.host, args.port), make_handler(store))
+        print(f"Serving on http://{args.host}:{args.port}")
+        server.serve_forever()
+    else:
+        read = store.battery if args.command == "battery" else store.cell
+        print(json.dumps(to_json(read(args.pipeline, args.split, args.id, args.start, args.end, args.points))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# Opt-in stage level instrumentation of a pipeline backend.
+#
+# Every backend call made by the pipeline steps is a stage. Per stage the
+# wall time, input and output rows and partitions, bytes under the output
+# path of writes, the move stats of writes staged by the backend and the
+# S3 API calls made by the backend's client are recorded, and a JSON
+# report is written under <pipeline>/reports/. The
+# report also counts the source scans each processing plan saved its
+# output branches.
+#
+# Spark frames are lazy: transforms take no time on their own and their
+# cost shows up in the stage running the next action (plan, save_data).
+# Row counts are off by default: they run their own Spark jobs, outside of
+# the timed region, and recompute every frame that isn't cached.
+
+import json
+import threading
+import time
+from dataclasses import asdict
+from datetime import datetime, timezone
+
+from pipeline_core import ProcessingPlan, Validation
+
+# Prefix under <pipeline>/ holding the run reports
+REPORTS_PREFIX = 'reports'
+
+
+class InstrumentedBackend:
+
+    def __init__(self, backend, count_rows=False, markers=False):
+        self.backend = backend
+        self.count_rows = count_rows
+        self.markers = markers
+        self.stages = []
+        self.plans = []
+        self.started = datetime.now(timezone.utc)
+        self._current = None
+        self._lock = threading.Lock()
+
+        s3 = getattr(backend, 's3', None)
+        if s3 is not None:
+            s3.meta.events.register('before-call.s3', self._count_s3_call)
+
+    def __getattr__(self, name):
+        attr = getattr(self.backend, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def instrumented(*args, **kwargs):
+            return self._run_stage(name, attr, args, kwargs)
+        instrumented.__name__ = name
+        return instrumented
+
+    def _count_s3_call(self, event_name, **kwargs):
+        operation = event_name.rsplit('.', 1)[-1]
+        with self._lock:
+            if self._current is not None:
+                calls = self._current['s3_calls']
+                calls[operation] = calls.get(operation, 0) + 1
+
+    def _frame_stats(self, objs):
+        stats = [self.backend.frame_stats(o.frame if isinstance(o, (ProcessingPlan, Validation)) else o) for o in objs]
+        stats = [s for s in stats if s is not None]
+        if not stats:
+            return None
+        return {
+            'rows': sum(s['rows'] for s in stats),
+            'partitions': sum(s['partitions'] for s in stats),
+        }
+
+    def _run_stage(self, name, fn, args, kwargs):
+        stage = {'stage': name, 's3_calls': {}}
+        if name in ('save_data', 'save_dataset'):
+            stage['path'] = args[1] if len(args) > 1 else kwargs['path']
+            stage['stage'] = f"{name}[{stage['path'].rstrip('/').split('/', 2)[-1]}]"
+        if self.count_rows:
+            stage['input'] = self._frame_stats(args)
+        if self.markers:
+            self.backend.mark_stage(stage['stage'])
+
+        with self._lock:
+            self._current = stage
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            stage['seconds'] = round(time.perf_counter() - start, 4)
+            with self._lock:
+                self._current = None
+            if self.markers:
+                self.backend.mark_stage(None)
+            self.stages.append(stage)
+
+        if isinstance(result, ProcessingPlan):
+            self.plans.append(result)
+        if self.count_rows:
+            stage['output'] = self._frame_stats([result])
+        if 'path' in stage:
+            stage['bytes_written'] = self.backend.stored_bytes(stage['path'])
+            if isinstance(result, dict):
+                stage['finalize'] = result
+        return result
+
+    # Time and calls per stage name, over every call of the stage
+    def summary(self):
+        totals = {}
+        for s in self.stages:
+            total = totals.setdefault(s['stage'], {'calls': 0, 'seconds': 0.0, 's3_calls': 0})
+            total['calls'] += 1
+            total['seconds'] = round(total['seconds'] + s['seconds'], 4)
+            total['s3_calls'] += sum(s['s3_calls'].values())
+        return totals
+
+    def report(self, job, config=None):
+        return {
+            'job': job,
+            'started': self.started.isoformat(),
+            'wall_seconds': round((datetime.now(timezone.utc) - self.started).total_seconds(), 4),
+            'config': asdict(config) if config is not None else None,
+            'stages': self.stages,
+            'summary': self.summary(),
+            'plans': [plan.scan_report() for plan in self.plans],
+        }
+
+    # Write the report to <pipeline>/reports/<job>-<start time>.json
+    def write_report(self, pipeline, job, config=None):
+        key = f"{pipeline}/{REPORTS_PREFIX}/{job}-{self.started.strftime('%Y%m%dT%H%M%SZ')}.json"
+        self.backend.write_text(key, json.dumps(self.report(job, config), indent=2))
+        print(f"Run report written to {key}")
+        return key
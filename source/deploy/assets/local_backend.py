@@ -0,0 +1,798 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# pandas/NumPy implementation of the pipeline backend.
+#
+# A local directory stands in for the S3 bucket, keys map to paths below it:
+#
+#   python local_backend.py --root ./bucket process user/123/raw_dataset.csv
+#   python local_backend.py --root ./bucket stream user/123/raw
+#   python local_backend.py --root ./bucket forecast user/123
+#   python local_backend.py --root ./bucket post user/123/plot/predictions
+
+import argparse
+import logging
+import os
+import shutil
+import time
+from uuid import uuid4
+
+import numpy as np
+import pandas as pd
+
+from anomalies import module_anomalies
+from backtest import backtest_metrics
+from baseline_forecast import forecast_frame
+from downsample import downsample_frame
+from health_metrics import FIT_RUL_MODEL, RUL_MODEL, RUL_MODELS, add_health_metrics, calc_soh, fade_fits
+from instrumentation import InstrumentedBackend
+from rollups import rollup_frame
+from pipeline_core import (
+    ANOMALY_WINDOW,
+    FORECAST_OUTPUT_PREFIX,
+    PIPELINE_WORKERS,
+    CELL_IDS_SCHEMA,
+    DOWNSAMPLE_LEVELS,
+    FREQUENCY,
+    HASH_MIX,
+    HASH_SHIFTS,
+    INIT_YEAR,
+    LOCATIONS_KEY,
+    OUTPUT_FORMAT,
+    OUTPUT_FORMATS,
+    QUALITY_REPORT_SCHEMA,
+    RAW_SCHEMA,
+    RAW_STREAM_SCHEMA,
+    REPAIR_GAPS,
+    BACKTEST_ORIGINS,
+    SAMPLING_SEED,
+    STREAM_CHECKPOINT_PREFIX,
+    STREAM_INTERVAL,
+    STREAM_MAX_FILES,
+    TABLE_TYPES,
+    UNKNOWN_SITE,
+    Backend,
+    Baseline,
+    FadeFits,
+    PipelineConfig,
+    ProcessingPlan,
+    Validation,
+    parse_schema,
+    frequency_step,
+    forecast_output_path,
+    run_baseline_forecast,
+    run_micro_batch,
+    run_post_processing,
+    run_pipelines,
+    run_processing,
+    hash_offset,
+    sampled_cells,
+)
+
+
+# Step numbers -> Forecast timestamp strings, vectorized with datetime64
+def cycles_to_dates(cycles, init_year, frequency):
+    seconds, months = frequency_step(frequency)
+    steps = np.asarray(cycles, dtype=np.int64) - 1
+    if months:
+        ts = np.datetime64(f"{init_year}-01", 'M') + steps*months
+    else:
+        ts = np.datetime64(f"{init_year}-01-01T00:00:00", 's') + steps*seconds
+    if not len(ts):
+        return np.array([], dtype=str)
+    return np.char.replace(np.datetime_as_string(ts.astype('datetime64[s]'), unit='s'), 'T', ' ')
+
+
+# Forecast timestamp strings (2000-01-01T00:00:00Z) -> step numbers
+def dates_to_cycles(dates, init_year, frequency):
+    seconds, months = frequency_step(frequency)
+    ts = pd.to_datetime(pd.Series(dates).str[:19].str.replace('T', ' '), format='%Y-%m-%d %H:%M:%S')
+    if months:
+        total = (ts.dt.year - init_year)*12 + ts.dt.month - 1
+        return (total // months + 1).to_numpy(dtype=np.int64)
+    delta = (ts - pd.Timestamp(init_year, 1, 1)).dt.total_seconds()
+    return (np.round(delta / seconds) + 1).to_numpy(dtype=np.int64)
+
+
+# Seeded SplitMix64 hash of cell IDs, as signed 64 bit integers so the
+# ranking matches cell_hash_col of the Spark backend
+def cell_hash(cell_ids, seed):
+    z = np.asarray(cell_ids).astype(np.uint64) + np.uint64(hash_offset(seed))
+    for shift, mix in zip(HASH_SHIFTS, HASH_MIX):
+        z = (z ^ (z >> np.uint64(shift))) * np.uint64(mix)
+    z = z ^ (z >> np.uint64(HASH_SHIFTS[-1]))
+    return z.view(np.int64)
+
+
+class LocalBackend(Backend):
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    # Files read directly under a prefix, mirrors Glue's non recursive read
+    def _list_csv(self, key, recurse):
+        path = self.path(key)
+        if os.path.isfile(path):
+            return [path]
+
+        files = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            files.extend(os.path.join(dirpath, f) for f in sorted(filenames) if f.endswith('.csv'))
+            if not recurse:
+                break
+        return files
+
+    def _csv_frame(self, key, recurse, files=None):
+        frames = []
+        for f in files or self._list_csv(key, recurse):
+            df = pd.read_csv(f, dtype=str)
+            df['source_file'] = f
+            frames.append(df)
+        return pd.concat(frames, ignore_index=True)
+
+    def read_raw(self, key):
+        return self._csv_frame(key, True)
+
+    # Raw files without their header, as RAW_STREAM_SCHEMA columns; columns
+    # past them are dropped like Spark's CSV reader does
+    def read_raw_stream(self, files):
+        columns = [name for name, _ in parse_schema(RAW_STREAM_SCHEMA)]
+        frames = []
+        for f in files:
+            df = pd.read_csv(f, header=None, dtype=str).reindex(columns=range(len(columns)))
+            df.columns = columns
+            df['source_file'] = f
+            frames.append(df)
+        return pd.concat(frames, ignore_index=True)
+
+    def read_frame(self, key, files=None):
+        if files is None:
+            return self._csv_frame(key, False)
+        return self._csv_frame(key, False, [self.path(f) for f in files])
+
+    def list_files(self, key):
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return []
+        return [f"{key}/{f}" for f in sorted(os.listdir(path))
+                if f.endswith('.csv') and os.path.isfile(os.path.join(path, f))]
+
+    def delete(self, keys):
+        for key in keys:
+            os.remove(self.path(key))
+
+    def read_cells(self, key, ids, cells=None):
+        if cells is None:
+            return self.with_cell_keys(self.read_frame(key), ids)
+
+        files = [self.path(f"{key}/{cell}.csv") for cell in cells]
+        files = [f for f in files if os.path.isfile(f)]
+        return self.with_cell_keys(self._csv_frame(key, False, files), ids) if files else None
+
+    def read_splits(self, base_path, keys, ids, cells=None):
+        frames = [self.read_cells(f"{base_path}/{key}", ids, cells) for key in keys]
+        return pd.concat([df.assign(split=key) for key, df in zip(keys, frames) if df is not None],
+                         ignore_index=True)
+
+    def select_split(self, df, key):
+        return df[df['split'] == key].drop(columns='split')
+
+    # Partition values of a hive partitioned dataset directory
+    def _partitions(self, target, partition_key):
+        if not os.path.isdir(target):
+            return set()
+        prefix = f"{partition_key}="
+        return {d[len(prefix):] for d in os.listdir(target) if d.startswith(prefix)}
+
+    def read_dataset(self, path, schema, partition_key, partitions=None, cells=None):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        target = self.path(path)
+        found = self._partitions(target, partition_key)
+        if partitions is not None:
+            found = found.intersection(partitions)
+        if not found:
+            return None
+
+        # Partition values are kept as strings, battery IDs can be digits
+        partitioning = ds.partitioning(pa.schema([(partition_key, pa.string())]), flavor='hive')
+        dataset = ds.dataset(target, format='parquet', partitioning=partitioning)
+        row_filter = ds.field(partition_key).isin(sorted(found)) if partitions is not None else None
+        if cells is not None:
+            cell_filter = ds.field('cell').isin(list(cells))
+            row_filter = cell_filter if row_filter is None else row_filter & cell_filter
+
+        dtypes = {name: TABLE_TYPES[kind] for name, kind in parse_schema(schema)}
+        table = dataset.to_table(columns=list(dtypes) + [partition_key], filter=row_filter)
+        return table.to_pandas().astype({**dtypes, partition_key: object})
+
+    def read_datasets(self, paths, schema, partition_key):
+        frames = [self.read_dataset(path, schema, partition_key) for path in paths.values()]
+        return pd.concat([df.assign(split=key) for key, df in zip(paths, frames) if df is not None],
+                         ignore_index=True)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def read_table(self, key, schema, header=True):
+        dtypes = {name: TABLE_TYPES[kind] for name, kind in parse_schema(schema)}
+        if not header:
+            return pd.read_csv(self.path(key), dtype=dtypes, header=None, names=list(dtypes))
+        return pd.read_csv(self.path(key), dtype=dtypes)[list(dtypes)]
+
+    def write_text(self, key, text):
+        target = self.path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'w') as f:
+            f.write(text)
+
+    def read_text(self, key):
+        target = self.path(key)
+        if not os.path.isfile(target):
+            return None
+        with open(target) as f:
+            return f.read()
+
+    def stored_bytes(self, key):
+        path = self.path(key)
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+    def frame_stats(self, obj):
+        if not isinstance(obj, pd.DataFrame):
+            return None
+        return {'rows': len(obj), 'partitions': 1}
+
+    def save_data(self, frame, path, partition_key=None, header=None, replace=False, sort_key=None,
+                  append=False):
+        header = bool(partition_key) if header is None else header
+        if sort_key:
+            frame = frame.sort_values(sort_key, kind='stable')
+        target = self.path(path)
+
+        if replace:
+            for f in self._list_csv(path, False):
+                os.remove(f)
+
+        if not partition_key:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            self._write_csv(frame, target, header, append)
+            return
+
+        os.makedirs(target, exist_ok=True)
+        columns = [c for c in frame.columns if c != partition_key]
+        for p_id, part in frame.groupby(partition_key, sort=False):
+            self._write_csv(part[columns], os.path.join(target, f"{p_id}.csv"), header, append)
+
+    def save_dataset(self, frame, path, schema, partition_key, replace=False, sort_key=None, append=False):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        dtypes = {name: TABLE_TYPES[kind] for name, kind in parse_schema(schema)}
+        if sort_key:
+            frame = frame.sort_values(sort_key, kind='stable')
+        frame = frame[list(dtypes) + [partition_key]].astype(dtypes)
+
+        target = self.path(path)
+        if replace and os.path.isdir(target):
+            shutil.rmtree(target)
+
+        # Appended files get a name of their own, otherwise the partitions
+        # written replace their previous files
+        ds.write_dataset(
+            pa.Table.from_pandas(frame, preserve_index=False), target, format='parquet',
+            partitioning=[partition_key], partitioning_flavor='hive',
+            basename_template=f"part-{uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior='overwrite_or_ignore' if append else 'delete_matching',
+        )
+
+    def cell_frame(self, df, cell_column, ids):
+        cell = df[cell_column]
+        return pd.DataFrame({'cell': cell, 'batt': self.cell_batts(cell, ids), 'cycle': df['cycle_no'],
+                             'qd': df['qd']})
+
+    # Appending to an existing file never repeats its header
+    def _write_csv(self, frame, target, header, append):
+        if append and os.path.exists(target):
+            frame.to_csv(target, mode='a', header=False, index=False)
+        else:
+            frame.to_csv(target, header=header, index=False)
+
+    def get_cutoff(self, df, config):
+        # Exact quantile returning a member of the data, like approxQuantile(..., 0)
+        return float(np.quantile(df['cycle_life'], config.quantile_cutoff, method='inverted_cdf'))
+
+    # Cells with every cycle of the forecast horizon, ranked by seeded hash
+    # within their battery, lowest ranks kept
+    def get_test_set(self, df, cutoff, config):
+        horizon = df[(df['cycle_no'] > cutoff) & (df['cycle_no'] <= cutoff + config.forecast_horizon)]
+        counts = horizon.groupby(['cell_id', 'batt_id'], sort=False)['cycle_no'].nunique()
+        poss_cells = counts[counts == config.forecast_horizon].reset_index()[['cell_id', 'batt_id']]
+        if config.sampling:
+            poss_cells = poss_cells.assign(rank=cell_hash(poss_cells['cell_id'], config.sampling_seed)) \
+                .sort_values(['batt_id', 'rank', 'cell_id'], kind='stable')
+            poss_cells = poss_cells[poss_cells.groupby('batt_id').cumcount() < config.cells_per_battery]
+        return sampled_cells(list(zip(poss_cells['cell_id'], poss_cells['batt_id'])), config)
+
+    # Rows sorted once by cell, cycle and range check: repeated cycles, gaps
+    # and the rows filling them are vectorized over all cells
+    def validate(self, df, config):
+        qd_min, qd_max = config.qd_range
+        cycle = pd.to_numeric(df['cycle_no'], errors='coerce').to_numpy(float)
+        life = pd.to_numeric(df['cycle_life'], errors='coerce').to_numpy(float)
+        qd = pd.to_numeric(df['QD'], errors='coerce').to_numpy(np.float32)
+        invalid = np.isnan(cycle) | np.isnan(life)
+        rows = pd.DataFrame({
+            'battery_name': df['battery_name'].to_numpy(object),
+            'cycle_no': cycle,
+            'cycle_life': life,
+            'QD': qd,
+            'invalid': invalid,
+            'out_of_range': ~invalid & ~((qd > qd_min) & (qd <= qd_max)),
+        })
+        cells = rows.groupby('battery_name', sort=False)
+        rows['unordered'] = (cells['cycle_no'].shift() >= rows['cycle_no']).to_numpy()
+
+        # In range rows come first among those of a cycle, later ones repeat it
+        rows = rows.sort_values(['battery_name', 'cycle_no', 'out_of_range'], kind='stable', na_position='first')
+        same = (rows['battery_name'] == rows['battery_name'].shift()) & (rows['cycle_no'] == rows['cycle_no'].shift())
+        rows['duplicates'] = same & ~rows['invalid'] & ~rows['out_of_range']
+        valid = rows[~(rows['invalid'] | rows['out_of_range'] | rows['duplicates'])].copy()
+        by_cell = valid.groupby('battery_name', sort=False)
+        valid['gap'] = by_cell['cycle_no'].shift(-1) - valid['cycle_no']
+        valid['next_qd'] = by_cell['QD'].shift(-1)
+        fill = (valid['gap'] > 1) & (valid['gap'] <= config.repair_gaps + 1)
+        valid['filled'] = np.where(fill, valid['gap'] - 1, 0)
+
+        flags = rows.groupby('battery_name', sort=True)
+        lives = rows[~rows['invalid']].groupby('battery_name')['cycle_life']
+        spans = valid.groupby('battery_name').agg(
+            valid=('cycle_no', 'size'), first=('cycle_no', 'min'), last=('cycle_no', 'max'),
+            max_gap=('gap', 'max'), filled=('filled', 'sum'),
+        )
+        report = pd.DataFrame({
+            'rows': flags.size(),
+            'invalid': flags['invalid'].sum(),
+            'duplicates': flags['duplicates'].sum(),
+            'unordered': flags['unordered'].sum(),
+            'out_of_range': flags['out_of_range'].sum(),
+        }).join(spans).join(lives.min().rename('life_min')).join(lives.max().rename('life_max'))
+        report = report.fillna({'valid': 0, 'first': 0, 'last': -1, 'max_gap': 1, 'filled': 0})
+        span = report['last'] - report['first'] + 1
+        report['missing'] = (span - report['valid']).clip(lower=0)
+        report['max_gap'] = (report['max_gap'] - 1).clip(lower=0)
+
+        bad = (report['life_min'] != report['life_max']) | (report['valid'] < config.min_valid_rows) \
+            | (report['missing'] > config.max_missing_share*span)
+        report['status'] = np.select([bad, report['filled'] > 0], ['quarantined', 'repaired'], 'ok')
+        report['filled'] = report['filled'].where(~bad, 0)
+        columns = [name for name, _ in parse_schema(QUALITY_REPORT_SCHEMA)]
+        report = report.reset_index().rename(columns={'index': 'battery_name'})
+        report = report[columns].astype({c: np.int32 for c in columns[1:-1]})
+
+        # Rows of the kept cells, with cycle k of a gap at QD + (next - QD)*k/gap
+        quarantined = report.loc[report['status'] == 'quarantined', 'battery_name']
+        valid = valid[~valid['battery_name'].isin(quarantined)]
+        gaps = valid[valid['filled'] > 0]
+        counts = gaps['filled'].to_numpy(np.int64)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+        gaps = gaps.iloc[np.repeat(np.arange(len(gaps)), counts)]
+        qd = gaps['QD'].to_numpy(float)
+        filled = pd.DataFrame({
+            'battery_name': gaps['battery_name'].to_numpy(),
+            'cycle_no': gaps['cycle_no'].to_numpy() + k,
+            'cycle_life': gaps['cycle_life'].to_numpy(),
+            'QD': (qd + (gaps['next_qd'].to_numpy(float) - qd)*k/gaps['gap'].to_numpy()).astype(np.float32),
+        })
+        frame = pd.concat([valid[filled.columns], filled], ignore_index=True) \
+            .astype({'cycle_no': np.int32, 'cycle_life': np.int32, 'QD': np.float32})
+
+        statuses = report['status'].value_counts().to_dict()
+        quarantine = df.loc[df['battery_name'].isin(quarantined), ['battery_name', 'cycle_no', 'cycle_life', 'QD']]
+        return Validation(frame, report, quarantine, statuses)
+
+    def calc_cell_ids(self, df, ids=None):
+        dtypes = {name: TABLE_TYPES[kind] for name, kind in parse_schema(CELL_IDS_SCHEMA)}
+        if ids is None:
+            ids = pd.DataFrame({name: pd.Series(dtype=kind) for name, kind in dtypes.items()})
+
+        # Sorted names of the cells and batteries not in ids yet
+        cells = np.setdiff1d(df['battery_name'].unique().astype(object), ids['battery_name'].to_numpy(object))
+        batt = pd.Series(cells, dtype=object).str[:2]
+        known = ids.drop_duplicates('batt').set_index('batt')['batt_id']
+        batts = np.setdiff1d(batt.unique().astype(object), known.index.to_numpy(object))
+        batt_ids = pd.concat([known, pd.Series(np.arange(len(batts)) + (known.max() + 1 if len(known) else 0),
+                                               index=batts)])
+
+        fresh = pd.DataFrame({
+            'cell_id': np.arange(len(cells)) + (ids['cell_id'].max() + 1 if len(ids) else 0),
+            'battery_name': cells,
+            'batt_id': batt.map(batt_ids).to_numpy(),
+            'batt': batt.to_numpy(),
+        })
+        return pd.concat([ids, fresh], ignore_index=True).astype(dtypes)
+
+    def convert_ts(self, df, config, ids):
+        # Position of each row's cell in ids
+        pos = pd.Categorical(df['battery_name'], categories=ids['battery_name']).codes
+        df = pd.DataFrame({
+            'cell_id': ids['cell_id'].to_numpy()[pos],
+            'batt_id': ids['batt_id'].to_numpy()[pos],
+            'cycle_no': df['cycle_no'].astype(float).astype(np.int32),
+            'cycle_life': df['cycle_life'].astype(float).astype(np.int32),
+            'qd': df['QD'].astype(np.float32),
+        })
+        return df.sort_values(['cycle_no', 'cell_id'], kind='stable', ignore_index=True)
+
+    def plan(self, df, config, ids):
+        cutoff = self.get_cutoff(df, config)
+        return ProcessingPlan(df, cutoff, self.get_test_set(df, cutoff, config), ids=ids)
+
+    def plan_incremental(self, df, manifest, config, ids, advance=False):
+        cell_ids = manifest['battery_name'].map(ids.set_index('battery_name')['cell_id'])
+        marks = pd.Series(manifest['last_cycle'].to_numpy(), index=cell_ids)
+        cuts = pd.Series(manifest['cutoff'].to_numpy(np.float64), index=cell_ids)
+        test_set = list(cell_ids[manifest['test'] == 1])
+        cutoff = float(cuts.min())
+        cutoffs = cuts[cuts > cutoff].to_dict()
+
+        moved = None
+        if advance:
+            last = df[df['cell_id'].isin(test_set)].groupby('cell_id')['cycle_no'].max()
+            ahead = (last - config.forecast_horizon).astype(np.float64)
+            ahead = ahead[ahead > cuts.reindex(ahead.index)]
+            # Rows of a moved cell start at its previous cutoff
+            marks = marks.astype(np.float64)
+            marks[ahead.index] = cuts[ahead.index]
+            cutoffs.update(ahead.to_dict())
+            moved = list(ahead.index)
+
+        last = df['cell_id'].map(marks)
+        df = df[last.isna() | (df['cycle_no'] > last)]
+        return ProcessingPlan(df, cutoff, test_set, complete=False, ids=ids, cutoffs=cutoffs, moved=moved)
+
+    def calc_manifest(self, plan, manifest=None):
+        marks = plan.frame.groupby('cell_id', as_index=False)['cycle_no'].max() \
+            .rename(columns={'cycle_no': 'last_cycle'})
+        marks = self.with_names(marks, plan).assign(
+            test=marks['cell_id'].isin(plan.test_set).astype(int).to_numpy(),
+            cutoff=self.cell_cutoffs(marks, plan),
+            updated=1,
+        )
+        if manifest is not None:
+            kept = manifest[~manifest['battery_name'].isin(marks['battery_name'])].assign(updated=0)
+            marks = pd.concat([kept, marks], ignore_index=True)
+        return marks[['battery_name', 'last_cycle', 'test', 'cutoff', 'updated']]
+
+    def new_cell_ids(self, lookup, ids):
+        return lookup[~lookup['cell_id'].isin(ids['cell_id'])]
+
+    def cell_batteries(self, ids, cells):
+        return sorted(ids.loc[ids['battery_name'].isin(list(cells)), 'batt'].unique())
+
+    def affected_cells(self, manifest, ids):
+        batt = pd.Series(self.cell_batts(manifest['battery_name'], ids), index=manifest.index)
+        updated = batt[manifest['updated'] == 1].unique()
+        return list(manifest.loc[(manifest['test'] == 1) & batt.isin(updated), 'battery_name'])
+
+    def merge_baseline(self, old, fresh):
+        def merge(a, b, keys):
+            kept = a.merge(b[keys], on=keys, how='left', indicator=True)
+            kept = kept[kept['_merge'] == 'left_only'].drop(columns='_merge')
+            return pd.concat([kept, b], ignore_index=True)
+        return type(old)(merge(old.batteries, fresh.batteries, ['batt']),
+                         merge(old.cells, fresh.cells, ['batt', 'cell']))
+
+    # Cutoff of the cell of each row
+    def cell_cutoffs(self, df, plan):
+        if not plan.cutoffs:
+            return np.full(len(df), float(plan.cutoff))
+        return df['cell_id'].map(plan.cutoffs).fillna(plan.cutoff).to_numpy(np.float64)
+
+    # Cell names in place of cell IDs, keeping the row order
+    def with_names(self, df, plan):
+        names = plan.ids.set_index('cell_id')['battery_name']
+        return df.assign(battery_name=df['cell_id'].map(names).to_numpy())
+
+    # Cycle numbers for the plots, timestamps for the Forecast datasets
+    def to_output(self, df, plan, config, plot_data):
+        df = self.with_names(df, plan)
+        if plot_data:
+            return df[['cycle_no', 'battery_name', 'qd']]
+        dates = cycles_to_dates(df['cycle_no'], config.init_year, config.frequency)
+        return df.assign(date=dates)[['date', 'battery_name', 'qd']]
+
+    def extract_train(self, plan, config, plot_data):
+        df = plan.frame
+
+        if plot_data:
+            df = df[df['cell_id'].isin(plan.test_set)]
+
+        df_train = df[df['cycle_no'] <= self.cell_cutoffs(df, plan)]
+        return self.to_output(df_train, plan, config, plot_data)
+
+    def extract_test(self, plan, config, plot_data):
+        df = plan.frame
+
+        df_test = df[df['cell_id'].isin(plan.test_set)]
+        cutoff = self.cell_cutoffs(df_test, plan)
+        df_test = df_test[(df_test['cycle_no'] > cutoff) & (df_test['cycle_no'] <= cutoff + config.forecast_horizon)]
+
+        return self.to_output(df_test, plan, config, plot_data)
+
+    def extract_ids(self, plan):
+        return plan.ids.loc[plan.ids['cell_id'].isin(plan.test_set), ['battery_name']]
+
+    def convert_forecasts(self, df, config):
+        cycles = dates_to_cycles(df['date'], config.init_year, config.frequency)
+        df = df.assign(cycle_no=cycles).rename(columns={'p50': 'qd'})
+        df = df.sort_values(['item_id', 'cycle_no'], kind='stable', ignore_index=True)
+        return df[['item_id', 'cycle_no', 'qd']]
+
+    def baseline_forecast(self, df, ids, config, cell_ids):
+        df = df[df['item_id'].isin(ids['item_id'])]
+        df = df.assign(cycle=dates_to_cycles(df['date'], config.init_year, config.frequency))
+        df = forecast_frame(df, config.forecast_horizon)
+        dates = cycles_to_dates(df['cycle'], config.init_year, config.frequency)
+        dates = np.char.add(np.char.replace(dates, ' ', 'T'), 'Z')
+        return df.assign(date=dates)[['item_id', 'date', 'p10', 'p50', 'p90']]
+
+    def backtest(self, frames, config):
+        df = pd.concat([df.assign(split=key) for key, df in frames.items() if df is not None], ignore_index=True)
+        return backtest_metrics(df, config.forecast_horizon, config.backtest_origins, config.rul_model)
+
+    def anomalies(self, df, ids, config):
+        cells = ids.groupby('batt')['cell_id']
+        modules = pd.DataFrame({
+            'cell_id': ids['cell_id'],
+            'batt': ids['batt'],
+            'cell': ids['battery_name'],
+            'module': cells.rank(method='first').astype(int),
+            'modules': cells.transform('size'),
+        })
+        df = pd.DataFrame({'cell_id': df['cell_id'], 'cycle': df['cycle_no'], 'qd': df['qd'].astype(np.float64)})
+        return module_anomalies(df.merge(modules, on='cell_id'), config.anomaly_window)
+
+    def module_statuses(self, df):
+        return list(zip(df['batt'], df['modules'], df['module'], df['status']))
+
+    def raw_by_name(self, df):
+        names = [name for name, _ in parse_schema(RAW_SCHEMA)]
+        positions = [name for name, _ in parse_schema(RAW_STREAM_SCHEMA)][:len(names)]
+        values = df[positions].to_numpy(object)
+        labels = df[positions].fillna('').to_numpy(str)
+        is_header = (np.sort(labels, axis=1) == sorted(names)).all(axis=1) & df.iloc[:, len(names)].isna().to_numpy()
+
+        headers = pd.DataFrame(labels[is_header], index=df['source_file'][is_header]).groupby(level=0).first()
+        keep = ~is_header & df['source_file'].isin(headers.index).to_numpy()
+        header = headers.loc[df['source_file'][keep]].to_numpy(str)
+        rows = np.arange(len(header))
+        out = pd.DataFrame({name: values[keep][rows, np.argmax(header == name, axis=1)] for name in names})
+        out['source_file'] = df['source_file'][keep].to_numpy()
+
+        files = df['source_file'].unique()
+        return out, [f for f in files if f in headers.index], [f for f in files if f not in headers.index]
+
+    # Fade fits only cover the test cells, live RUL uses the default model
+    def update_live(self, plan, state, config):
+        model = RUL_MODEL if config.rul_model == FIT_RUL_MODEL else config.rul_model
+        df = self.with_names(plan.frame, plan).sort_values('cycle_no', kind='stable')
+        cells = df.groupby('battery_name', sort=True)
+        df = pd.DataFrame({
+            'qd_first': cells['qd'].first().astype(np.float64),
+            'cycle': cells['cycle_no'].last(),
+            'qd': cells['qd'].last().astype(np.float64),
+        }).reset_index()
+
+        qd_orig = df['qd_first']
+        if state is not None:
+            qd_orig = df[['battery_name']].merge(state, on='battery_name', how='left')['qd_orig'].fillna(qd_orig)
+        df = add_health_metrics(df.assign(batt=self.cell_batts(df['battery_name'], plan.ids),
+                                          qd_orig=qd_orig.to_numpy()), model)
+        df = df[['battery_name', 'batt', 'qd_orig', 'cycle', 'qd', 'soh', 'rul']]
+
+        if state is not None:
+            df = pd.concat([state[~state['battery_name'].isin(df['battery_name'])], df], ignore_index=True)
+        return df.sort_values('battery_name', kind='stable', ignore_index=True)
+
+    def live_batteries(self, df):
+        return df.groupby('batt', as_index=False).agg(cycle=('cycle', 'max'), soh=('soh', 'mean'), rul=('rul', 'mean')) \
+            .round({'soh': 2, 'rul': 2})
+
+    # SOH against the qd of each cell's first cycle, rows are in cycle order
+    def rollup(self, df, ids, sites):
+        batt = ids.drop_duplicates('batt_id').set_index('batt_id')['batt']
+        qd_orig = df.groupby('cell_id')['qd'].transform('first')
+        df = pd.DataFrame({
+            'site': df['batt_id'].map(batt).map(sites).fillna(UNKNOWN_SITE),
+            'batt': df['batt_id'].map(batt),
+            'cycle': df['cycle_no'],
+            'qd': df['qd'].astype(np.float64),
+            'soh': calc_soh(df['qd'], qd_orig),
+        })
+        return rollup_frame(df)
+
+    # Battery IDs (batt) of cell names, looked up in ids
+    def cell_batts(self, cells, ids):
+        return cells.map(ids.set_index('battery_name')['batt']).to_numpy(object)
+
+    # Cell key from the file name, battery key from the lookup, cycle and
+    # qd typed
+    def with_cell_keys(self, df, ids):
+        cell = df['source_file'].map(lambda f: os.path.basename(f).split('.')[0])
+        return pd.DataFrame({
+            'cell': cell,
+            'batt': self.cell_batts(cell, ids),
+            'cycle': df['cycle_no'].astype(int),
+            'qd': df['qd'].astype(np.float32),
+        })
+
+    # Take avg of cell Qd values across cycles for each battery (and split)
+    def get_avg_qd(self, df):
+        keys = ['split', 'batt', 'cycle'] if 'split' in df.columns else ['batt', 'cycle']
+        return df.groupby(keys, as_index=False)['qd'].mean()
+
+    # Original Qd per group: qd of the earliest cycle
+    def first_qd(self, df, keys):
+        first = df.sort_values('cycle', kind='stable').groupby(keys, as_index=False).first()
+        return first[keys].assign(qd_orig=first['qd'].astype(np.float64))
+
+    def calc_baseline(self, df):
+        return Baseline(self.first_qd(self.get_avg_qd(df), ['batt']), self.first_qd(df, ['batt', 'cell']))
+
+    def fit_fade(self, df, baseline):
+        batteries = baseline.batteries.rename(columns={'qd_orig': 'batt_qd_orig'})
+        df = df[['batt', 'cell', 'cycle', 'qd']].merge(baseline.cells, on=['batt', 'cell']).merge(batteries, on='batt')
+        fits = fade_fits(df)
+        return FadeFits(fits[fits['cell'].isna()].drop(columns='cell').reset_index(drop=True),
+                        fits[fits['cell'].notna()].reset_index(drop=True))
+
+    def add_stats(self, df, baseline, config, fits=None):
+        df = self.get_avg_qd(df)
+        df = df.merge(baseline.batteries, on='batt')
+        if config.rul_model == FIT_RUL_MODEL:
+            df = df.merge(fits.batteries[['batt', 'eol_cycle']], on='batt', how='left')
+        df = add_health_metrics(df, config.rul_model).sort_values('cycle', kind='stable')
+        return df[['cycle', 'soh', 'rul', 'qd', 'batt'] + (['split'] if 'split' in df.columns else [])]
+
+    def downsample(self, df, key, n_out):
+        return downsample_frame(df, key, n_out)
+
+    def latest_stats(self, df):
+        last = df.sort_values('cycle', kind='stable').groupby('batt', sort=True).tail(1)
+        return list(zip(last['batt'], last['cycle'].astype(int), last['soh'].astype(float),
+                        last['rul'].astype(float)))
+
+
+# Watches raw_prefix and runs each batch of new files, oldest first, through
+# run_micro_batch. Files read are listed in the stream checkpoint, so a
+# restarted watcher goes on where it stopped. Files have to be moved into
+# the prefix once complete, like S3 objects appear.
+def watch(backend, raw_prefix, config, interval=STREAM_INTERVAL, max_files=STREAM_MAX_FILES, once=False):
+    raw_prefix = raw_prefix.rstrip('/')
+    checkpoint = f"{raw_prefix.rsplit('/', 1)[0]}/{STREAM_CHECKPOINT_PREFIX}/files.txt"
+    done = set((backend.read_text(checkpoint) or '').splitlines())
+
+    while True:
+        found = sorted((os.path.getmtime(f), os.path.relpath(f, backend.root), f)
+                       for f in backend._list_csv(raw_prefix, True))
+        batch = [(key, f) for _, key, f in found if key not in done][:max_files]
+        if batch:
+            frame = backend.read_raw_stream([f for _, f in batch])
+            run_micro_batch(backend, raw_prefix, frame, config)
+            done.update(key for key, _ in batch)
+            backend.write_text(checkpoint, '\n'.join(sorted(done)) + '\n')
+            print(f"Micro-batch of {len(batch)} files, {len(frame)} lines")
+
+        if len(batch) == max_files:
+            continue
+        if once:
+            return
+        time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs the processing plugin or post processor steps against a local directory"
+    )
+    parser.add_argument("--root", default=".", help="directory standing in for the S3 bucket")
+    parser.add_argument("--init-year", type=int, default=INIT_YEAR, help="epoch year of cycle 1")
+    parser.add_argument("--frequency", default=FREQUENCY, help="Forecast frequency between cycles")
+    parser.add_argument("--single-pass", action="store_true", help="post process all splits in one pass")
+    parser.add_argument("--incremental", action="store_true", help="only process cycles added since the last run")
+    parser.add_argument("--sampling", action="store_true", help="sample the test cells of each battery")
+    parser.add_argument("--sampling-seed", type=int, default=SAMPLING_SEED, help="seed of the test cell sampling")
+    parser.add_argument("--no-validation", action="store_true", help="skip the raw data checks and gap repair")
+    parser.add_argument("--no-rollups", action="store_true", help="skip the battery, site and fleet rollups")
+    parser.add_argument("--repair-gaps", type=int, default=REPAIR_GAPS, help="longest gap of missing cycles filled")
+    parser.add_argument("--report", action="store_true", help="write a stage level run report under the pipeline")
+    parser.add_argument("--output-format", default=OUTPUT_FORMAT, choices=OUTPUT_FORMATS, help="format of the plot outputs")
+    parser.add_argument("--locations-key", default=LOCATIONS_KEY, help="battery location table joined into the summary and rollups")
+    parser.add_argument("--levels", type=int, nargs='*', default=list(DOWNSAMPLE_LEVELS),
+                        help="points per series of the downsampled levels, none to skip them")
+    parser.add_argument("--backtest-origins", type=int, default=BACKTEST_ORIGINS,
+                        help="origins of the baseline backtest, 0 to skip the forecast accuracy stage")
+    parser.add_argument("--anomaly-window", type=int, default=ANOMALY_WINDOW,
+                        help="cycles of the fade rate of the module anomalies, 0 to skip them")
+    parser.add_argument("--workers", type=int, default=PIPELINE_WORKERS, help="pipelines processed at once")
+    parser.add_argument("--rul-model", default=RUL_MODEL, choices=[*RUL_MODELS, FIT_RUL_MODEL],
+                        help="decay model for RUL")
+    sub = parser.add_subparsers(dest="step", required=True)
+    process = sub.add_parser("process", help="raw dataset -> Forecast inputs and cell plots")
+    process.add_argument("raw_dataset_key", nargs='+', help="raw datasets of one or more pipelines")
+    post = sub.add_parser("post", help="Forecast export -> battery SOH/RUL plots")
+    post.add_argument("output_path", nargs='+', help="Forecast exports or prefixes of one or more pipelines")
+    stream = sub.add_parser("stream", help="new raw files under a prefix -> micro-batch updates")
+    stream.add_argument("raw_prefix")
+    stream.add_argument("--interval", type=float, default=STREAM_INTERVAL, help="seconds between directory scans")
+    stream.add_argument("--max-files", type=int, default=STREAM_MAX_FILES, help="most files per micro-batch")
+    stream.add_argument("--once", action="store_true", help="stop once every file found has been processed")
+    forecast = sub.add_parser("forecast", help="Forecast inputs -> baseline forecast export")
+    forecast.add_argument("pipeline")
+    forecast.add_argument("--output", help="prefix of the export, <pipeline>/plot/predictions by default")
+    args = parser.parse_args()
+
+    config = PipelineConfig(
+        init_year=args.init_year,
+        frequency=args.frequency,
+        rul_model=args.rul_model,
+        sampling=args.sampling,
+        sampling_seed=args.sampling_seed,
+        single_pass=args.single_pass,
+        incremental=args.incremental,
+        output_format=args.output_format,
+        locations_key=args.locations_key,
+        downsample_levels=tuple(sorted(set(args.levels))),
+        validation=not args.no_validation,
+        repair_gaps=args.repair_gaps,
+        backtest_origins=args.backtest_origins,
+        rollups=not args.no_rollups,
+        anomaly_window=args.anomaly_window,
+    )
+
+    if args.step == "process":
+        keys, pipeline = args.raw_dataset_key, lambda key: key.rsplit('/', 1)[0]
+    elif args.step == "stream":
+        keys, pipeline = [args.raw_prefix.rstrip('/')], lambda key: key.rsplit('/', 1)[0]
+    elif args.step == "forecast":
+        keys, pipeline = [args.pipeline], lambda key: key
+    else:
+        keys, pipeline = [forecast_output_path(key) for key in args.output_path], lambda key: key.rsplit('/', 2)[0]
+
+    # Every pipeline gets its own backend, so run reports stay separate
+    def run(key):
+        backend = LocalBackend(args.root)
+        # Row counts of in-memory frames cost nothing, so they are kept
+        if args.report:
+            backend = InstrumentedBackend(backend, count_rows=True)
+        if args.step == "process":
+            run_processing(backend, key, config)
+        elif args.step == "stream":
+            watch(backend, key, config, args.interval, args.max_files, args.once)
+        elif args.step == "forecast":
+            run_baseline_forecast(backend, key, config, args.output or f"{key}/{FORECAST_OUTPUT_PREFIX}")
+        else:
+            run_post_processing(backend, key, config)
+        if args.report:
+            backend.write_report(pipeline(key), args.step, config)
+
+    logging.basicConfig(level=logging.INFO)
+    run_pipelines(run, list(dict.fromkeys(keys)), pipeline, args.workers)
+
+if __name__ == "__main__":
+    main()
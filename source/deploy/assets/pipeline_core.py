@@ -0,0 +1,1325 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# Backend independent definition of the battery health pipeline.
+#
+# The processing plugin and the post processor only describe *what* happens
+# to the data. Each step is delegated to a backend which knows *how* to do
+# it: SparkBackend (spark_backend.py) runs inside Glue against S3 and
+# LocalBackend (local_backend.py) runs on pandas/NumPy against a directory.
+
+import csv
+import io
+import json
+import logging
+import math
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+
+from health_metrics import FIT_RUL_MODEL, RUL_MODEL, calc_eol_cycle
+
+logger = logging.getLogger(__name__)
+
+# Parameter for removing sparsely timed data
+# Useful only when data has varied timeseries lengths
+# Only CUTOFF% cells have a lower cycle_life
+# So (100 - CUTOFF)% cells have at least these many cycles
+QUANTILE_CUTOFF = 0.5
+
+# Arbitrarily initialized year for converting cycle_no to timestamp
+INIT_YEAR = 2000
+
+# Time step between consecutive cycles, must match the Forecast dataset frequency
+FREQUENCY = 'D'
+
+# Fixed length Forecast frequencies in seconds, calendar ones in months
+FREQUENCY_SECONDS = {
+    'W': 7*24*3600,
+    'D': 24*3600,
+    'H': 3600,
+    '30min': 30*60,
+    '15min': 15*60,
+    '10min': 10*60,
+    '5min': 5*60,
+    '1min': 60,
+}
+FREQUENCY_MONTHS = {'Y': 12, 'M': 1}
+
+# Number of days into the future to generate forecasts for
+FORECAST_HORIZON = 30
+
+# Cells we want to generate forecasts while testing
+CELLS_PER_BATTERY = 5
+
+# Source scans behind each field of a processing plan: the converted frame
+# is one pass over the raw lineage, the cutoff a quantile pass over it and
+# the test cells a collect. Every output branch reading a field would rerun
+# its scans without the plan. An incremental plan takes its cutoff and test
+# cells from the manifest. Moving the cutoffs of test cells seen past their
+# horizon takes one more pass.
+PLAN_SCANS = {'frame': 1, 'cutoff': 1, 'test_set': 1}
+INCREMENTAL_PLAN_SCANS = {'frame': 1, 'cutoffs': 1}
+
+# Seed of the test cell sampling. The same dataset and seed always give the
+# same test cells, on either backend.
+SAMPLING_SEED = 0
+
+# Constants of the SplitMix64 finalizer used to rank cells for sampling
+HASH_GOLDEN = 0x9E3779B97F4A7C15
+HASH_MIX = (0xBF58476D1CE4E5B9, 0x94D049BB133111EB)
+HASH_SHIFTS = (30, 27, 31)
+
+# Validation of the raw dataset ahead of ConvertTS. Rows with a non numeric
+# cycle_no or cycle_life, repeated cycles and QD outside QD_RANGE (Ah) are
+# dropped. Cells whose cycle_life changes, with fewer than 2 rows left or
+# more than MAX_MISSING_SHARE of their cycle span missing are quarantined:
+# their raw rows go to <pipeline>/quarantine.csv instead of the outputs.
+# Gaps of up to REPAIR_GAPS missing cycles are filled by linear
+# interpolation of QD, 0 leaves them. Per cell findings are written to
+# <pipeline>/quality_report.csv.
+QD_RANGE = (0.0, 2.0)
+MAX_MISSING_SHARE = 0.2
+MIN_VALID_ROWS = 2
+REPAIR_GAPS = 0
+QUALITY_REPORT_KEY = 'quality_report.csv'
+QUALITY_REPORT_SCHEMA = 'battery_name string, rows int, invalid int, duplicates int, unordered int, ' \
+                        'out_of_range int, missing int, max_gap int, filled int, status string'
+QUARANTINE_KEY = 'quarantine.csv'
+
+# Prefixes under <pipeline>/plot/ holding data for the UI
+SPLITS = ['past', 'actual', 'predictions']
+
+# Baseline capacity tables under <pipeline>/baseline/
+BASELINE_PREFIX = 'baseline'
+BATTERY_BASELINE_SCHEMA = 'batt string, qd_orig double'
+CELL_BASELINE_SCHEMA = 'batt string, cell string, qd_orig double'
+
+# Fade curve fits of the past cells and of every battery's average curve
+# under <pipeline>/fits/, see health_metrics.FADE_MODELS. eol_cycle is
+# empty when no decay is seen.
+FITS_PREFIX = 'fits'
+BATTERY_FIT_SCHEMA = 'batt string, model string, c0 double, c1 double, rmse double, eol_cycle double, points int'
+CELL_FIT_SCHEMA = 'batt string, cell string, model string, c0 double, c1 double, rmse double, ' \
+                  'eol_cycle double, points int'
+
+# Built-in baseline forecast of the test cells (baseline_forecast.py), in
+# the layout of a Forecast export. The processing plugin writes it under
+# <pipeline>/baseline_forecast/ next to Forecast's, locally it can stand
+# in for the export under <pipeline>/plot/predictions.
+BASELINE_FORECAST_PREFIX = 'baseline_forecast'
+BASELINE_FORECAST_KEY = 'baseline_forecast.csv'
+TRAIN_DATASET_SCHEMA = 'date string, item_id string, qd double'
+TEST_IDS_SCHEMA = 'item_id string'
+FORECAST_SCHEMA = 'item_id string, cycle int, p10 double, p50 double, p90 double'
+
+# Forecast accuracy of the test cells in <pipeline>/backtest.csv, see
+# backtest.py. Battery rows have no cell. The baseline forecaster is also
+# scored from BACKTEST_ORIGINS - 1 earlier origins, horizon cycles apart.
+BACKTEST_KEY = 'backtest.csv'
+BACKTEST_ORIGINS = 3
+BACKTEST_SCHEMA = 'model string, origin int, batt string, cell string, points int, wape double, rmse double, ' \
+                  'mape double, eol_error double'
+
+# Degradation anomalies of every cell against the other cells of its
+# battery (anomalies.py), one row per cell in <pipeline>/anomalies.csv,
+# recomputed from all converted rows by every processing run. The modules
+# under warning or needing attention of each scored battery go to
+# <pipeline>/module_warnings.json, in the shape of connected-batteries.json.
+# Modules are the cells of a battery, numbered from 1 in cell ID order.
+# Fade rates are taken over the last ANOMALY_WINDOW cycles.
+ANOMALIES_KEY = 'anomalies.csv'
+MODULE_WARNINGS_KEY = 'module_warnings.json'
+ANOMALY_WINDOW = 50
+ANOMALY_SCHEMA = 'batt string, cell string, module int, modules int, cycle int, fade double, loss double, ' \
+                 'fade_z double, loss_z double, status string'
+
+# Streaming mode (run_micro_batch): raw files landing under a prefix are
+# processed in micro-batches, each as an incremental run. The running state
+# of every cell (original capacity, latest cycle with its SOH and RUL) is
+# kept in <pipeline>/live/cells.csv and averaged per battery in
+# <pipeline>/live/batteries.csv. Raw files already read are tracked under
+# <pipeline>/stream_checkpoint/. Raw files are read without their header,
+# as RAW_STREAM_SCHEMA columns, one more than RAW_SCHEMA to catch extra
+# ones. Each file is mapped by the names of its header row, files whose
+# header doesn't name the RAW_SCHEMA columns are skipped and listed in
+# <pipeline>/rejected_files.csv.
+RAW_SCHEMA = 'battery_name string, cycle_no string, cycle_life string, QD string'
+RAW_STREAM_SCHEMA = '_c0 string, _c1 string, _c2 string, _c3 string, _c4 string'
+REJECTED_FILES_KEY = 'rejected_files.csv'
+LIVE_PREFIX = 'live'
+LIVE_CELL_SCHEMA = 'battery_name string, batt string, qd_orig double, cycle int, qd double, soh double, rul double'
+LIVE_BATTERY_SCHEMA = 'batt string, cycle int, soh double, rul double'
+STREAM_CHECKPOINT_PREFIX = 'stream_checkpoint'
+STREAM_SPLITS = ['past', 'actual']
+STREAM_INTERVAL = 60
+STREAM_MAX_FILES = 100
+
+# Capacity and SOH of every cell rolled up per cycle to battery, site and
+# fleet level under <pipeline>/rollups/, partitioned by level (rollups.py).
+# SOH is against the qd of the cell's first cycle. Sites are country/city
+# of the battery location table, UNKNOWN_SITE for batteries without one.
+# p5, p50 and p95 are approximate.
+ROLLUP_PREFIX = 'rollups'
+ROLLUP_SCHEMA = 'site string, batt string, cycle int, cells int, ' \
+                'qd_mean double, qd_min double, qd_p5 double, qd_p50 double, qd_p95 double, ' \
+                'soh_mean double, soh_min double, soh_p5 double, soh_p50 double, soh_p95 double'
+UNKNOWN_SITE = 'unknown'
+
+# Incremental runs keep one row per cell in <pipeline>/manifest.csv: last
+# processed cycle_no, test cell flag, cutoff of the first run and whether
+# the cell received new cycles in the latest processing run
+MANIFEST_KEY = 'manifest.csv'
+MANIFEST_SCHEMA = 'battery_name string, last_cycle int, test int, cutoff double, updated int'
+
+# Integer IDs of the cells and batteries of a pipeline, assigned in name
+# order. Incremental runs keep the IDs and number new cells after them.
+CELL_IDS_KEY = 'cell_ids.csv'
+CELL_IDS_SCHEMA = 'cell_id int, battery_name string, batt_id int, batt string'
+
+# Downsampled copies of the cell and battery series, as numbers of points
+# per series, under <split>/levels/<points>/cells/ and .../stats/
+DOWNSAMPLE_LEVELS = (200, 1000)
+LEVELS_PREFIX = 'levels'
+
+# Battery summary index under <pipeline>/, one record per battery keyed by
+# battery ID, joined with the headerless battery location table
+SUMMARY_KEY = 'summary.json'
+LOCATIONS_KEY = 'CDK-assets/battery-locations.csv'
+LOCATION_FIELDS = ('lng', 'lat', 'country', 'city', 'vin')
+
+# Format of the plot outputs. Parquet datasets are partitioned by battery
+# (<split>/cells/batt=b1/, <split>/stats/batt=b1/) with typed columns. The
+# Forecast datasets and the Forecast export stay CSV in both formats.
+OUTPUT_FORMAT = 'csv'
+OUTPUT_FORMATS = ('csv', 'parquet')
+CELLS_PREFIX = 'cells'
+STATS_PREFIX = 'stats'
+CELL_DATASET_SCHEMA = 'cell string, cycle int, qd float'
+STATS_DATASET_SCHEMA = 'cycle int, soh double, rul double, qd float'
+
+# Multi-pipeline jobs (run_pipelines): the key argument of either job takes
+# a comma separated list of pipelines, run up to PIPELINE_WORKERS at a time
+# in the same Spark session. Each pipeline only reads and writes under its
+# own prefix. Post processing also takes pipeline prefixes, their Forecast
+# export is under FORECAST_OUTPUT_PREFIX.
+PIPELINE_WORKERS = 4
+FORECAST_OUTPUT_PREFIX = 'plot/predictions'
+
+# Column types used in table schemas and their NumPy equivalent
+TABLE_TYPES = {
+    'string': object,
+    'int': 'int32',
+    'bigint': 'int64',
+    'float': 'float32',
+    'double': 'float64',
+}
+
+
+@dataclass
+class PipelineConfig:
+    quantile_cutoff: float = QUANTILE_CUTOFF
+    init_year: int = INIT_YEAR
+    frequency: str = FREQUENCY
+    forecast_horizon: int = FORECAST_HORIZON
+    cells_per_battery: int = CELLS_PER_BATTERY
+    sampling: bool = False
+    sampling_seed: int = SAMPLING_SEED
+    rul_model: str = RUL_MODEL
+    single_pass: bool = False
+    incremental: bool = False
+    output_format: str = OUTPUT_FORMAT
+    locations_key: str = LOCATIONS_KEY
+    downsample_levels: tuple = DOWNSAMPLE_LEVELS
+    validation: bool = True
+    qd_range: tuple = QD_RANGE
+    max_missing_share: float = MAX_MISSING_SHARE
+    min_valid_rows: int = MIN_VALID_ROWS
+    repair_gaps: int = REPAIR_GAPS
+    baseline_forecast: bool = False
+    backtest_origins: int = BACKTEST_ORIGINS
+    rollups: bool = True
+    anomaly_window: int = ANOMALY_WINDOW
+
+
+# Cutoff, test cells and converted frame computed once and shared by every
+# output branch. The frame and test_set hold integer cell IDs, names are
+# looked up in ids for the outputs only. An incomplete plan only holds the
+# cycles added since the previous run. cutoffs maps the test cells whose
+# cutoff moved past cutoff to theirs, moved lists those moved by this run:
+# their frame rows start at their previous cutoff. moved is None when the
+# plan couldn't move any, see plan_incremental.
+@dataclass
+class ProcessingPlan:
+    frame: object
+    cutoff: float
+    test_set: list
+    complete: bool = True
+    ids: object = None
+    cutoffs: dict = None
+    moved: list = None
+    # (branch, plan fields read) per branch served, see serve()
+    branches: list = None
+    reads: set = None
+
+    def __post_init__(self):
+        if self.branches is None:
+            self.branches = []
+
+    def __getattribute__(self, name):
+        if name in PLAN_SCANS or name in INCREMENTAL_PLAN_SCANS:
+            reads = object.__getattribute__(self, 'reads')
+            if reads is not None:
+                reads.add(name)
+        return object.__getattribute__(self, name)
+
+    # Run fn(plan, *args) as an output branch, recording the plan fields it reads
+    def serve(self, fn, *args, name=None):
+        self.reads = set()
+        try:
+            return fn(self, *args)
+        finally:
+            self.branches.append((name or fn.__name__, sorted(self.reads)))
+            self.reads = None
+
+    @property
+    def field_scans(self):
+        if self.complete:
+            return PLAN_SCANS
+        return INCREMENTAL_PLAN_SCANS if self.moved is not None else dict(INCREMENTAL_PLAN_SCANS, cutoffs=0)
+
+    # Scans run once to build the plan
+    @property
+    def source_scans(self):
+        return sum(self.field_scans.values())
+
+    # Scans the branches served so far would have run on their own
+    @property
+    def branch_scans(self):
+        return sum(self.field_scans.get(f, 0) for _, fields in self.branches for f in fields)
+
+    @property
+    def scans_avoided(self):
+        return self.branch_scans - self.source_scans
+
+    def scan_report(self):
+        return {
+            'source_scans': self.source_scans,
+            'branch_scans': self.branch_scans,
+            'scans_avoided': self.scans_avoided,
+            'branches': [{'branch': name, 'reads': fields} for name, fields in self.branches],
+        }
+
+
+# Fade curve fits per battery and per cell
+@dataclass
+class FadeFits:
+    batteries: object
+    cells: object
+
+
+# Raw frame left by validation (typed raw columns), its per cell quality
+# report, the raw rows of the quarantined cells and {status: cells}
+@dataclass
+class Validation:
+    frame: object
+    report: object
+    quarantine: object
+    statuses: dict
+
+
+# Original capacity (qd at the first recorded cycle) per battery and per cell
+@dataclass
+class Baseline:
+    batteries: object
+    cells: object
+
+
+# Operations every backend has to provide, frames are backend specific
+class Backend(ABC):
+
+    # Load the raw dataset at key (file or directory)
+    @abstractmethod
+    def read_raw(self, key):
+        raise NotImplementedError
+
+    # Load every file directly under the prefix, or only the given keys
+    @abstractmethod
+    def read_frame(self, key, files=None):
+        raise NotImplementedError
+
+    # Keys of the CSV files directly under the prefix
+    @abstractmethod
+    def list_files(self, key):
+        raise NotImplementedError
+
+    # Delete the given keys
+    @abstractmethod
+    def delete(self, keys):
+        raise NotImplementedError
+
+    # Cell files under the prefix with cell, batt, typed cycle and qd
+    # columns. Cells are named by their file, batt comes from the cell ID
+    # lookup ids. Restricted to the files of cells if given, None if none exist.
+    @abstractmethod
+    def read_cells(self, key, ids, cells=None):
+        raise NotImplementedError
+
+    # read_cells over several prefixes in one scan, tagged with a split column
+    @abstractmethod
+    def read_splits(self, base_path, keys, ids, cells=None):
+        raise NotImplementedError
+
+    # Rows of one split, without the split column
+    @abstractmethod
+    def select_split(self, frame, key):
+        raise NotImplementedError
+
+    # Parquet dataset under path with the columns of a DDL schema and the
+    # partition_key column. Only the files of the partitions given are read,
+    # and only the rows of cells if given. None if the dataset does not exist.
+    @abstractmethod
+    def read_dataset(self, path, schema, partition_key, partitions=None, cells=None):
+        raise NotImplementedError
+
+    # read_dataset of several paths tagged with a split column, keys as split
+    @abstractmethod
+    def read_datasets(self, paths, schema, partition_key):
+        raise NotImplementedError
+
+    # Whether any object exists at key or under it
+    @abstractmethod
+    def exists(self, key):
+        raise NotImplementedError
+
+    # Load a small table with a DDL schema ('name type, ...'). Headerless
+    # tables take the schema's column names.
+    @abstractmethod
+    def read_table(self, key, schema, header=True):
+        raise NotImplementedError
+
+    # Write frame to path, one file per partition_key value if given, rows
+    # ordered by sort_key. With replace, objects previously found under path
+    # are removed. With append, rows are added to the end of existing files.
+    # Backends that move their outputs into place return the move stats.
+    @abstractmethod
+    def save_data(self, frame, path, partition_key=None, header=None, replace=False, sort_key=None,
+                  append=False):
+        raise NotImplementedError
+
+    # Write frame as a Parquet dataset under path, partitioned by
+    # partition_key, columns cast to a DDL schema and rows ordered by
+    # sort_key. With replace, the whole dataset is rewritten, with append
+    # files are added next to the existing ones; otherwise only the
+    # partitions present in frame are rewritten.
+    @abstractmethod
+    def save_dataset(self, frame, path, schema, partition_key, replace=False, sort_key=None, append=False):
+        raise NotImplementedError
+
+    # Cell frame (cell, batt, cycle, qd) of a frame keyed by cell_column,
+    # batt looked up in ids
+    @abstractmethod
+    def cell_frame(self, frame, cell_column, ids):
+        raise NotImplementedError
+
+    # Per cell checks and gap repair of a raw frame, as a Validation. Statuses
+    # are 'ok', 'repaired' or 'quarantined', see QUALITY_REPORT_SCHEMA.
+    @abstractmethod
+    def validate(self, frame, config):
+        raise NotImplementedError
+
+    # Cell ID lookup (CELL_IDS_SCHEMA) of the cells in a raw frame. Cells
+    # already in ids keep their IDs. The battery of a cell is the one place
+    # read off its name, everything downstream looks it up here.
+    @abstractmethod
+    def calc_cell_ids(self, frame, ids=None):
+        raise NotImplementedError
+
+    # Typed and integer encoded frame (cell_id, batt_id, cycle_no,
+    # cycle_life, qd) ordered by cycle_no and cell_id
+    @abstractmethod
+    def convert_ts(self, frame, config, ids):
+        raise NotImplementedError
+
+    # Persist the converted frame, compute cutoff and test set once
+    @abstractmethod
+    def plan(self, frame, config, ids):
+        raise NotImplementedError
+
+    # Plan over the cycles past each cell's watermark, reusing the cutoffs
+    # and test cells recorded in the manifest. With advance, frame holds every
+    # cycle and test cells seen past their cutoff + horizon get the cutoff
+    # holding out their last horizon cycles.
+    @abstractmethod
+    def plan_incremental(self, frame, manifest, config, ids, advance=False):
+        raise NotImplementedError
+
+    # Manifest after a run of plan: watermarks moved to the last cycle seen,
+    # the cutoff of each cell and updated set for the cells with new cycles only
+    @abstractmethod
+    def calc_manifest(self, plan, manifest=None):
+        raise NotImplementedError
+
+    # Rows of the lookup for the cells missing from ids
+    @abstractmethod
+    def new_cell_ids(self, lookup, ids):
+        raise NotImplementedError
+
+    # Sorted battery IDs (batt) of cells in ids
+    @abstractmethod
+    def cell_batteries(self, ids, cells):
+        raise NotImplementedError
+
+    # Test cells of every battery having at least one updated cell
+    @abstractmethod
+    def affected_cells(self, manifest, ids):
+        raise NotImplementedError
+
+    # Baseline (or FadeFits) with the rows of fresh replacing those of old
+    # for the same keys
+    @abstractmethod
+    def merge_baseline(self, old, fresh):
+        raise NotImplementedError
+
+    # Write a small text object, such as a run report
+    @abstractmethod
+    def write_text(self, key, text):
+        raise NotImplementedError
+
+    # Content of a small text object, None if it does not exist
+    @abstractmethod
+    def read_text(self, key):
+        raise NotImplementedError
+
+    # Total size of the objects at key or under it
+    @abstractmethod
+    def stored_bytes(self, key):
+        raise NotImplementedError
+
+    # {'rows', 'partitions'} of a backend frame, None for anything else
+    @abstractmethod
+    def frame_stats(self, obj):
+        raise NotImplementedError
+
+    # Label the work started from now on with a stage name, None to clear
+    def mark_stage(self, name):
+        pass
+
+    # Keep a frame around for several consumers
+    def cache(self, frame):
+        return frame
+
+    # Drop a frame persisted by cache() or plan()
+    def release(self, frame):
+        pass
+
+    @abstractmethod
+    def extract_train(self, plan, config, plot_data):
+        raise NotImplementedError
+
+    @abstractmethod
+    def extract_test(self, plan, config, plot_data):
+        raise NotImplementedError
+
+    @abstractmethod
+    def extract_ids(self, plan):
+        raise NotImplementedError
+
+    # Preprocessing to get cycle_no from Forecast export
+    @abstractmethod
+    def convert_forecasts(self, frame, config):
+        raise NotImplementedError
+
+    # Forecast export rows (item_id, date, p10, p50, p90) over the horizon
+    # of the cells in ids, forecast together from the train dataset.
+    # cell_ids is the cell ID lookup.
+    @abstractmethod
+    def baseline_forecast(self, train, ids, config, cell_ids):
+        raise NotImplementedError
+
+    # Rows of a raw stream frame (RAW_STREAM_SCHEMA and source_file) under
+    # the RAW_SCHEMA columns, mapped by the header row of each file, with
+    # the files read and the files rejected for their header
+    @abstractmethod
+    def raw_by_name(self, frame):
+        raise NotImplementedError
+
+    # Running state of every cell (LIVE_CELL_SCHEMA) with the latest cycle of
+    # each cell in plan. Cells new to state take the qd of their first cycle
+    # as original capacity.
+    @abstractmethod
+    def update_live(self, plan, state, config):
+        raise NotImplementedError
+
+    # Latest cycle, mean SOH and mean RUL of the cells of each battery
+    @abstractmethod
+    def live_batteries(self, state):
+        raise NotImplementedError
+
+    # Forecast accuracy (BACKTEST_SCHEMA) of the cell frames of each split,
+    # None for a split without cells
+    @abstractmethod
+    def backtest(self, frames, config):
+        raise NotImplementedError
+
+    # Anomalies (ANOMALY_SCHEMA) of every cell of a converted frame, scored
+    # against the other cells of their battery. Modules are numbered from ids.
+    @abstractmethod
+    def anomalies(self, frame, ids, config):
+        raise NotImplementedError
+
+    # [(batt, modules, module, status)] of an anomalies frame
+    @abstractmethod
+    def module_statuses(self, frame):
+        raise NotImplementedError
+
+    # Rollup rows (level, then ROLLUP_SCHEMA) of a converted frame in one
+    # grouping pass, sites maps battery names to site names
+    @abstractmethod
+    def rollup(self, frame, ids, sites):
+        raise NotImplementedError
+
+    # Baseline capacity of a frame of cell files, as distributed aggregates
+    @abstractmethod
+    def calc_baseline(self, frame):
+        raise NotImplementedError
+
+    # FadeFits of a frame of cell files in one batched least squares pass
+    @abstractmethod
+    def fit_fade(self, frame, baseline):
+        raise NotImplementedError
+
+    # Average cell qd per battery and cycle (and split), adding SOH and RUL.
+    # FIT_RUL_MODEL reads RUL off the battery fits.
+    @abstractmethod
+    def add_stats(self, frame, baseline, config, fits=None):
+        raise NotImplementedError
+
+    # Rows of frame kept by LTTB on (cycle, qd) for n_out points per value
+    # of key. Series with at most n_out points are kept whole.
+    @abstractmethod
+    def downsample(self, frame, key, n_out):
+        raise NotImplementedError
+
+    # [(batt, cycle, soh, rul)] at the last cycle of each battery of a frame
+    # returned by add_stats, without a split column
+    @abstractmethod
+    def latest_stats(self, frame):
+        raise NotImplementedError
+
+
+# Optional job arguments with their defaults, getResolvedOptions only
+# supports required ones. Values are converted to the type of the default.
+def get_optional_args(argv, defaults):
+    args = dict(defaults)
+    for name, default in defaults.items():
+        flag = f"--{name}"
+        if flag not in argv:
+            continue
+        value = argv[argv.index(flag) + 1]
+        if isinstance(default, bool):
+            args[name] = value.lower() in ('true', '1', 'yes')
+        else:
+            args[name] = type(default)(value)
+    return args
+
+
+# Keys of a comma separated list, in order and without duplicates
+def parse_keys(text):
+    return list(dict.fromkeys(k.strip().rstrip('/') for k in text.split(',') if k.strip()))
+
+
+# Forecast export path of a post processing key, a pipeline prefix or the
+# export path itself
+def forecast_output_path(key):
+    key = key.rstrip('/')
+    return key if key.endswith(f"/{FORECAST_OUTPUT_PREFIX}") else f"{key}/{FORECAST_OUTPUT_PREFIX}"
+
+
+# run(key) for every key, up to workers at a time on threads sharing the
+# Spark session. pipeline(key) is the prefix a key writes under, no two
+# keys may share one. A single key runs on the calling thread. Otherwise
+# every key is run even when some fail, and the failures are raised
+# together at the end.
+def run_pipelines(run, keys, pipeline, workers=PIPELINE_WORKERS):
+    prefixes = [pipeline(key) for key in keys]
+    shared = sorted({p for p in prefixes if prefixes.count(p) > 1})
+    if shared:
+        raise ValueError(f"Several keys of the same pipeline: {', '.join(shared)}")
+    if len(keys) == 1:
+        run(keys[0])
+        return
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(keys)))) as pool:
+        futures = {pool.submit(run, key): key for key in keys}
+        for future in as_completed(futures):
+            key = futures[future]
+            error = future.exception()
+            if error is None:
+                logger.info("Pipeline %s done", key)
+            else:
+                failed.append(key)
+                logger.error("Pipeline %s failed", key, exc_info=error)
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(keys)} pipelines failed: {', '.join(sorted(failed))}")
+
+
+# Downsampled levels of a comma separated list of point counts
+def parse_levels(text):
+    return tuple(sorted({int(n) for n in text.split(',') if n.strip()}))
+
+
+# [(name, type)] of a DDL schema string
+def parse_schema(schema):
+    return [tuple(field.split()) for field in schema.split(',')]
+
+
+# Baseline persisted by an earlier run of the pipeline, if any
+def read_baseline(backend, path):
+    if not backend.exists(f"{path}/batteries.csv"):
+        return None
+    return Baseline(
+        backend.read_table(f"{path}/batteries.csv", BATTERY_BASELINE_SCHEMA),
+        backend.read_table(f"{path}/cells.csv", CELL_BASELINE_SCHEMA),
+    )
+
+
+def save_baseline(backend, baseline, path):
+    backend.save_data(baseline.batteries, f"{path}/batteries.csv", header=True)
+    backend.save_data(baseline.cells, f"{path}/cells.csv", header=True)
+
+
+# Fade fits of an earlier run of the pipeline, if any
+def read_fits(backend, path):
+    if not backend.exists(f"{path}/batteries.csv"):
+        return None
+    return FadeFits(
+        backend.read_table(f"{path}/batteries.csv", BATTERY_FIT_SCHEMA),
+        backend.read_table(f"{path}/cells.csv", CELL_FIT_SCHEMA),
+    )
+
+
+def save_fits(backend, fits, path):
+    backend.save_data(fits.batteries, f"{path}/batteries.csv", header=True)
+    backend.save_data(fits.cells, f"{path}/cells.csv", header=True)
+
+
+# Fade fits of the past cells, replacing those of old for the cells and
+# batteries refitted
+def update_fits(backend, past, baseline, path, old=None):
+    fits = backend.fit_fade(past, baseline)
+    if old is not None:
+        fits = backend.merge_baseline(old, fits)
+    save_fits(backend, fits, path)
+    return fits
+
+
+def output_format(config):
+    if config.output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format {config.output_format}, expected one of {OUTPUT_FORMATS}")
+    return config.output_format
+
+
+# Cell level plot data of a split, with cycle_no, qd and cell_column
+def save_cells(backend, frame, path, config, ids, cell_column='battery_name', replace=False, append=False):
+    if output_format(config) == 'parquet':
+        backend.save_dataset(backend.cell_frame(frame, cell_column, ids), f"{path}/{CELLS_PREFIX}",
+                             CELL_DATASET_SCHEMA, 'batt', replace=replace, sort_key=['cell', 'cycle'], append=append)
+    else:
+        backend.save_data(frame, path, cell_column, header=True, replace=replace,
+                          sort_key='cycle_no', append=append)
+
+
+# Cell frame of a split, restricted to cells if given. Parquet datasets are
+# only read for the batteries of cells, and only the needed columns.
+def load_cells(backend, path, config, ids, cells=None):
+    if output_format(config) == 'parquet':
+        batteries = None if cells is None else backend.cell_batteries(ids, cells)
+        return backend.read_dataset(f"{path}/{CELLS_PREFIX}", CELL_DATASET_SCHEMA, 'batt', batteries, cells)
+    return backend.read_cells(path, ids, cells)
+
+
+# Cell frames of all splits, tagged with a split column
+def load_splits(backend, base_path, config, ids, cells=None):
+    if output_format(config) == 'parquet':
+        paths = {key: f"{base_path}/{key}/{CELLS_PREFIX}" for key in SPLITS}
+        return backend.read_datasets(paths, CELL_DATASET_SCHEMA, 'batt')
+    return backend.read_splits(base_path, SPLITS, ids, cells)
+
+
+# Battery level SOH/RUL of a split. CSV battery files are written next to
+# the cell files and only replace the files of the same batteries, so the
+# cells stay readable by later runs.
+def save_stats(backend, frame, path, config, replace=True):
+    if output_format(config) == 'parquet':
+        backend.save_dataset(frame, f"{path}/{STATS_PREFIX}", STATS_DATASET_SCHEMA, 'batt',
+                             replace=replace, sort_key='cycle')
+    else:
+        backend.save_data(frame, path, "batt", header=True, sort_key='cycle')
+
+
+# Downsampled levels of a split. Both formats use cells/ and stats/ below
+# each level, CSV files are named after the cell or battery.
+def save_levels(backend, cells, stats, path, config, replace=True):
+    parquet = output_format(config) == 'parquet'
+    for n_out in config.downsample_levels:
+        level = f"{path}/{LEVELS_PREFIX}/{n_out}"
+        cell_level = backend.downsample(cells, 'cell', n_out)
+        stats_level = backend.downsample(stats, 'batt', n_out)
+        if parquet:
+            backend.save_dataset(cell_level, f"{level}/{CELLS_PREFIX}", CELL_DATASET_SCHEMA, 'batt',
+                                 replace=replace, sort_key=['cell', 'cycle'])
+            backend.save_dataset(stats_level, f"{level}/{STATS_PREFIX}", STATS_DATASET_SCHEMA, 'batt',
+                                 replace=replace, sort_key='cycle')
+        else:
+            backend.save_data(cell_level[['cycle', 'qd', 'cell']], f"{level}/{CELLS_PREFIX}", 'cell',
+                              header=True, replace=replace, sort_key='cycle')
+            backend.save_data(stats_level, f"{level}/{STATS_PREFIX}", 'batt',
+                              header=True, replace=replace, sort_key='cycle')
+
+
+# {battery: {field: value}} of the headerless location table
+def parse_locations(text):
+    locations = {}
+    for row in csv.reader(io.StringIO(text or '')):
+        if len(row) <= len(LOCATION_FIELDS):
+            continue
+        record = dict(zip(LOCATION_FIELDS, (v.strip() for v in row[1:])))
+        record['lng'], record['lat'] = float(record['lng']), float(record['lat'])
+        locations[row[0].strip()] = record
+    return locations
+
+
+# {battery: site} of parsed locations
+def battery_sites(locations):
+    return {batt: f"{record['country']}/{record['city']}" for batt, record in locations.items()}
+
+
+def finite(value):
+    return value if value is not None and math.isfinite(value) else None
+
+
+# RUL of a summary record, a model past end of life gives negative values
+def remaining(rul):
+    rul = finite(rul)
+    return None if rul is None else max(rul, 0.0)
+
+
+# Summary index of a post processing run. latest holds latest_stats per
+# split; batteries missing from this run keep their previous record.
+# Observed values come from the later of the past and actual splits,
+# end of life from the predictions when there are some. RUL is clamped at
+# 0, and end of life is null once SOH is down to it. fitted holds the
+# fitted end of life cycle per battery for FIT_RUL_MODEL.
+def build_summary(latest, locations, previous=None, model=RUL_MODEL, fitted=None):
+    batteries = dict((previous or {}).get('batteries', {}))
+    fitted = fitted or {}
+
+    observed = {}
+    for key in ('past', 'actual', 'live'):
+        for batt, cycle, soh, rul in latest.get(key, []):
+            if batt not in observed or cycle > observed[batt][0]:
+                observed[batt] = (cycle, soh, rul)
+    for batt, (cycle, soh, rul) in observed.items():
+        record = batteries.setdefault(batt, {'batt': batt})
+        record.update(cycle=int(cycle), soh=finite(soh), rul=remaining(rul),
+                      eol_cycle=calc_eol_cycle(cycle, soh, model, fitted.get(batt)))
+
+    for batt, cycle, soh, rul in latest.get('predictions', []):
+        record = batteries.setdefault(batt, {'batt': batt})
+        record.update(forecast_cycle=int(cycle), forecast_soh=finite(soh), forecast_rul=remaining(rul),
+                      eol_cycle=calc_eol_cycle(cycle, soh, model, fitted.get(batt)))
+
+    for batt, record in batteries.items():
+        record.update(locations.get(batt, dict.fromkeys(LOCATION_FIELDS)))
+
+    return {
+        'updated': datetime.now(timezone.utc).isoformat(),
+        'batteries': dict(sorted(batteries.items())),
+    }
+
+
+# {battery: eol_cycle} of a battery fits table (BATTERY_FIT_SCHEMA)
+def fitted_eol_cycles(text):
+    return {row['batt']: float(row['eol_cycle']) for row in csv.DictReader(io.StringIO(text or ''))
+            if row['eol_cycle']}
+
+
+# Write <pipeline>/summary.json, merged with the one of a previous run
+def save_summary(backend, pipeline_path, latest, config):
+    key = f"{pipeline_path}/{SUMMARY_KEY}"
+    previous = backend.read_text(key)
+    fitted = None
+    if config.rul_model == FIT_RUL_MODEL:
+        fitted = fitted_eol_cycles(backend.read_text(f"{pipeline_path}/{FITS_PREFIX}/batteries.csv"))
+    summary = build_summary(latest, parse_locations(backend.read_text(config.locations_key)),
+                            json.loads(previous) if previous else None, config.rul_model, fitted)
+    backend.write_text(key, json.dumps(summary, separators=(',', ':')))
+    print(f"Summary of {len(summary['batteries'])} batteries written to {key}")
+
+
+# (seconds, months) between two cycles for a Forecast frequency
+def frequency_step(frequency):
+    if frequency in FREQUENCY_SECONDS:
+        return FREQUENCY_SECONDS[frequency], 0
+    if frequency in FREQUENCY_MONTHS:
+        return 0, FREQUENCY_MONTHS[frequency]
+    raise ValueError(f"Unsupported frequency {frequency}")
+
+
+# Treat int as step number offset from Jan 1, init_year. Ex: 1 -> 2000-01-01
+def cycle_to_date(cycle, init_year=INIT_YEAR, frequency=FREQUENCY):
+    seconds, months = frequency_step(frequency)
+    if months:
+        total = (int(cycle) - 1)*months
+        res_date = datetime(init_year + total // 12, total % 12 + 1, 1)
+    else:
+        res_date = datetime(init_year, 1, 1) + timedelta(seconds=(int(cycle) - 1)*seconds)
+    # Forecast expects yyyy-MM-dd HH:mm:ss by default
+    return res_date.strftime("%Y-%m-%d %H:%M:%S")
+
+
+# Convert Forecast date (2000-01-01T00:00:00Z) back to step number
+def date_to_cycle(date_str, init_year=INIT_YEAR, frequency=FREQUENCY):
+    req = datetime.fromisoformat(date_str[:19])
+    seconds, months = frequency_step(frequency)
+    if months:
+        return ((req.year - init_year)*12 + req.month - 1) // months + 1
+    delta = req - datetime(init_year, 1, 1)
+    return round(delta.total_seconds() / seconds) + 1
+
+
+# Unix time of Jan 1 00:00:00 UTC of the year
+def epoch_seconds(init_year):
+    return (datetime(init_year, 1, 1) - datetime(1970, 1, 1)).days*24*3600
+
+
+# 64 bit offset added to cell IDs before hashing them, for a seed
+def hash_offset(seed):
+    return (seed + 1)*HASH_GOLDEN % 2**64
+
+
+# Two's complement reading of an unsigned 64 bit value, as Spark longs are
+def signed64(value):
+    return value - 2**64 if value >= 2**63 else value
+
+
+# Test cells out of sampled (cell, battery) pairs. A battery with fewer
+# eligible cells than cells_per_battery keeps all of them.
+def sampled_cells(pairs, config):
+    if config.sampling:
+        counts = {}
+        for _, batt in pairs:
+            counts[batt] = counts.get(batt, 0) + 1
+        short = sum(1 for n in counts.values() if n < config.cells_per_battery)
+        if short:
+            print(f"{short} of {len(counts)} batteries have fewer than {config.cells_per_battery} eligible cells, "
+                  f"all of their cells are used")
+    return sorted(cell for cell, _ in pairs)
+
+
+# Quality report of a validation, and the rows of quarantined cells if any
+def save_validation(backend, validation, base, append=False):
+    backend.save_data(validation.report, f"{base}/{QUALITY_REPORT_KEY}", header=True, append=append)
+    quarantined = validation.statuses.get('quarantined', 0)
+    if quarantined:
+        backend.save_data(validation.quarantine, f"{base}/{QUARANTINE_KEY}", header=True, append=append)
+    print(f"Validated {sum(validation.statuses.values())} cells, {validation.statuses.get('repaired', 0)} "
+          f"repaired, {quarantined} quarantined")
+
+
+# Cell ID lookup (CELL_IDS_SCHEMA) of a pipeline, None before its first run
+def read_cell_ids(backend, pipeline_path):
+    key = f"{pipeline_path}/{CELL_IDS_KEY}"
+    return backend.read_table(key, CELL_IDS_SCHEMA) if backend.exists(key) else None
+
+
+# Every converted row: the plan frame once complete, else the rows it was
+# planned from
+def all_rows(plan, converted):
+    return plan.frame if plan.complete else converted
+
+
+# Steps of the processing plugin, raw dataset -> Forecast inputs and UI plots.
+# frame holds the rows of a micro-batch in place of the raw dataset.
+def run_processing(backend, raw_dataset_key, config=None, frame=None):
+    config = config or PipelineConfig()
+    base = raw_dataset_key.rsplit('/', 1)[0]
+    manifest_path = f"{base}/{MANIFEST_KEY}"
+
+    # Import raw dataset
+    InputRaw_Node = backend.read_raw(raw_dataset_key) if frame is None else frame
+
+    # Drop bad rows, fill small gaps and quarantine bad cells up front, so
+    # every branch below sees contiguous, consistent series
+    Validated_Node = None
+    if config.validation:
+        Validated_Node = backend.validate(InputRaw_Node, config)
+        save_validation(backend, Validated_Node, base, append=frame is not None)
+        InputRaw_Node = Validated_Node.frame
+
+    # Integer cell and battery IDs used by every sort, join and filter below.
+    # Known cells keep their IDs across runs, new ones are appended.
+    ids = read_cell_ids(backend, base)
+    CellIds_Node = backend.cache(backend.calc_cell_ids(InputRaw_Node, ids))
+    if ids is None:
+        backend.save_data(CellIds_Node, f"{base}/{CELL_IDS_KEY}", header=True)
+    else:
+        backend.save_data(backend.new_cell_ids(CellIds_Node, ids), f"{base}/{CELL_IDS_KEY}", header=True,
+                          append=True)
+
+    # Preprocessing to get typed, integer encoded columns from TS data
+    ConvertTS_Node = backend.convert_ts(InputRaw_Node, config, CellIds_Node)
+
+    # Cutoff and test cells shared by all output branches. Incremental runs
+    # after the first one only carry the cycles past each cell's watermark,
+    # and their outputs are appended to the existing files. A micro-batch
+    # doesn't hold the earlier cycles, so only batch runs move cutoffs.
+    manifest = None
+    if config.incremental and backend.exists(manifest_path):
+        manifest = backend.read_table(manifest_path, MANIFEST_SCHEMA)
+        Plan_Node = backend.plan_incremental(ConvertTS_Node, manifest, config, CellIds_Node, frame is None)
+    else:
+        Plan_Node = backend.plan(ConvertTS_Node, config, CellIds_Node)
+    append = not Plan_Node.complete
+
+    # The actual cycles of a test cell move with its cutoff, so the test
+    # outputs of a run moving any are rewritten from all converted rows
+    Test_Plan_Node = Plan_Node
+    if Plan_Node.moved:
+        Test_Plan_Node = replace(Plan_Node, frame=ConvertTS_Node, branches=[])
+    append_test = append and not Plan_Node.moved
+
+    # Extract and save training dataset w timestamp as single file for Forecast
+    # Single file outputs keep the (cycle_no, cell_id) order of the plan
+    Train_ByTime_Node = Plan_Node.serve(backend.extract_train, config, False)
+    backend.save_data(Train_ByTime_Node, f"{base}/train_dataset.csv", append=append)
+
+    # Extract and save training dataset w cycle_no split by cell IDs for UI
+    Train_ByCycle_Node = Plan_Node.serve(backend.extract_train, config, True)
+    save_cells(backend, Train_ByCycle_Node, f"{base}/plot/past", config, CellIds_Node, append=append)
+
+    # Extract and save testing dataset w timestamp as single file for Forecast
+    Test_ByTime_Node = Test_Plan_Node.serve(backend.extract_test, config, False)
+    backend.save_data(Test_ByTime_Node, f"{base}/test_dataset.csv", append=append_test)
+
+    # Extract and save testing dataset w cycle_no split by cell IDs for UI
+    Test_ByCycle_Node = Test_Plan_Node.serve(backend.extract_test, config, True)
+    save_cells(backend, Test_ByCycle_Node, f"{base}/plot/actual", config, CellIds_Node, append=append_test)
+
+    # Extract and save test cell IDs for Forecast to generate predictions.
+    Test_Ids_Node = Plan_Node.serve(backend.extract_ids)
+    backend.save_data(Test_Ids_Node, f"{base}/test_ids.csv")
+
+    # Record the new watermarks for the next incremental run
+    if config.incremental:
+        backend.save_data(Plan_Node.serve(backend.calc_manifest, manifest), manifest_path, header=True)
+
+    # Fleet rollups over every cell. An incremental plan only holds the new
+    # cycles, its rollups are computed from all converted rows.
+    if config.rollups:
+        Plan_Node.serve(lambda plan: save_rollups(backend, all_rows(plan, ConvertTS_Node), CellIds_Node, base, config),
+                        name='rollups')
+
+    # Module anomalies over every cell, from all converted rows as well
+    if config.anomaly_window:
+        Plan_Node.serve(lambda plan: run_anomalies(backend, all_rows(plan, ConvertTS_Node), CellIds_Node, base, config),
+                        name='anomalies')
+
+    backend.release(Plan_Node.frame)
+    backend.release(CellIds_Node)
+    if Validated_Node is not None:
+        backend.release(Validated_Node.frame)
+        backend.release(Validated_Node.report)
+
+    print(f"Cutoff {Plan_Node.cutoff}, {len(Plan_Node.test_set)} test cells, "
+          f"{len(Plan_Node.moved or [])} cutoffs moved, {Plan_Node.scans_avoided} source scans avoided")
+
+    # Baseline to compare the Forecast predictions against
+    if config.baseline_forecast:
+        run_baseline_forecast(backend, base, config)
+    return Plan_Node
+
+
+# Rollups of a converted frame, recomputed in full on every run
+def save_rollups(backend, frame, ids, base, config):
+    sites = battery_sites(parse_locations(backend.read_text(config.locations_key)))
+    Rollup_Node = backend.rollup(frame, ids, sites)
+    path = f"{base}/{ROLLUP_PREFIX}"
+    if output_format(config) == 'parquet':
+        backend.save_dataset(Rollup_Node, path, ROLLUP_SCHEMA, 'level', replace=True, sort_key=['cycle'])
+    else:
+        backend.save_data(Rollup_Node, path, 'level', header=True, replace=True, sort_key=['site', 'batt', 'cycle'])
+    return Rollup_Node
+
+
+# Baseline forecast of the test cells from the saved train dataset and test
+# IDs, written as a Forecast export under output_path
+def run_baseline_forecast(backend, base, config=None, output_path=None):
+    config = config or PipelineConfig()
+    output_path = output_path or f"{base}/{BASELINE_FORECAST_PREFIX}"
+
+    train = backend.read_table(f"{base}/train_dataset.csv", TRAIN_DATASET_SCHEMA, header=False)
+    ids = backend.read_table(f"{base}/test_ids.csv", TEST_IDS_SCHEMA, header=False)
+    Forecast_Node = backend.baseline_forecast(train, ids, config, read_cell_ids(backend, base))
+    backend.save_data(Forecast_Node, f"{output_path}/{BASELINE_FORECAST_KEY}", header=True,
+                      sort_key=['item_id', 'date'])
+    return Forecast_Node
+
+
+# Steps of the post processor, Forecast export -> battery level UI plots
+def run_post_processing(backend, output_path, config=None):
+    config = config or PipelineConfig()
+    base_path = output_path.rsplit('/', 1)[0]
+    baseline_path = f"{base_path.rsplit('/', 1)[0]}/{BASELINE_PREFIX}"
+    fits_path = f"{base_path.rsplit('/', 1)[0]}/{FITS_PREFIX}"
+
+    # Only the files of the test cells are read from the splits, the battery
+    # files of earlier runs sit next to them. Batteries of the cells come
+    # from the cell ID lookup of the processing plugin.
+    ids = backend.cache(read_cell_ids(backend, base_path.rsplit('/', 1)[0]))
+    cells = test_cells(backend, base_path.rsplit('/', 1)[0])
+    test_set = cells or None
+
+    # PART 1: Reorganize and rename prediction data
+    # The export is consumed: CSV cells replace every file under
+    # output_path, Parquet ones are written below it and the export files
+    # are deleted. A rerun without a new export keeps the converted cells.
+    files = export_files(backend, output_path, cells, backend.cell_batteries(ids, cells))
+    if files:
+        InputRaw_Node = backend.read_frame(output_path, files)
+        ConvertTS_Node = backend.convert_forecasts(InputRaw_Node, config)
+        save_cells(backend, ConvertTS_Node, output_path, config, ids, 'item_id', replace=True)
+        if output_format(config) == 'parquet':
+            backend.delete(files)
+    else:
+        print(f"No new Forecast export under {output_path}, keeping the converted predictions")
+
+    # PART 2: Forecast accuracy of the test cells
+    if config.backtest_origins:
+        frames = load_test_cells(backend, base_path, config, ids)
+        if frames is None:
+            print("No test cell files left to score")
+        else:
+            run_backtest(backend, frames, base_path, config)
+            for frame in frames.values():
+                if frame is not None:
+                    backend.release(frame)
+
+    # PART 3: Add battery-level data for SOH and RUL
+    # Baseline comes from the past split, or from a previous run
+    baseline = read_baseline(backend, baseline_path)
+    manifest_path = f"{base_path.rsplit('/', 1)[0]}/{MANIFEST_KEY}"
+    if config.incremental and backend.exists(manifest_path):
+        manifest = backend.read_table(manifest_path, MANIFEST_SCHEMA)
+        latest = add_stats_incremental(backend, base_path, manifest, baseline, baseline_path, fits_path, config, ids)
+    elif config.single_pass:
+        latest = add_stats_single_pass(backend, base_path, baseline, baseline_path, fits_path, config, ids,
+                                       test_set)
+    else:
+        latest = {}
+        fits = None
+        for key in SPLITS:
+            split = backend.cache(load_cells(backend, f"{base_path}/{key}", config, ids, test_set))
+            if key == 'past':
+                if baseline is None:
+                    baseline = backend.calc_baseline(split)
+                    save_baseline(backend, baseline, baseline_path)
+                fits = update_fits(backend, split, baseline, fits_path)
+            df = backend.cache(backend.add_stats(split, baseline, config, fits))
+            # Save data partitioned by battery
+            save_stats(backend, df, f"{base_path}/{key}", config)
+            save_levels(backend, split, df, f"{base_path}/{key}", config)
+            latest[key] = backend.latest_stats(df)
+            backend.release(df)
+            backend.release(split)
+
+    # PART 4: Battery summary index for the map and battery pages
+    save_summary(backend, base_path.rsplit('/', 1)[0], latest, config)
+    backend.release(ids)
+
+
+# Names of the test cells of a pipeline, the only cells with plot files
+def test_cells(backend, pipeline_path):
+    return (backend.read_text(f"{pipeline_path}/test_ids.csv") or '').split()
+
+
+# Keys of the Forecast export files under output_path: every CSV file but
+# the files of cells and of their batteries written there by earlier runs
+def export_files(backend, output_path, cells, batteries):
+    outputs = {f"{name}.csv" for name in list(cells) + list(batteries)}
+    return [key for key in backend.list_files(output_path) if key.rsplit('/', 1)[-1] not in outputs]
+
+
+# Cell frames of the test cells in each split, None for a split without
+# them, or None while past has none
+def load_test_cells(backend, base_path, config, ids):
+    cells = test_cells(backend, base_path.rsplit('/', 1)[0])
+    frames = {key: load_cells(backend, f"{base_path}/{key}", config, ids, cells) for key in SPLITS}
+    if not cells or frames['past'] is None:
+        return None
+    return {key: None if frame is None else backend.cache(frame) for key, frame in frames.items()}
+
+
+# Forecast accuracy of the test cell frames of each split
+def run_backtest(backend, frames, base_path, config):
+    pipeline_path = base_path.rsplit('/', 1)[0]
+    Backtest_Node = backend.backtest(frames, config)
+    backend.save_data(Backtest_Node, f"{pipeline_path}/{BACKTEST_KEY}", header=True,
+                      sort_key=['model', 'origin', 'batt', 'cell'])
+    return Backtest_Node
+
+
+# {battery: warning lists} in the shape of connected-batteries.json
+def build_module_warnings(statuses):
+    warnings = {}
+    for batt, modules, module, status in sorted(statuses):
+        if status == 'not_scored':
+            continue
+        record = warnings.setdefault(batt, {
+            'batteryName': batt,
+            'numberOfModules': int(modules),
+            'modulesUnderWarning': [],
+            'modulesNeedAttention': [],
+        })
+        if status == 'warning':
+            record['modulesUnderWarning'].append(int(module))
+        elif status == 'attention':
+            record['modulesNeedAttention'].append(int(module))
+    return warnings
+
+
+# Module anomalies of a converted frame, and the warning lists of the
+# batteries with enough cells to be scored
+def run_anomalies(backend, frame, ids, base, config):
+    Anomaly_Node = backend.cache(backend.anomalies(frame, ids, config))
+    backend.save_data(Anomaly_Node, f"{base}/{ANOMALIES_KEY}", header=True, sort_key=['batt', 'module'])
+
+    statuses = backend.module_statuses(Anomaly_Node)
+    warnings = build_module_warnings(statuses)
+    backend.write_text(f"{base}/{MODULE_WARNINGS_KEY}", json.dumps(warnings, indent=2))
+    backend.release(Anomaly_Node)
+    flagged = sum(len(w['modulesUnderWarning']) + len(w['modulesNeedAttention']) for w in warnings.values())
+    skipped = len({batt for batt, _, _, _ in statuses} - set(warnings))
+    print(f"{flagged} modules flagged in {len(warnings)} batteries, {skipped} batteries with too few cells not scored")
+    return warnings
+
+
+# All splits read in one scan and aggregated in one shuffle, then each
+# split is written from the cached result
+def add_stats_single_pass(backend, base_path, baseline, baseline_path, fits_path, config, ids, test_set=None):
+    cells = backend.cache(load_splits(backend, base_path, config, ids, test_set))
+    past = backend.select_split(cells, 'past')
+    if baseline is None:
+        baseline = backend.calc_baseline(past)
+        save_baseline(backend, baseline, baseline_path)
+    fits = update_fits(backend, past, baseline, fits_path)
+
+    stats = backend.cache(backend.add_stats(cells, baseline, config, fits))
+    latest = {}
+    for key in SPLITS:
+        df = backend.select_split(stats, key)
+        save_stats(backend, df, f"{base_path}/{key}", config)
+        save_levels(backend, backend.select_split(cells, key), df, f"{base_path}/{key}", config)
+        latest[key] = backend.latest_stats(df)
+
+    backend.release(stats)
+    backend.release(cells)
+    return latest
+
+
+# Only the batteries with new cycles are recomputed. Their cell files under
+# past and actual are kept for the next run, the battery files are
+# rewritten next to them. Predictions are a new forecast every time and are
+# processed in full.
+def add_stats_incremental(backend, base_path, manifest, baseline, baseline_path, fits_path, config, ids,
+                          splits=SPLITS):
+    cells = backend.affected_cells(manifest, ids)
+    print(f"{len(cells)} test cells in updated batteries")
+    test_set = test_cells(backend, base_path.rsplit('/', 1)[0]) or None
+
+    latest = {}
+    fits = read_fits(backend, fits_path)
+    for key in splits:
+        replace = key == 'predictions'
+        split = load_cells(backend, f"{base_path}/{key}", config, ids, test_set if replace else cells)
+        if split is None:
+            continue
+        split = backend.cache(split)
+        if key == 'past':
+            fresh = backend.calc_baseline(split)
+            baseline = fresh if baseline is None else backend.merge_baseline(baseline, fresh)
+            save_baseline(backend, baseline, baseline_path)
+            fits = update_fits(backend, split, baseline, fits_path, fits)
+        df = backend.cache(backend.add_stats(split, baseline, config, fits))
+        save_stats(backend, df, f"{base_path}/{key}", config, replace)
+        save_levels(backend, split, df, f"{base_path}/{key}", config, replace)
+        latest[key] = backend.latest_stats(df)
+        backend.release(df)
+        backend.release(split)
+    return latest
+
+
+# Running cell state of a stream, if any
+def read_live(backend, path):
+    if not backend.exists(f"{path}/cells.csv"):
+        return None
+    return backend.read_table(f"{path}/cells.csv", LIVE_CELL_SCHEMA)
+
+
+# One micro-batch of a stream over raw_prefix: the new rows go through the
+# processing steps as an incremental run, the running cell state is updated
+# from them, then SOH/RUL of the updated batteries is recomputed in past
+# and actual. Predictions only change with a new Forecast export.
+def run_micro_batch(backend, raw_prefix, frame, config=None):
+    # A cell may report a single new cycle. A micro-batch doesn't hold the
+    # earlier cycles to roll up or score, the live state stands in for them.
+    config = replace(config or PipelineConfig(), incremental=True, min_valid_rows=1, rollups=False,
+                     anomaly_window=0)
+    raw_prefix = raw_prefix.rstrip('/')
+    base = raw_prefix.rsplit('/', 1)[0]
+    live_path = f"{base}/{LIVE_PREFIX}"
+
+    raw = backend.cache(frame)
+    frame, files, rejected = backend.raw_by_name(raw)
+    if rejected:
+        key = f"{base}/{REJECTED_FILES_KEY}"
+        backend.write_text(key, (backend.read_text(key) or '') + ''.join(f"{f}\n" for f in rejected))
+        print(f"{len(rejected)} raw files rejected, their header doesn't name the columns "
+              f"{', '.join(name for name, _ in parse_schema(RAW_SCHEMA))}, see {key}")
+    if not files:
+        backend.release(raw)
+        return None
+
+    frame = backend.cache(frame)
+    plan = run_processing(backend, raw_prefix, config, frame)
+
+    # Collected before the state it was read from is replaced
+    cells = backend.cache(backend.update_live(plan, read_live(backend, live_path), config))
+    batteries = backend.live_batteries(cells)
+    latest = {'live': backend.latest_stats(batteries)}
+    backend.save_data(cells, f"{live_path}/cells.csv", header=True)
+    backend.save_data(batteries, f"{live_path}/batteries.csv", header=True)
+
+    manifest = backend.read_table(f"{base}/{MANIFEST_KEY}", MANIFEST_SCHEMA)
+    baseline_path = f"{base}/{BASELINE_PREFIX}"
+    latest.update(add_stats_incremental(backend, f"{base}/plot", manifest, read_baseline(backend, baseline_path),
+                                        baseline_path, f"{base}/{FITS_PREFIX}", config, plan.ids, STREAM_SPLITS))
+    save_summary(backend, base, latest, config)
+
+    backend.release(cells)
+    backend.release(frame)
+    backend.release(raw)
+    return plan
@@ -11,26 +11,92 @@
 # express or implied. See the License for the specific language governing
 # permissions and limitations under the License.
 
+import logging
 import sys
 from awsglue.transforms import *
 from awsglue.utils import getResolvedOptions
 from pyspark.context import SparkContext
 from awsglue.context import GlueContext
 from awsglue.job import Job
-from awsglue.dynamicframe import DynamicFrameCollection
-from awsglue.dynamicframe import DynamicFrame
-from pyspark.sql.functions import col, udf
-from pyspark.sql.types import StringType
-from datetime import datetime, date, timedelta
-import boto3
 
+# Shared pipeline library, passed to the job with --extra-py-files
+from instrumentation import InstrumentedBackend
+from pipeline_core import (
+    LOCATIONS_KEY,
+    PipelineConfig,
+    forecast_output_path,
+    get_optional_args,
+    parse_keys,
+    parse_levels,
+    run_pipelines,
+    run_post_processing,
+)
+from s3_finalize import FINALIZE_WORKERS
+from spark_backend import SparkBackend
+
+# Must match the epoch and frequency used by the processing plugin
 INIT_YEAR = 2000
+FREQUENCY = 'D'
+
+# Decay model for RUL, 'linear' (calc_rul), 'log' (calc_rul2) or 'fit' (end
+# of life cycle of the battery's fitted fade curve, see <pipeline>/fits/)
+RUL_MODEL = 'linear'
+
+# Read and aggregate past, actual and predictions in one pass
+SINGLE_PASS = False
+
+# Only process cycles added since the previous run, tracked per cell in
+# <pipeline>/manifest.csv. Has to be set for both jobs from the first run on.
+INCREMENTAL = False
+
+# Write a stage level run report under <pipeline>/reports/, and label the
+# Spark jobs of every stage in the Spark UI and event log. COUNT_ROWS adds
+# the rows and partitions of every stage's input and output to the report.
+# Each count is a Spark job of its own that recomputes uncached frames, so
+# it can cost as much as the stage itself.
+INSTRUMENT = False
+STAGE_MARKERS = False
+COUNT_ROWS = False
+
+# Format of the plot outputs, 'csv' or 'parquet' (partitioned by battery,
+# typed columns). Has to be the same for both jobs of a pipeline.
+OUTPUT_FORMAT = 'csv'
+
+# Points per series of the downsampled levels written next to the plot
+# outputs, comma separated. Empty to write none.
+DOWNSAMPLE_LEVELS = '200,1000'
+
+# Score the Forecast export against the actual split, and backtest the
+# built-in baseline forecaster from this many origins, to
+# <pipeline>/backtest.csv. 0 to skip.
+BACKTEST_ORIGINS = 3
+
+# output_path may list several pipelines, comma separated, as Forecast
+# export paths or pipeline prefixes. Up to PIPELINE_WORKERS of them are
+# post processed at once in this job's Spark session.
+PIPELINE_WORKERS = 4
 
 args = getResolvedOptions(sys.argv, [
     'JOB_NAME',
     's3_bucket',
     'output_path'
 ])
+args.update(get_optional_args(sys.argv, {
+    'init_year': INIT_YEAR,
+    'frequency': FREQUENCY,
+    'finalize_workers': FINALIZE_WORKERS,
+    'incremental': INCREMENTAL,
+    'instrument': INSTRUMENT,
+    'stage_markers': STAGE_MARKERS,
+    'count_rows': COUNT_ROWS,
+    'output_format': OUTPUT_FORMAT,
+    'locations_key': LOCATIONS_KEY,
+    'downsample_levels': DOWNSAMPLE_LEVELS,
+    'rul_model': RUL_MODEL,
+    'single_pass': SINGLE_PASS,
+    'backtest_origins': BACKTEST_ORIGINS,
+    'pipeline_workers': PIPELINE_WORKERS,
+}))
 
 sc = SparkContext.getOrCreate()
 glueContext = GlueContext(sc)
@@ -38,220 +104,40 @@ spark = glueContext.spark_session
 job = Job(glueContext)
 job.init(args['JOB_NAME'], args)
 
-s3 = boto3.client('s3')
-bucket = args['s3_bucket']
-base_path = args['output_path'].rsplit('/', 1)[0]
-
-
-#################################################
-# PART 1: Reorganize and rename prediction data #
-##################################################
-
-
-# Convert date to day number offset from starting date of Jan 1, 2000
-def date_to_day_num(date_str):
-    req = datetime.fromisoformat(date_str[:-1])
-    delta = req - datetime(INIT_YEAR, 1, 1, 0, 0, 0)
-    return delta.days + 1
-
-
-# Replace Spark autogen key with expected filename for all objects in directory
-def rename_files(s3_path):
-    files = s3.list_objects(
-        Bucket=bucket,
-        Prefix=s3_path,
-    )
-
-    for f in files["Contents"]:
-        f_name = f["Key"]
-        p_name = f_name.rsplit('/', 1)[0]
-
-        if '=' in p_name:
-            p_id = p_name.split('=', 1)[1]
-            p_name = f"{p_name.rsplit('/', 1)[0]}/{p_id}.csv"
-
-        s3.copy_object(Bucket=bucket, CopySource=f"{bucket}/{f_name}", Key=p_name)
-        s3.delete_object(Bucket=bucket, Key=f_name)
-
-
-# Script generated for ConvertTS Transform
-def ConvertTS_Transform(glueContext, dynamicFrame) -> DynamicFrame:
-    df = dynamicFrame.toDF()
-    
-    # Change fake incremental days back to cycle_no. Ex: date_to_day_num("2000-01-01") -> 1
-    toDateUDF = udf(lambda i: date_to_day_num(i), StringType()) 
-    df = df.withColumn('cycle_no', toDateUDF(df['date'])) \
-           .withColumnRenamed('p50', 'qd')
-    
-    # Sort values by cell_id, cycle_no to adhere to UI expectations
-    df = df.sort(['item_id', 'cycle_no'])
-    
-    # Drop date column
-    df = df[['item_id', 'cycle_no', 'qd']]
-
-    return DynamicFrame.fromDF(df, glueContext, "timeseries_set")
-
-
-# Script generated for SaveData Transform
-def SaveData_Transform(input_node, s3_path, partition_key):
-    glueContext.write_dynamic_frame.from_options(
-        frame=input_node.coalesce(1),
-        connection_type="s3",
-        format="csv",
-        format_options={
-            "quoteChar": -1,
-            "writeHeader": True
-        }, 
-        connection_options={
-            "path": f"s3://{bucket}/{s3_path}",
-            "partitionKeys": [partition_key]
-        },
-    )
-    rename_files(s3_path)
-    # Delete orphaned node in S3
-    s3.delete_object(Bucket=bucket, Key=s3_path)
-    
-# Import forecasts from S3 bucket
-InputRaw_Node = glueContext.create_dynamic_frame.from_options(
-    format_options={
-        "quoteChar": '"',
-        "withHeader": True,
-        "separator": ",",
-        "optimizePerformance": True,
-    },
-    connection_type="s3",
-    format="csv",
-    connection_options={
-        "paths": [f"s3://{bucket}/{args['output_path']}"],
-        "recurse": False,
-    }
+# Pipeline progress and failures go to the driver log
+logging.basicConfig(level=logging.INFO)
+
+config = PipelineConfig(
+    init_year=args['init_year'],
+    frequency=args['frequency'],
+    rul_model=args['rul_model'],
+    single_pass=args['single_pass'],
+    incremental=args['incremental'],
+    output_format=args['output_format'],
+    locations_key=args['locations_key'],
+    downsample_levels=parse_levels(args['downsample_levels']),
+    backtest_origins=args['backtest_origins'],
 )
 
-# Preprocessing to get cycle_no from TS data
-ConvertTS_Node = ConvertTS_Transform(glueContext, InputRaw_Node)
-
-SaveData_Transform(ConvertTS_Node, args['output_path'], "item_id")
-
-
-##################################################
-# PART 2: Add battery-level data for SOH and RUL #
-##################################################
-
-import math
-import builtins as py_builtin
-from pyspark.sql.functions import min as min_
-from pyspark.sql.functions import udf, input_file_name
-
-
-QD_ORIG = {}
-
-def get_qd_orig(batt):
-    return QD_ORIG[batt]
-
-
-# Extract battery ID from S3 file URI
-def extract_battery(file):
-    return file.split('/')[-1].split('.')[0][:2]
-
-
-def calc_soh(qd, batt, qd_orig):
-    soh = qd*100/qd_orig
-    soh = py_builtin.min(soh, 100.0)
-    return str(round(soh, 2))
-
-    
-# calculated assuming constant decay
-# Qd = Qd_orig - J*cycle
-def calc_rul(qd, batt, cycle, qd_orig):
-    qd_dead = 0.8*qd_orig
-    if qd == qd_orig:
-        return 100.0
-    
-    c_dead = cycle*(qd_dead - qd)/(qd - qd_orig)
-    rul = (c_dead - cycle)*100/c_dead
-    return round(py_builtin.min(rul, 100.0), 2)
-    
-    
-# calcualted assuming logarithmic decay
-# Qd = Qd_orig * J^cycle
-def calc_rul2(qd, batt, cycle, qd_orig):
-    qd_dead = 0.8*qd_orig
-    if qd == qd_orig:
-        return 100.0
-    
-    c_dead = cycle*math.log(qd_dead/qd)/math.log(qd/qd_orig)
-    rul = (c_dead - cycle)*100/c_dead
-    return round(py_builtin.min(rul, 100.0), 2)
-
-    
-
-battUDF = udf(lambda i: extract_battery(i)) 
-origUDF = udf(lambda i: get_qd_orig(i), 'float')
-sohUDF = udf(lambda i, j, k: calc_soh(i, j, k))
-rulUDF = udf(lambda i, j, k, l: calc_rul(i, j, k, l))
-
-
-# Read data from directory
-def read_frame(key) -> DynamicFrame:
-    return glueContext.create_dynamic_frame.from_options(
-        format_options={
-            "quoteChar": '"',
-            "withHeader": True,
-            "separator": ",",
-            "optimizePerformance": True,
-        },
-        connection_type="s3",
-        format="csv",
-        connection_options={
-            "paths": [f"s3://{bucket}/{base_path}/{key}/"],
-            "recurse": False,
-        }
-    )
-
-
-# Take avg of cell Qd values across cycles for each battery
-def get_avg_qd(df):
-    df = df.withColumn("batt", battUDF(input_file_name())) \
-       .withColumn('cycle', df['cycle_no'].cast('int')) \
-       .withColumn('qd', df['qd'].cast('float'))
-    
-    return df.groupBy('batt', 'cycle').mean('qd') \
-       .withColumnRenamed('avg(qd)', 'qd').sort('cycle')
-
-
-# Store original Qd values for each battery in dictionary
-# {'b3': 1.0652467558781307, 'b1': 1.0782249867916107}
-def calc_qd_orig(df):
-    min_cycle = df.select(min_("cycle")).first().asDict()['min(cycle)']
-    df_min = df.filter(df['cycle'] == min_cycle).drop('cycle')
-    data_min = df_min.toPandas().to_dict(orient='list')
 
-    for i in range(0, len(data_min['batt'])):
-        key = data_min['batt'][i]
-        val = data_min['qd'][i]
-        QD_ORIG[key] = val
+# Every pipeline gets its own backend, so run reports stay separate
+def post_process(output_path):
+    backend = SparkBackend(glueContext, args['s3_bucket'], finalize_workers=args['finalize_workers'])
+    if args['instrument']:
+        backend = InstrumentedBackend(backend, count_rows=args['count_rows'], markers=args['stage_markers'])
 
+    # PART 1: Reorganize and rename prediction data
+    # PART 2: Score the forecasts and flag the module anomalies of the test cells
+    # PART 3: Add battery-level data for SOH and RUL, and the downsampled levels
+    # PART 4: Write the battery summary index
+    # All are defined in pipeline_core.run_post_processing
+    run_post_processing(backend, output_path, config)
 
-# Add SOH and RUL calculations to Frame
-def AddStats_Transform(glueContext, key) -> DynamicFrame:
-    df = read_frame(key).toDF()
-    df = get_avg_qd(df)
-    
-    if key == 'past':
-        calc_qd_orig(df)
-        
-    df = df.withColumn('qd_orig', origUDF('batt')) \
-           .withColumn('soh', sohUDF('qd', 'batt', 'qd_orig')) \
-           .withColumn('rul', rulUDF('qd', 'batt', 'cycle', 'qd_orig'))
-    df = df[['cycle', 'soh', 'rul', 'qd', 'batt']]
-    
-    # Save data partitioned by battery
-    StatsLoaded_Node = DynamicFrame.fromDF(df, glueContext, f"{key}_stats_loaded")
-    SaveData_Transform(StatsLoaded_Node, f"{base_path}/{key}", "batt")
+    if args['instrument']:
+        backend.write_report(output_path.rsplit('/', 2)[0], 'post_processor', config)
 
 
-# Load QD, SOH and RUL values by battery
-for key in ['past', 'actual', 'predictions']:
-    AddStats_Transform(glueContext, key)
+output_paths = [forecast_output_path(key) for key in parse_keys(args['output_path'])]
+run_pipelines(post_process, output_paths, lambda path: path.rsplit('/', 2)[0], args['pipeline_workers'])
 
 job.commit()
\ No newline at end of file
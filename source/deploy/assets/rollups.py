@@ -0,0 +1,109 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# Per cycle rollups of cell values to battery, site and fleet level.
+#
+# Rows are read once, into sums and quantile sketches per (site, battery,
+# cycle). A sketch is the histogram of a column on a fixed grid, stored
+# sparsely as (group, bin, count) triples. Sketches merge by adding counts,
+# so every level above batteries is computed from the one below, and its
+# quantiles are exact to half a grid step.
+
+import numpy as np
+import pandas as pd
+
+# Levels from the finest, with the columns identifying their groups
+LEVEL_KEYS = (
+    ('battery', ['site', 'batt', 'cycle']),
+    ('site', ['site', 'cycle']),
+    ('fleet', ['cycle']),
+)
+
+# Quantiles reported, as column suffixes
+QUANTILES = {'p5': 0.05, 'p50': 0.5, 'p95': 0.95}
+
+# Spark's percentile_approx accuracy, its rank error is 1/ACCURACY of the
+# group size
+PERCENTILE_ACCURACY = 10000
+
+# Grid step of the sketch of each column rolled up. SOH is rounded to it.
+SKETCH_STEPS = {'qd': 1e-4, 'soh': 0.01}
+
+
+# (group, bin, count) of values on a grid, sorted by group then bin
+def sketch(group, values, step):
+    bins = np.rint(np.asarray(values, dtype=np.float64)/step).astype(np.int64)
+    return _count(np.asarray(group, dtype=np.int64), bins, np.ones(len(bins), dtype=np.int64))
+
+
+# Sketch of the parent groups, parent[g] being the parent of group g
+def merge_sketch(sk, parent):
+    group, bins, counts = sk
+    return _count(np.asarray(parent, dtype=np.int64)[group], bins, counts)
+
+
+def _count(group, bins, counts):
+    if not len(bins):
+        return group, bins, counts
+    low = bins.min()
+    span = bins.max() - low + 1
+    keys, inverse = np.unique(group*span + (bins - low), return_inverse=True)
+    return keys // span, keys % span + low, np.bincount(inverse, weights=counts).astype(np.int64)
+
+
+# Inverted CDF quantile q of every group of a sketch, in value units
+def sketch_quantile(sk, n_groups, q, step):
+    group, bins, counts = sk
+    if not len(bins):
+        return np.full(n_groups, np.nan)
+    total = np.bincount(group, weights=counts, minlength=n_groups)
+    cum = np.cumsum(counts)
+    before = np.cumsum(total) - total
+    rank = np.maximum(np.ceil(q*total), 1)
+    pos = np.minimum(np.searchsorted(cum, before + rank), len(cum) - 1)
+    return np.where(total > 0, bins[pos]/np.rint(1/step), np.nan)
+
+
+# Rollup rows (level, site, batt, cycle, cells, <column>_mean, _min, _p5,
+# _p50, _p95 for each column) of a pandas frame with site, batt, cycle and
+# the columns rolled up, one row per cell and cycle
+def rollup_frame(df, columns=('qd', 'soh'), steps=SKETCH_STEPS):
+    _, keys = LEVEL_KEYS[0]
+    groups = df.groupby(keys, sort=True)
+    code = groups.ngroup().to_numpy()
+    sums = groups[list(columns)].agg(['sum', 'min'])
+    table = sums.index.to_frame(index=False).assign(cells=groups.size().to_numpy())
+    for c in columns:
+        table[f"{c}_sum"], table[f"{c}_min"] = sums[(c, 'sum')].to_numpy(), sums[(c, 'min')].to_numpy()
+    sketches = {c: sketch(code, df[c], steps[c]) for c in columns}
+
+    levels = []
+    for i, (level, keys) in enumerate(LEVEL_KEYS):
+        if i:
+            parent = table.groupby(keys, sort=True).ngroup().to_numpy()
+            table = table.groupby(keys, sort=True, as_index=False).agg(
+                cells=('cells', 'sum'),
+                **{f"{c}_sum": (f"{c}_sum", 'sum') for c in columns},
+                **{f"{c}_min": (f"{c}_min", 'min') for c in columns},
+            )
+            sketches = {c: merge_sketch(sk, parent) for c, sk in sketches.items()}
+
+        out = pd.DataFrame({'level': level, 'site': table.get('site'), 'batt': table.get('batt'),
+                            'cycle': table['cycle'], 'cells': table['cells']})
+        for c in columns:
+            out[f"{c}_mean"] = (table[f"{c}_sum"]/table['cells']).round(6)
+            out[f"{c}_min"] = table[f"{c}_min"].round(6)
+            for name, q in QUANTILES.items():
+                out[f"{c}_{name}"] = sketch_quantile(sketches[c], len(table), q, steps[c])
+        levels.append(out)
+    return pd.concat(levels, ignore_index=True)
@@ -0,0 +1,317 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# Finalize step run after a Spark write: Spark writes under a staging
+# prefix of its own, its autogen keys are then moved to the names the UI
+# and Forecast expect, and the staging prefix is deleted.
+#
+#   _tmp/<id>/battery_name=b1c0/part-00000-....csv -> <path>/b1c0.csv
+#   _tmp/<id>/part-00000-....csv                   -> <path>
+#
+# Listing is paginated, copies run on a bounded thread pool and deletes are
+# batched. Single file outputs written as several part files are merged by
+# streaming them into one multipart upload. Appending outputs concatenate
+# the existing object with the new parts the same way. Throughput can be compared
+# against a moto stand-in:
+#
+#   python s3_finalize.py --files 2000 --workers 1 8 32 --latency-ms 20
+
+import argparse
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError, ConnectionError
+
+# Concurrent copy requests per finalize
+FINALIZE_WORKERS = 16
+
+# Attempts per request before giving up, with exponential backoff
+FINALIZE_RETRIES = 5
+
+# Maximum keys accepted by a single DeleteObjects request
+DELETE_BATCH = 1000
+
+# Prefix of the staging directories of Spark writes
+STAGING_PREFIX = '_tmp'
+
+# Bytes read per request when streaming a source object
+READ_CHUNK = 1024*1024
+
+# Smallest part S3 accepts in a multipart upload, except for the last one
+MIN_PART_SIZE = 8*1024*1024
+
+# Error codes worth retrying, anything else fails the finalize
+RETRYABLE_ERRORS = {'SlowDown', 'Throttling', 'RequestTimeout', 'InternalError', 'ServiceUnavailable'}
+
+
+# Expected key for a key written by Spark under path
+def target_key(key):
+    p_name = key.rsplit('/', 1)[0]
+    if '=' in p_name:
+        p_id = p_name.split('=', 1)[1]
+        p_name = f"{p_name.rsplit('/', 1)[0]}/{p_id}.csv"
+    return p_name
+
+
+# Fresh staging prefix for one Spark write
+def staging_key():
+    return f"{STAGING_PREFIX}/{uuid.uuid4().hex}"
+
+
+# Chunks of a stream without its first line
+def skip_line(chunks):
+    chunks = iter(chunks)
+    for chunk in chunks:
+        end = chunk.find(b'\n')
+        if end >= 0:
+            yield chunk[end + 1:]
+            break
+    yield from chunks
+
+
+def with_retries(fn, retries=FINALIZE_RETRIES):
+    for attempt in range(retries):
+        try:
+            return fn()
+        except ClientError as err:
+            if err.response['Error']['Code'] not in RETRYABLE_ERRORS or attempt == retries - 1:
+                raise
+        except ConnectionError:
+            if attempt == retries - 1:
+                raise
+        time.sleep(min(0.1*2**attempt, 5) * (0.5 + random.random()))
+
+
+class S3Finalizer:
+
+    def __init__(self, s3, bucket, workers=FINALIZE_WORKERS, retries=FINALIZE_RETRIES):
+        self.s3 = s3
+        self.bucket = bucket
+        self.workers = workers
+        self.retries = retries
+
+    def list_keys(self, prefix):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for f in page.get('Contents', []):
+                yield f['Key']
+
+    def copy(self, src, dst):
+        with_retries(lambda: self.s3.copy_object(
+            Bucket=self.bucket, CopySource={'Bucket': self.bucket, 'Key': src}, Key=dst), self.retries)
+
+    def delete_keys(self, keys):
+        for i in range(0, len(keys), DELETE_BATCH):
+            batch = [{'Key': k} for k in keys[i:i + DELETE_BATCH]]
+            resp = with_retries(lambda: self.s3.delete_objects(
+                Bucket=self.bucket, Delete={'Objects': batch, 'Quiet': True}), self.retries)
+            if resp.get('Errors'):
+                raise RuntimeError(f"Failed to delete {len(resp['Errors'])} objects: {resp['Errors'][:3]}")
+
+    # Move the partition files Spark wrote under staging to their expected
+    # keys under path. With replace, any other CSV file directly under path
+    # is a leftover of the previous contents and is deleted; otherwise it is
+    # left alone. With append, a partition whose target already exists is
+    # added to its end. The staging prefix is left to discard().
+    def finalize(self, staging, path, replace=False, append=False, header=True):
+        start = time.time()
+        parts = {}
+        for key in self.list_keys(f"{staging}/"):
+            name = key[len(staging) + 1:]
+            if '=' in name.rsplit('/', 1)[0] and not name.rsplit('/', 1)[-1].startswith('_'):
+                parts.setdefault(target_key(f"{path}/{name}"), []).append(key)
+
+        existing = set(self.list_keys(f"{path}/")) if replace or append else set()
+        deletes = sorted(k for k in existing if replace and k not in parts and k.endswith('.csv')
+                         and '/' not in k[len(path) + 1:])
+
+        def move(dst):
+            sources = sorted(parts[dst])
+            if append and dst in existing:
+                sources.insert(0, dst)
+            if len(sources) == 1:
+                self.copy(sources[0], dst)
+            else:
+                self.concat(dst, sources, header)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(move, parts))
+        self.delete_keys(deletes)
+
+        return {
+            'path': path,
+            'copied': len(parts),
+            'appended': len(existing.intersection(parts)) if append else 0,
+            'deleted': len(deletes),
+            'seconds': round(time.time() - start, 3),
+        }
+
+    # Concatenate the part files Spark wrote under staging into the single
+    # object path, in key order. With append, an existing object at path
+    # is kept in front of the new parts.
+    def merge_parts(self, staging, path, header=False, append=False):
+        start = time.time()
+        parts = sorted(k for k in self.list_keys(f"{staging}/") if not k.rsplit('/', 1)[-1].startswith('_'))
+        if append and self.exists(path):
+            parts.insert(0, path)
+
+        self.concat(path, parts, header)
+
+        return {
+            'path': path,
+            'merged': len(parts),
+            'seconds': round(time.time() - start, 3),
+        }
+
+    # Delete everything under a staging prefix
+    def discard(self, staging):
+        self.delete_keys(list(self.list_keys(f"{staging}/")))
+
+    def exists(self, key):
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as err:
+            if err.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    # Write the sources one after the other into dst. Sources are streamed
+    # through a bounded buffer; large ones are copied server side when
+    # nothing is buffered. With header, only the first source keeps its
+    # header line, whatever the chunks it spans. A failed upload is aborted,
+    # so its parts aren't left behind.
+    def concat(self, dst, sources, header=False):
+        upload = MultipartWriter(self, dst)
+        try:
+            for i, key in enumerate(sources):
+                skip_header = header and i > 0
+                size = self.s3.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+                if not skip_header and not upload.buffered and size >= MIN_PART_SIZE:
+                    upload.copy_part(key)
+                    continue
+
+                chunks = self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].iter_chunks(READ_CHUNK)
+                for chunk in skip_line(chunks) if skip_header else chunks:
+                    upload.write(chunk)
+            upload.close()
+        except Exception:
+            upload.abort()
+            raise
+
+
+# Builds one object out of streamed bytes and server side part copies
+class MultipartWriter:
+
+    def __init__(self, finalizer, key):
+        self.s3 = finalizer.s3
+        self.bucket = finalizer.bucket
+        self.retries = finalizer.retries
+        self.key = key
+        self.upload_id = None
+        self.parts = []
+        self.buffer = bytearray()
+
+    @property
+    def buffered(self):
+        return len(self.buffer) > 0
+
+    def _start(self):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+
+    def _flush(self):
+        self._start()
+        number = len(self.parts) + 1
+        data = bytes(self.buffer)
+        resp = with_retries(lambda: self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=data), self.retries)
+        self.parts.append({'ETag': resp['ETag'], 'PartNumber': number})
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer.extend(data)
+        if len(self.buffer) >= MIN_PART_SIZE:
+            self._flush()
+
+    def copy_part(self, src):
+        self._start()
+        number = len(self.parts) + 1
+        resp = with_retries(lambda: self.s3.upload_part_copy(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number,
+            CopySource={'Bucket': self.bucket, 'Key': src}), self.retries)
+        self.parts.append({'ETag': resp['CopyPartResult']['ETag'], 'PartNumber': number})
+
+    def close(self):
+        # Small outputs never need a multipart upload
+        if self.upload_id is None:
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+            return
+        if self.buffered:
+            self._flush()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': self.parts})
+        self.upload_id = None
+
+    # Drop the parts uploaded so far, if any
+    def abort(self):
+        if self.upload_id is not None:
+            upload_id, self.upload_id = self.upload_id, None
+            with_retries(lambda: self.s3.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=upload_id), self.retries)
+
+
+# Time finalize of n partition files on moto, for each worker count
+def benchmark(files, workers, latency_ms=0):
+    import boto3
+    from botocore.config import Config
+    from moto import mock_aws
+
+    results = []
+    with mock_aws():
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='bench')
+
+        for n in workers:
+            staging = staging_key()
+            for i in range(files):
+                s3.put_object(Bucket='bench', Key=f"{staging}/battery_name=b{i % 10}c{i}/part-00000.csv",
+                              Body=b"cycle_no,qd\n")
+
+            # moto answers instantly, emulate the round trip to S3
+            client = boto3.client('s3', region_name='us-east-1',
+                                  config=Config(max_pool_connections=max(n, 10)))
+            if latency_ms:
+                client.meta.events.register('before-call.s3', lambda **kw: time.sleep(latency_ms / 1000))
+            stats = S3Finalizer(client, 'bench', workers=n).finalize(staging, f"bench/{n}/plot/past")
+            stats['workers'] = n
+            stats['files_per_second'] = round(files / max(stats['seconds'], 1e-9), 1)
+            results.append(stats)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the S3 finalize step against moto")
+    parser.add_argument("--files", type=int, default=1000, help="partition files to rename")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, FINALIZE_WORKERS], help="pool sizes to compare")
+    parser.add_argument("--latency-ms", type=float, default=0, help="emulated latency per S3 request")
+    args = parser.parse_args()
+
+    for stats in benchmark(args.files, args.workers, args.latency_ms):
+        print(stats)
+
+
+if __name__ == "__main__":
+    main()
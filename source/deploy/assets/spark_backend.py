@@ -0,0 +1,725 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# Glue/Spark implementation of the pipeline backend, reading and writing S3
+
+from awsglue.dynamicframe import DynamicFrame
+from pyspark import StorageLevel
+from pyspark.sql import DataFrame, Window, functions as F
+from pyspark.sql.functions import input_file_name
+from botocore.config import Config
+from functools import reduce
+import boto3
+
+from anomalies import module_anomalies
+from backtest import backtest_metrics
+from baseline_forecast import forecast_frame
+from downsample import downsample_frame
+from health_metrics import FIT_RUL_MODEL, RUL_MODEL, fade_fits, health_columns
+from pipeline_core import (
+    ANOMALY_SCHEMA,
+    BACKTEST_SCHEMA,
+    CELL_FIT_SCHEMA,
+    FORECAST_SCHEMA,
+    HASH_MIX,
+    HASH_SHIFTS,
+    QUALITY_REPORT_SCHEMA,
+    RAW_SCHEMA,
+    RAW_STREAM_SCHEMA,
+    ROLLUP_SCHEMA,
+    UNKNOWN_SITE,
+    Backend,
+    Baseline,
+    FadeFits,
+    ProcessingPlan,
+    Validation,
+    epoch_seconds,
+    frequency_step,
+    parse_schema,
+    hash_offset,
+    sampled_cells,
+    signed64,
+)
+from rollups import PERCENTILE_ACCURACY, QUANTILES
+from s3_finalize import FINALIZE_WORKERS, S3Finalizer, staging_key
+
+
+# Step number column -> Forecast timestamp string with native Spark date
+# arithmetic. Ex: 1 -> 2000-01-01 00:00:00 for INIT_YEAR 2000
+def cycle_to_date_col(cycle, init_year, frequency):
+    seconds, months = frequency_step(frequency)
+    # Long arithmetic, (cycle - 1) * seconds overflows an int past ~24855 days
+    step = cycle.cast('long') - 1
+    if months:
+        total = step * months
+        ts = F.format_string('%d-%02d-01', F.floor(total / 12) + init_year, total % 12 + 1)
+        ts = F.to_timestamp(ts, 'yyyy-MM-dd')
+    else:
+        ts = F.timestamp_seconds(F.lit(epoch_seconds(init_year)).cast('long') + step * seconds)
+    return F.date_format(ts, 'yyyy-MM-dd HH:mm:ss')
+
+
+# Forecast export timestamp column (2000-01-01T00:00:00Z) -> step number
+def date_to_cycle_col(date, init_year, frequency):
+    seconds, months = frequency_step(frequency)
+    ts = F.to_timestamp(F.regexp_replace(F.substring(date, 1, 19), 'T', ' '), 'yyyy-MM-dd HH:mm:ss')
+    if months:
+        total = (F.year(ts) - init_year) * 12 + F.month(ts) - 1
+        return (F.floor(total / months) + 1).cast('int')
+    delta = F.unix_timestamp(ts) - epoch_seconds(init_year)
+    return (F.round(delta / seconds) + 1).cast('int')
+
+
+# Seeded SplitMix64 hash of a cell ID column with wrapping long arithmetic,
+# equal to cell_hash of the local backend
+def cell_hash_col(cell_id, seed):
+    z = cell_id.cast('long') + F.lit(signed64(hash_offset(seed)))
+    for shift, mix in zip(HASH_SHIFTS, HASH_MIX):
+        z = z.bitwiseXOR(F.shiftRightUnsigned(z, shift)) * F.lit(signed64(mix))
+    return z.bitwiseXOR(F.shiftRightUnsigned(z, HASH_SHIFTS[-1]))
+
+
+class SparkBackend(Backend):
+
+    def __init__(self, glueContext, bucket, s3=None, finalize_workers=FINALIZE_WORKERS):
+        self.glueContext = glueContext
+        self.spark = glueContext.spark_session
+        self.bucket = bucket
+        self.s3 = s3 or boto3.client('s3', config=Config(
+            max_pool_connections=finalize_workers,
+            retries={'max_attempts': 10, 'mode': 'adaptive'},
+        ))
+        self.finalizer = S3Finalizer(self.s3, bucket, finalize_workers)
+
+        # Date arithmetic is defined in UTC, like Forecast timestamps
+        self.spark.conf.set('spark.sql.session.timeZone', 'UTC')
+
+    def _csv_frame(self, paths, recurse):
+        return self.glueContext.create_dynamic_frame.from_options(
+            format_options={
+                "quoteChar": '"',
+                "withHeader": True,
+                "separator": ",",
+                "optimizePerformance": True,
+            },
+            connection_type="s3",
+            format="csv",
+            connection_options={
+                "paths": [f"s3://{self.bucket}/{path}" for path in paths],
+                "recurse": recurse,
+            }
+        ).toDF()
+
+    def read_raw(self, key):
+        return self._csv_frame([key], True)
+
+    def read_frame(self, key, files=None):
+        return self._csv_frame([f"{key}/"] if files is None else files, False)
+
+    def list_files(self, key):
+        prefix = f"{key}/"
+        return sorted(k for k in self.finalizer.list_keys(prefix)
+                      if k.endswith('.csv') and '/' not in k[len(prefix):])
+
+    def delete(self, keys):
+        self.finalizer.delete_keys(list(keys))
+
+    def read_cells(self, key, ids, cells=None):
+        if cells is None:
+            return self.with_cell_keys(self.read_frame(key), ids)
+
+        # Cell files are listed once, missing ones are skipped
+        existing = set(self.finalizer.list_keys(f"{key}/"))
+        paths = [p for p in (f"{key}/{cell}.csv" for cell in cells) if p in existing]
+        return self.with_cell_keys(self._csv_frame(paths, False), ids) if paths else None
+
+    def read_splits(self, base_path, keys, ids, cells=None):
+        if cells is None:
+            paths = [f"{base_path}/{key}/" for key in keys]
+        else:
+            paths = [p for key in keys for p in self.list_files(f"{base_path}/{key}")
+                     if p.rsplit('/', 1)[-1][:-len('.csv')] in cells]
+        df = self._csv_frame(paths, False)
+        split = F.regexp_extract(input_file_name(), r'/([^/]+)/[^/]+$', 1)
+        return self.with_cell_keys(df.withColumn('split', split), ids)
+
+    def select_split(self, df, key):
+        return df.filter(df['split'] == key).drop('split')
+
+    # Partition values of a hive partitioned dataset, from its keys
+    def _partitions(self, path, partition_key):
+        prefix = f"{path}/{partition_key}="
+        return {key[len(prefix):].split('/', 1)[0] for key in self.finalizer.list_keys(prefix)}
+
+    # Partition filters prune the files listed, the schema prunes the
+    # columns read from each file
+    def read_dataset(self, path, schema, partition_key, partitions=None, cells=None):
+        found = self._partitions(path, partition_key)
+        if partitions is not None:
+            found = found.intersection(partitions)
+        if not found:
+            return None
+
+        df = self.spark.read.schema(f"{schema}, {partition_key} string").parquet(f"s3://{self.bucket}/{path}")
+        if partitions is not None:
+            df = df.filter(df[partition_key].isin(sorted(found)))
+        if cells is not None:
+            df = df.filter(df['cell'].isin(list(cells)))
+        return df
+
+    def read_datasets(self, paths, schema, partition_key):
+        frames = [(key, self.read_dataset(path, schema, partition_key)) for key, path in paths.items()]
+        frames = [df.withColumn('split', F.lit(key)) for key, df in frames if df is not None]
+        return reduce(DataFrame.unionByName, frames)
+
+    def cache(self, df):
+        return df.persist(StorageLevel.MEMORY_AND_DISK)
+
+    def release(self, df):
+        df.unpersist()
+
+    def exists(self, key):
+        resp = self.s3.list_objects_v2(Bucket=self.bucket, Prefix=key, MaxKeys=1)
+        return resp.get('KeyCount', 0) > 0
+
+    def read_table(self, key, schema, header=True):
+        return self.spark.read.csv(f"s3://{self.bucket}/{key}", header=header, schema=schema)
+
+    def write_text(self, key, text):
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=text.encode('utf-8'))
+
+    def read_text(self, key):
+        try:
+            return self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].read().decode('utf-8')
+        except self.s3.exceptions.NoSuchKey:
+            return None
+
+    def stored_bytes(self, key):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        return sum(f['Size'] for page in paginator.paginate(Bucket=self.bucket, Prefix=key)
+                   for f in page.get('Contents', []))
+
+    def frame_stats(self, obj):
+        if not isinstance(obj, DataFrame):
+            return None
+        return {'rows': obj.count(), 'partitions': obj.rdd.getNumPartitions()}
+
+    # Shows up as the job description in the Spark UI and event log
+    def mark_stage(self, name):
+        self.spark.sparkContext.setJobDescription(name)
+
+    # Script generated for SaveData Transform
+    # Partitioned outputs are repartitioned by key so every file is written
+    # by its own task. Single file outputs are written in parallel and the
+    # part files merged afterwards. Appends are done by the same merge.
+    def save_data(self, frame, path, partition_key=None, header=None, replace=False, sort_key=None,
+                  append=False):
+        header = bool(partition_key) if header is None else header
+
+        if partition_key:
+            frame = frame.repartition(partition_key)
+            if sort_key:
+                frame = frame.sortWithinPartitions(sort_key)
+        elif sort_key:
+            # Range partitioned, so parts in key order are globally sorted
+            frame = frame.sort(sort_key)
+
+        # Parts are staged under a prefix of their own, so path never holds
+        # a mix of part files and final objects
+        staging = staging_key()
+        try:
+            self.glueContext.write_dynamic_frame.from_options(
+                frame=DynamicFrame.fromDF(frame, self.glueContext, "output"),
+                connection_type="s3",
+                format="csv",
+                format_options={
+                    "quoteChar": -1,
+                    "writeHeader": header
+                },
+                connection_options={
+                    "path": f"s3://{self.bucket}/{staging}/",
+                    "partitionKeys": [partition_key] if partition_key else []
+                },
+            )
+
+            # Replace Spark autogen keys with expected filenames
+            if partition_key:
+                return self.finalizer.finalize(staging, path, replace, append, header)
+            return self.finalizer.merge_parts(staging, path, header, append)
+        finally:
+            self.finalizer.discard(staging)
+
+    # One file per partition, written by its own task. Without replace or
+    # append, dynamic overwrite only replaces the partitions in frame.
+    def save_dataset(self, frame, path, schema, partition_key, replace=False, sort_key=None, append=False):
+        columns = [F.col(name).cast(kind).alias(name) for name, kind in parse_schema(schema)]
+        frame = frame.select(*columns, partition_key).repartition(partition_key)
+        if sort_key:
+            frame = frame.sortWithinPartitions(sort_key)
+
+        writer = frame.write.partitionBy(partition_key)
+        if append:
+            writer = writer.mode('append')
+        else:
+            writer = writer.mode('overwrite').option('partitionOverwriteMode', 'static' if replace else 'dynamic')
+        writer.parquet(f"s3://{self.bucket}/{path}")
+
+    def cell_frame(self, df, cell_column, ids):
+        df = df.select(df[cell_column].alias('cell'), df['cycle_no'].alias('cycle'), df['qd'])
+        return df.join(F.broadcast(self.cell_batts(ids)), 'cell').select('cell', 'batt', 'cycle', 'qd')
+
+    def get_cutoff(self, df, config):
+        return df.approxQuantile(['cycle_life'], [config.quantile_cutoff], 0)[0][0]
+
+    # Sample cells that have every cycle of the forecast horizon. Cells are
+    # ranked by seeded hash within their battery on the executors, only the
+    # sampled ones reach the driver.
+    def get_test_set(self, df, cutoff, config):
+        horizon = df[(df['cycle_no'] > cutoff) & (df['cycle_no'] <= cutoff + config.forecast_horizon)]
+        poss_cells = horizon.groupBy('cell_id', 'batt_id').agg(F.countDistinct('cycle_no').alias('cycles')) \
+            .filter(F.col('cycles') == config.forecast_horizon)
+        if config.sampling:
+            order = Window.partitionBy('batt_id').orderBy(cell_hash_col(F.col('cell_id'), config.sampling_seed), 'cell_id')
+            poss_cells = poss_cells.withColumn('rank', F.row_number().over(order)) \
+                .filter(F.col('rank') <= config.cells_per_battery)
+        return sampled_cells([(r[0], r[1]) for r in poss_cells.select('cell_id', 'batt_id').collect()], config)
+
+    # One shuffle by cell: the file order window finds unordered rows, the
+    # cycle order window repeated cycles and the next valid row of each row,
+    # and the report is aggregated on the same partitioning. The report and
+    # the validated frame are persisted, the raw data is scanned twice like
+    # the ID lookup and ConvertTS did before.
+    def validate(self, df, config):
+        qd_min, qd_max = config.qd_range
+        rows = df.select(
+            'battery_name',
+            df['cycle_no'].cast('double').cast('int').alias('cycle_no'),
+            df['cycle_life'].cast('double').cast('int').alias('cycle_life'),
+            df['QD'].cast('float').alias('QD'),
+            F.monotonically_increasing_id().alias('row'),
+        )
+        invalid = rows['cycle_no'].isNull() | rows['cycle_life'].isNull()
+        in_range = F.coalesce((rows['QD'] > qd_min) & (rows['QD'] <= qd_max), F.lit(False))
+        rows = rows.withColumn('invalid', invalid).withColumn('out_of_range', ~invalid & ~in_range)
+
+        # In range rows come first among those of a cycle, later ones repeat it
+        by_row = Window.partitionBy('battery_name').orderBy('row')
+        by_cycle = Window.partitionBy('battery_name').orderBy('cycle_no', 'out_of_range', 'row')
+        after = by_cycle.rowsBetween(1, Window.unboundedFollowing)
+        cycle = F.col('cycle_no')
+        rows = rows.withColumn('unordered', F.coalesce(F.lag('cycle_no').over(by_row) >= cycle, F.lit(False))) \
+            .withColumn('duplicates', ~F.col('invalid') & ~F.col('out_of_range')
+                        & F.coalesce(F.lag('cycle_no').over(by_cycle) == cycle, F.lit(False)))
+        valid = ~(F.col('invalid') | F.col('out_of_range') | F.col('duplicates'))
+        rows = rows.withColumn('valid', valid) \
+            .withColumn('gap', F.first(F.when(F.col('valid'), cycle), ignorenulls=True).over(after) - cycle) \
+            .withColumn('next_qd', F.first(F.when(F.col('valid'), F.col('QD')), ignorenulls=True).over(after))
+        fill = F.col('valid') & (F.col('gap') > 1) & (F.col('gap') <= config.repair_gaps + 1)
+        rows = rows.withColumn('filled', F.when(fill, F.col('gap') - 1).otherwise(0))
+
+        flags = ('invalid', 'duplicates', 'unordered', 'out_of_range', 'valid')
+        report = rows.groupBy('battery_name').agg(
+            F.count(F.lit(1)).alias('rows'),
+            *[F.sum(F.col(flag).cast('int')).alias(flag) for flag in flags],
+            F.min(F.when(F.col('valid'), cycle)).alias('first'),
+            F.max(F.when(F.col('valid'), cycle)).alias('last'),
+            F.max(F.when(F.col('valid'), F.col('gap'))).alias('gap'),
+            F.sum('filled').alias('filled'),
+            F.min(F.when(~F.col('invalid'), F.col('cycle_life'))).alias('life_min'),
+            F.max(F.when(~F.col('invalid'), F.col('cycle_life'))).alias('life_max'),
+        )
+        span = F.coalesce(F.col('last') - F.col('first') + 1, F.lit(0))
+        missing = F.greatest(span - F.col('valid'), F.lit(0))
+        bad = (F.col('life_min') != F.col('life_max')) | (F.col('valid') < config.min_valid_rows) \
+            | (missing > config.max_missing_share*span)
+        report = report.withColumn('missing', missing) \
+            .withColumn('max_gap', F.greatest(F.coalesce(F.col('gap'), F.lit(1)) - 1, F.lit(0))) \
+            .withColumn('status', F.when(bad, 'quarantined').when(F.col('filled') > 0, 'repaired').otherwise('ok')) \
+            .withColumn('filled', F.when(bad, 0).otherwise(F.col('filled')))
+        report = report.select('battery_name', *[report[name].cast(kind).alias(name)
+                                                 for name, kind in parse_schema(QUALITY_REPORT_SCHEMA)[1:]]) \
+            .sort('battery_name').persist()
+        statuses = {r['status']: r['count'] for r in report.groupBy('status').count().collect()}
+
+        # Rows of the kept cells, with cycle k of a gap at QD + (next - QD)*k/gap
+        kept_cells = F.broadcast(report.filter(report['status'] != 'quarantined').select('battery_name'))
+        kept = rows.filter(F.col('valid')).join(kept_cells, 'battery_name')
+        qd = F.col('QD').cast('double')
+        fills = kept.filter(F.col('filled') > 0) \
+            .withColumn('k', F.explode(F.sequence(F.lit(1), F.col('filled')))) \
+            .select('battery_name', (cycle + F.col('k')).alias('cycle_no'), 'cycle_life',
+                    (qd + (F.col('next_qd').cast('double') - qd)*F.col('k')/F.col('gap')).cast('float').alias('QD'))
+        frame = kept.select('battery_name', 'cycle_no', 'cycle_life', 'QD').unionByName(fills) \
+            .persist(StorageLevel.MEMORY_AND_DISK)
+
+        quarantined = F.broadcast(report.filter(report['status'] == 'quarantined').select('battery_name'))
+        quarantine = df.join(quarantined, 'battery_name', 'left_semi').select('battery_name', 'cycle_no', 'cycle_life', 'QD')
+        return Validation(frame, report, quarantine, statuses)
+
+    # New cells and batteries are numbered in name order after the largest
+    # ID in ids. There is one row per cell, so the windows run on a single
+    # partition of a small frame.
+    def calc_cell_ids(self, df, ids=None):
+        cells = df.select('battery_name').distinct()
+        batts, cell_offset, batt_offset = None, 0, 0
+        if ids is not None:
+            cells = cells.join(ids.select('battery_name'), 'battery_name', 'left_anti')
+            batts = ids.select('batt', 'batt_id').distinct()
+            cell_offset, batt_offset = [v + 1 for v in ids.agg(F.max('cell_id'), F.max('batt_id')).first()]
+        cells = cells.withColumn('batt', F.substring('battery_name', 1, 2))
+
+        new_batts = cells.select('batt').distinct()
+        if batts is not None:
+            new_batts = new_batts.join(batts, 'batt', 'left_anti')
+        new_batts = new_batts.withColumn('batt_id', F.row_number().over(Window.orderBy('batt')) - 1 + batt_offset)
+        batts = new_batts if batts is None else batts.unionByName(new_batts)
+
+        cells = cells.withColumn('cell_id', F.row_number().over(Window.orderBy('battery_name')) - 1 + cell_offset) \
+            .join(F.broadcast(batts), 'batt')
+        cells = cells.select(F.col('cell_id').cast('int'), 'battery_name', F.col('batt_id').cast('int'), 'batt')
+        return cells if ids is None else ids.unionByName(cells)
+
+    # Script generated for ConvertTS Transform
+    def convert_ts(self, df, config, ids):
+        # Cast columns to ensure numerical sorting, cell names become the
+        # integer IDs of the broadcast lookup
+        df = df.join(F.broadcast(ids.select('battery_name', 'cell_id', 'batt_id')), 'battery_name') \
+               .select('cell_id', 'batt_id',
+                       df['cycle_no'].cast('int').alias('cycle_no'),
+                       df['cycle_life'].cast('int').alias('cycle_life'),
+                       df['QD'].cast('float').alias('qd'))
+
+        # Sort values by cycle_no (timestamp) to adhere to Forecast expectations
+        return df.sort(['cycle_no', 'cell_id'])
+
+    # Cache the converted frame so the quantile, the collect and every
+    # output branch read it from executors instead of S3
+    def plan(self, df, config, ids):
+        df = df.persist(StorageLevel.MEMORY_AND_DISK)
+        cutoff = self.get_cutoff(df, config)
+        test_set = self.get_test_set(df, cutoff, config)
+        return ProcessingPlan(df, cutoff, test_set, ids=ids)
+
+    # Rows past the watermark of their cell, cells missing from the manifest
+    # are new and kept whole. Test cells and moved cutoffs are collected,
+    # there are a few per battery.
+    def plan_incremental(self, df, manifest, config, ids, advance=False):
+        manifest = manifest.join(F.broadcast(ids.select('battery_name', 'cell_id')), 'battery_name').persist()
+        cutoff = manifest.agg(F.min('cutoff')).first()[0]
+        tests = manifest.filter(manifest['test'] == 1).select('cell_id', 'cutoff').collect()
+        test_set = [r['cell_id'] for r in tests]
+        cutoffs = {r['cell_id']: r['cutoff'] for r in tests if r['cutoff'] > cutoff}
+
+        moved = None
+        if advance:
+            last = df.filter(F.col('cell_id').isin(test_set)).groupBy('cell_id') \
+                .agg((F.max('cycle_no') - config.forecast_horizon).cast('double').alias('cutoff'))
+            ahead = {r['cell_id']: r['cutoff'] for r in last.collect()
+                     if r['cutoff'] > cutoffs.get(r['cell_id'], cutoff)}
+            moved = list(ahead)
+
+        # Rows of a moved cell start at its previous cutoff
+        marks = manifest.select('cell_id', 'last_cycle', 'cutoff')
+        if moved:
+            marks = marks.withColumn('last_cycle', F.when(F.col('cell_id').isin(moved), F.col('cutoff'))
+                                     .otherwise(F.col('last_cycle')))
+            cutoffs.update(ahead)
+        df = df.join(F.broadcast(marks.drop('cutoff')), 'cell_id', 'left')
+        df = df.filter(df['last_cycle'].isNull() | (df['cycle_no'] > df['last_cycle'])).drop('last_cycle')
+        df = df.persist(StorageLevel.MEMORY_AND_DISK)
+        return ProcessingPlan(df, cutoff, test_set, complete=False, ids=ids, cutoffs=cutoffs, moved=moved)
+
+    def calc_manifest(self, plan, manifest=None):
+        marks = plan.frame.groupBy('cell_id').agg(F.max('cycle_no').alias('last_cycle')) \
+            .withColumn('test', F.col('cell_id').isin(plan.test_set).cast('int')) \
+            .withColumn('cutoff', self.cell_cutoffs(plan)) \
+            .withColumn('updated', F.lit(1))
+        marks = self.with_names(marks, plan)
+        if manifest is not None:
+            kept = manifest.join(marks.select('battery_name'), 'battery_name', 'left_anti') \
+                .withColumn('updated', F.lit(0))
+            marks = kept.unionByName(marks.select(*manifest.columns))
+        return marks.select('battery_name', 'last_cycle', 'test', 'cutoff', 'updated')
+
+    def new_cell_ids(self, lookup, ids):
+        return lookup.join(ids.select('cell_id'), 'cell_id', 'left_anti')
+
+    def cell_batteries(self, ids, cells):
+        batts = ids.filter(ids['battery_name'].isin(list(cells))).select('batt').distinct()
+        return sorted(r[0] for r in batts.collect())
+
+    def affected_cells(self, manifest, ids):
+        manifest = manifest.join(F.broadcast(ids.select('battery_name', 'batt')), 'battery_name')
+        updated = manifest.filter(manifest['updated'] == 1).select('batt').distinct()
+        cells = manifest.filter(manifest['test'] == 1).join(updated, 'batt')
+        return [r[0] for r in cells.select('battery_name').collect()]
+
+    def merge_baseline(self, old, fresh):
+        def merge(a, b, keys):
+            return a.join(b.select(*keys), keys, 'left_anti').unionByName(b).persist()
+        return type(old)(merge(old.batteries, fresh.batteries, ['batt']),
+                         merge(old.cells, fresh.cells, ['batt', 'cell']))
+
+    # Cutoff of the cell of each row, moved ones looked up in a literal map
+    def cell_cutoffs(self, plan):
+        cutoff = F.lit(float(plan.cutoff))
+        if not plan.cutoffs:
+            return cutoff
+        pairs = [F.lit(v) for cell, cut in plan.cutoffs.items() for v in (int(cell), float(cut))]
+        return F.coalesce(F.create_map(*pairs)[F.col('cell_id')], cutoff)
+
+    # Cell names in place of cell IDs. The lookup is broadcast, so rows keep
+    # the order of the plan.
+    def with_names(self, df, plan):
+        return df.join(F.broadcast(plan.ids.select('cell_id', 'battery_name')), 'cell_id')
+
+    # Cycle numbers for the plots, timestamps for the Forecast datasets
+    def to_output(self, df, plan, config, plot_data):
+        df = self.with_names(df, plan)
+        if plot_data:
+            return df[['cycle_no', 'battery_name', 'qd']]
+        # Change cycle_no to fake incremental timestamps. Ex: 1 -> 2000-01-01 00:00:00
+        df = df.withColumn('date', cycle_to_date_col(df['cycle_no'], config.init_year, config.frequency))
+        return df[['date', 'battery_name', 'qd']]
+
+    # Script generated for ExtractTrain Transform
+    def extract_train(self, plan, config, plot_data):
+        df = plan.frame
+
+        if plot_data:
+            df = df[df['cell_id'].isin(plan.test_set)]
+
+        df_train = df[df['cycle_no'] <= self.cell_cutoffs(plan)]
+        return self.to_output(df_train, plan, config, plot_data)
+
+    # Script generated for ExtractTest Transform
+    # Option to get all possible test cells, or only a sub-sample
+    def extract_test(self, plan, config, plot_data):
+        df = plan.frame
+        cutoff = self.cell_cutoffs(plan)
+
+        df_test = df[df['cell_id'].isin(plan.test_set)]
+        df_test = df_test[df_test['cycle_no'] > cutoff]
+        df_test = df_test[df_test['cycle_no'] <= (cutoff + config.forecast_horizon)]
+
+        return self.to_output(df_test, plan, config, plot_data)
+
+    # Script generated for ExtractTestIds Transform
+    # Needed by Forecast to generate a sub-sample for given IDs
+    def extract_ids(self, plan):
+        ids = plan.ids
+        return ids.filter(ids['cell_id'].isin(plan.test_set)).select('battery_name')
+
+    # Script generated for ConvertTS Transform
+    def convert_forecasts(self, df, config):
+        # Change fake incremental timestamps back to cycle_no. Ex: 2000-01-01T00:00:00Z -> 1
+        df = df.withColumn('cycle_no', date_to_cycle_col(df['date'], config.init_year, config.frequency)) \
+               .withColumnRenamed('p50', 'qd')
+
+        # Sort values by cell_id, cycle_no to adhere to UI expectations
+        df = df.sort(['item_id', 'cycle_no'])
+
+        # Drop date column
+        return df[['item_id', 'cycle_no', 'qd']]
+
+    # The test cells of a battery are forecast together in one grouped pandas
+    # call. Every group starts its forecasts after the last cycle of the
+    # whole train dataset, like the local backend.
+    def baseline_forecast(self, df, ids, config, cell_ids):
+        df = df.join(F.broadcast(ids), 'item_id') \
+            .join(F.broadcast(cell_ids.select(F.col('battery_name').alias('item_id'), 'batt')), 'item_id') \
+            .withColumn('cycle', date_to_cycle_col(df['date'], config.init_year, config.frequency)) \
+            .select('batt', 'item_id', 'cycle', 'qd')
+        end = df.agg(F.max('cycle')).first()[0]
+        horizon = config.forecast_horizon
+
+        df = df.groupBy('batt').applyInPandas(lambda pdf: forecast_frame(pdf, horizon, end), FORECAST_SCHEMA)
+        date = F.concat(F.regexp_replace(cycle_to_date_col(df['cycle'], config.init_year, config.frequency),
+                                         ' ', 'T'), F.lit('Z'))
+        return df.withColumn('date', date).select('item_id', 'date', 'p10', 'p50', 'p90')
+
+    # The test cells of a battery are scored together in one grouped pandas
+    # call, which also pools them into the battery's row
+    def backtest(self, frames, config):
+        df = reduce(DataFrame.unionByName, [
+            df.select('batt', 'cell', 'cycle', 'qd').withColumn('split', F.lit(key))
+            for key, df in frames.items() if df is not None
+        ])
+        horizon, origins, model = config.forecast_horizon, config.backtest_origins, config.rul_model
+        return df.groupBy('batt').applyInPandas(
+            lambda pdf: backtest_metrics(pdf, horizon, origins, model), BACKTEST_SCHEMA)
+
+    # The cells of a battery are scored against each other in one grouped
+    # pandas call. Module numbers are a window over the cell IDs.
+    def anomalies(self, df, ids, config):
+        by_batt = Window.partitionBy('batt')
+        modules = ids.select(
+            'cell_id',
+            'batt',
+            F.col('battery_name').alias('cell'),
+            F.row_number().over(by_batt.orderBy('cell_id')).alias('module'),
+            F.count('*').over(by_batt).cast('int').alias('modules'),
+        )
+        df = df.select('cell_id', F.col('cycle_no').alias('cycle'), F.col('qd').cast('double').alias('qd')) \
+            .join(F.broadcast(modules), 'cell_id').drop('cell_id')
+        window = config.anomaly_window
+        return df.groupBy('batt').applyInPandas(lambda pdf: module_anomalies(pdf, window), ANOMALY_SCHEMA)
+
+    def module_statuses(self, df):
+        return [tuple(r) for r in df.select('batt', 'modules', 'module', 'status').collect()]
+
+    # Header rows hold the column names in any order and nothing past them.
+    # The headers of the files are joined back to their rows, only the list
+    # of files reaches the driver.
+    def raw_by_name(self, df):
+        names = [name for name, _ in parse_schema(RAW_SCHEMA)]
+        positions = [name for name, _ in parse_schema(RAW_STREAM_SCHEMA)]
+        cells, extra = positions[:len(names)], positions[len(names)]
+        labels = F.array_sort(F.array(*[F.coalesce(F.col(c), F.lit('')) for c in cells]))
+        df = df.withColumn('is_header', (labels == F.array(*[F.lit(n) for n in sorted(names)])) & F.col(extra).isNull())
+
+        headers = df.filter('is_header').dropDuplicates(['source_file']) \
+            .select('source_file', *[F.col(c).alias(f"h{c}") for c in cells])
+        files = df.select('source_file').distinct() \
+            .join(headers.select('source_file', F.lit(True).alias('named')), 'source_file', 'left').collect()
+
+        rows = df.filter(~F.col('is_header')).join(F.broadcast(headers), 'source_file')
+        out = rows.select(*[F.coalesce(*[F.when(F.col(f"h{c}") == name, F.col(c)) for c in cells]).alias(name)
+                            for name in names], 'source_file')
+        return (out, sorted(r['source_file'] for r in files if r['named']),
+                sorted(r['source_file'] for r in files if not r['named']))
+
+    # First and last (cycle, qd) per cell as min and max over structs. Fade
+    # fits only cover the test cells, live RUL uses the default model.
+    def update_live(self, plan, state, config):
+        model = RUL_MODEL if config.rul_model == FIT_RUL_MODEL else config.rul_model
+        df = self.with_names(plan.frame, plan).groupBy('battery_name').agg(
+            F.min(F.struct('cycle_no', 'qd')).alias('first'),
+            F.max(F.struct('cycle_no', 'qd')).alias('last'),
+        ).select(
+            'battery_name',
+            F.col('first.qd').cast('double').alias('qd_first'),
+            F.col('last.cycle_no').alias('cycle'),
+            F.col('last.qd').cast('double').alias('qd'),
+        )
+
+        qd_orig = df['qd_first']
+        if state is not None:
+            df = df.join(state.select('battery_name', 'qd_orig'), 'battery_name', 'left')
+            qd_orig = F.coalesce(df['qd_orig'], df['qd_first'])
+        df = df.withColumn('qd_orig', qd_orig)
+        soh, rul = health_columns(df['qd'], df['cycle'], df['qd_orig'], model)
+        df = df.join(F.broadcast(plan.ids.select('battery_name', 'batt')), 'battery_name') \
+            .select('battery_name', 'batt', 'qd_orig', 'cycle', 'qd', soh.alias('soh'), rul.alias('rul'))
+
+        if state is not None:
+            df = state.join(df.select('battery_name'), 'battery_name', 'left_anti').unionByName(df)
+        return df.sort('battery_name')
+
+    def live_batteries(self, df):
+        return df.groupBy('batt').agg(
+            F.max('cycle').alias('cycle'),
+            F.round(F.avg('soh'), 2).alias('soh'),
+            F.round(F.avg('rul'), 2).alias('rul'),
+        )
+
+    # One aggregation over the (cycle, site, batt) rollup grouping sets, less
+    # the grand total. SOH is against the qd of each cell's first cycle,
+    # picked by min over (cycle, qd) structs.
+    def rollup(self, df, ids, sites):
+        first = df.groupBy('cell_id').agg(F.min(F.struct('cycle_no', 'qd')).alias('first')) \
+            .select('cell_id', F.col('first.qd').cast('double').alias('qd_orig'))
+        names = self.spark.createDataFrame(list(sites.items()), 'batt string, site string')
+        df = df.join(F.broadcast(first), 'cell_id') \
+            .join(F.broadcast(ids.select('batt_id', 'batt').distinct()), 'batt_id') \
+            .join(F.broadcast(names), 'batt', 'left')
+        soh, _ = health_columns(df['qd'], df['cycle_no'], df['qd_orig'])
+        df = df.select(F.coalesce(df['site'], F.lit(UNKNOWN_SITE)).alias('site'), 'batt',
+                       F.col('cycle_no').alias('cycle'), df['qd'].cast('double').alias('qd'), soh.alias('soh'))
+
+        aggs = [F.grouping_id().alias('gid'), F.count('*').cast('int').alias('cells')]
+        for c in ('qd', 'soh'):
+            aggs += [F.avg(c).alias(f"{c}_mean"), F.min(c).alias(f"{c}_min"),
+                     F.percentile_approx(c, list(QUANTILES.values()), PERCENTILE_ACCURACY).alias(f"{c}_q")]
+        df = df.rollup('cycle', 'site', 'batt').agg(*aggs).filter(F.col('gid') != 7)
+
+        quantiles = {f"{c}_{name}": F.col(f"{c}_q")[i] for c in ('qd', 'soh') for i, name in enumerate(QUANTILES)}
+        level = F.when(df['gid'] == 0, 'battery').when(df['gid'] == 1, 'site').otherwise('fleet')
+        return df.select(level.alias('level'), *[
+            quantiles[name].alias(name) if name in quantiles else F.col(name)
+            for name, _ in parse_schema(ROLLUP_SCHEMA)
+        ])
+
+    # (cell, batt) of a cell ID lookup
+    def cell_batts(self, ids):
+        return ids.select(F.col('battery_name').alias('cell'), 'batt')
+
+    # Cell key from the name of its S3 file, battery key from the lookup,
+    # cycle and qd typed
+    def with_cell_keys(self, df, ids):
+        cell = F.substring_index(F.substring_index(input_file_name(), '/', -1), '.', 1)
+        return df.withColumn('cell', cell) \
+           .join(F.broadcast(self.cell_batts(ids)), 'cell') \
+           .withColumn('cycle', df['cycle_no'].cast('int')) \
+           .withColumn('qd', df['qd'].cast('float'))
+
+    # Take avg of cell Qd values across cycles for each battery (and split)
+    def get_avg_qd(self, df):
+        keys = ['split', 'batt', 'cycle'] if 'split' in df.columns else ['batt', 'cycle']
+        return df.groupBy(*keys).mean('qd') \
+           .withColumnRenamed('avg(qd)', 'qd')
+
+    # Original Qd per group: qd of the earliest cycle, picked by min over
+    # (cycle, qd) structs so it stays a distributed aggregate
+    def first_qd(self, df, keys):
+        first = F.min(F.struct('cycle', 'qd')).alias('first')
+        return df.groupBy(*keys).agg(first) \
+           .select(*keys, F.col('first.qd').cast('double').alias('qd_orig'))
+
+    def calc_baseline(self, df):
+        batteries = self.first_qd(self.get_avg_qd(df), ['batt'])
+        cells = self.first_qd(df, ['batt', 'cell'])
+        return Baseline(batteries.persist(), cells.persist())
+
+    # The cells of a battery are fitted together in one grouped pandas call,
+    # which also fits the battery's average curve
+    def fit_fade(self, df, baseline):
+        batteries = baseline.batteries.withColumnRenamed('qd_orig', 'batt_qd_orig')
+        df = df.join(F.broadcast(baseline.cells), ['batt', 'cell']).join(F.broadcast(batteries), 'batt') \
+            .select('batt', 'cell', 'cycle', 'qd', 'qd_orig', 'batt_qd_orig')
+        fits = df.groupBy('batt').applyInPandas(fade_fits, CELL_FIT_SCHEMA).persist()
+        return FadeFits(fits.filter(fits['cell'].isNull()).drop('cell'), fits.filter(fits['cell'].isNotNull()))
+
+    # Add SOH and RUL calculations to Frame
+    def add_stats(self, df, baseline, config, fits=None):
+        df = self.get_avg_qd(df)
+
+        # One row per battery, shipped to every executor instead of shuffled
+        df = df.join(F.broadcast(baseline.batteries), 'batt')
+        eol_cycle = None
+        if config.rul_model == FIT_RUL_MODEL:
+            df = df.join(F.broadcast(fits.batteries.select('batt', 'eol_cycle')), 'batt', 'left')
+            eol_cycle = df['eol_cycle']
+
+        soh, rul = health_columns(df['qd'], df['cycle'], df['qd_orig'], config.rul_model, eol_cycle)
+        df = df.withColumn('soh', soh).withColumn('rul', rul).sort('cycle')
+        return df[['cycle', 'soh', 'rul', 'qd', 'batt'] + (['split'] if 'split' in df.columns else [])]
+
+    # One pandas group per series, decimated on the executors
+    def downsample(self, df, key, n_out):
+        return df.groupBy(key).applyInPandas(lambda pdf: downsample_frame(pdf, key, n_out), df.schema)
+
+    # Row of the largest cycle per battery, as a max over structs
+    def latest_stats(self, df):
+        last = df.groupBy('batt').agg(F.max(F.struct('cycle', 'soh', 'rul')).alias('last'))
+        return [(r['batt'], r['last']['cycle'], r['last']['soh'], r['last']['rul']) for r in last.collect()]
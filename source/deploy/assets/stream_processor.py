@@ -0,0 +1,116 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+import logging
+import sys
+from awsglue.transforms import *
+from awsglue.utils import getResolvedOptions
+from pyspark.context import SparkContext
+from awsglue.context import GlueContext
+from awsglue.job import Job
+from pyspark.sql.functions import input_file_name
+
+# Shared pipeline library, passed to the job with --extra-py-files
+from pipeline_core import (
+    LOCATIONS_KEY,
+    RAW_STREAM_SCHEMA,
+    STREAM_CHECKPOINT_PREFIX,
+    STREAM_INTERVAL,
+    STREAM_MAX_FILES,
+    PipelineConfig,
+    get_optional_args,
+    parse_levels,
+    run_micro_batch,
+)
+from s3_finalize import FINALIZE_WORKERS
+from spark_backend import SparkBackend
+
+# Must match the processing plugin and the post processor of the pipeline
+INIT_YEAR = 2000
+FREQUENCY = 'D'
+RUL_MODEL = 'linear'
+OUTPUT_FORMAT = 'csv'
+DOWNSAMPLE_LEVELS = '200,1000'
+
+# Gaps of up to REPAIR_GAPS missing cycles within a micro-batch are filled
+REPAIR_GAPS = 0
+
+# Seconds between micro-batches, and most new raw files read by one
+TRIGGER_INTERVAL = STREAM_INTERVAL
+MAX_FILES_PER_TRIGGER = STREAM_MAX_FILES
+
+args = getResolvedOptions(sys.argv, [
+    'JOB_NAME',
+    's3_bucket',
+    'raw_prefix'
+])
+args.update(get_optional_args(sys.argv, {
+    'init_year': INIT_YEAR,
+    'frequency': FREQUENCY,
+    'finalize_workers': FINALIZE_WORKERS,
+    'output_format': OUTPUT_FORMAT,
+    'locations_key': LOCATIONS_KEY,
+    'downsample_levels': DOWNSAMPLE_LEVELS,
+    'rul_model': RUL_MODEL,
+    'repair_gaps': REPAIR_GAPS,
+    'trigger_interval': TRIGGER_INTERVAL,
+    'max_files_per_trigger': MAX_FILES_PER_TRIGGER,
+}))
+
+sc = SparkContext.getOrCreate()
+glueContext = GlueContext(sc)
+spark = glueContext.spark_session
+job = Job(glueContext)
+job.init(args['JOB_NAME'], args)
+
+# Pipeline progress and failures go to the driver log
+logging.basicConfig(level=logging.INFO)
+
+backend = SparkBackend(glueContext, args['s3_bucket'], finalize_workers=args['finalize_workers'])
+config = PipelineConfig(
+    init_year=args['init_year'],
+    frequency=args['frequency'],
+    rul_model=args['rul_model'],
+    output_format=args['output_format'],
+    locations_key=args['locations_key'],
+    downsample_levels=parse_levels(args['downsample_levels']),
+    repair_gaps=args['repair_gaps'],
+)
+
+# Files already read are tracked in the checkpoint, a restarted job only
+# reads the files added since. Header rows are read as data, columns are
+# mapped by name in run_micro_batch.
+raw_prefix = args['raw_prefix'].rstrip('/')
+checkpoint = f"s3://{args['s3_bucket']}/{raw_prefix.rsplit('/', 1)[0]}/{STREAM_CHECKPOINT_PREFIX}/"
+raw = spark.readStream.schema(RAW_STREAM_SCHEMA) \
+    .option('header', False) \
+    .option('maxFilesPerTrigger', args['max_files_per_trigger']) \
+    .option('recursiveFileLookup', True) \
+    .csv(f"s3://{args['s3_bucket']}/{raw_prefix}/") \
+    .withColumn('source_file', input_file_name())
+
+
+# Steps are defined in pipeline_core.run_micro_batch, the same steps can be
+# run against a watched directory with local_backend.py stream
+def process_batch(frame, batch_id):
+    run_micro_batch(backend, raw_prefix, frame, config)
+    logging.info("Micro-batch %s done", batch_id)
+
+
+query = raw.writeStream.foreachBatch(process_batch) \
+    .option('checkpointLocation', checkpoint) \
+    .trigger(processingTime=f"{args['trigger_interval']} seconds") \
+    .start()
+query.awaitTermination()
+
+job.commit()
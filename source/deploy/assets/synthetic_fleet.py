@@ -0,0 +1,109 @@
+# Copyright 2022 Amazon.com, Inc. and its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License").
+# You may not use this file except in compliance with the License.
+# A copy of the License is located at
+#
+# http://aws.amazon.com/asl/
+#
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+# Synthetic raw datasets in the processing plugin input format
+# (battery_name, cycle_no, cycle_life, QD), for any fleet size:
+#
+#   python synthetic_fleet.py --batteries 50 --cells 8 --cycles 1000 --out raw_dataset.csv
+#
+# Every cell fades from its original capacity to EOL_FRACTION of it at its
+# cycle life, slowly at first and faster past the knee. Cycle lives are
+# spread around the mean so QUANTILE_CUTOFF has effect, and a share of the
+# early cycles is missing.
+
+import argparse
+import string
+
+import numpy as np
+import pandas as pd
+
+from health_metrics import EOL_FRACTION
+
+# Battery IDs are the first 2 characters of a cell name
+BATTERY_ALPHABET = string.ascii_lowercase + string.digits
+
+# Mean original capacity (Ah) and its spread between cells
+QD_ORIG = 1.07
+QD_ORIG_SPREAD = 0.01
+
+# Spread of the cycle life around the mean, as lognormal sigma
+CYCLE_LIFE_SPREAD = 0.25
+
+# Curvature of the fade curve, 1 is linear, higher values have a later knee
+FADE_EXPONENT = (1.5, 3.0)
+
+# Measurement noise on qd (Ah)
+QD_NOISE = 0.001
+
+# Share of cycles missing, only before MISSING_BEFORE of the cycle life so
+# the forecast window of test cells stays complete
+MISSING_RATE = 0.01
+MISSING_BEFORE = 0.5
+
+
+def battery_ids(count):
+    if count > len(BATTERY_ALPHABET)**2:
+        raise ValueError(f"At most {len(BATTERY_ALPHABET)**2} batteries have a 2 character ID")
+    return [a + b for a in BATTERY_ALPHABET for b in BATTERY_ALPHABET][:count]
+
+
+# Raw dataset of batteries x cells, with cycles as the mean cycle life
+def generate_fleet(batteries, cells, cycles, seed=0, missing_rate=MISSING_RATE):
+    rng = np.random.default_rng(seed)
+    n_cells = batteries*cells
+
+    names = np.array([f"{b}c{c}" for b in battery_ids(batteries) for c in range(cells)])
+    life = np.maximum(np.round(cycles*rng.lognormal(0, CYCLE_LIFE_SPREAD, n_cells)), 2).astype(np.int32)
+    qd_orig = rng.normal(QD_ORIG, QD_ORIG_SPREAD, n_cells)
+    exponent = rng.uniform(*FADE_EXPONENT, n_cells)
+
+    # One row per cycle of every cell
+    cell = np.repeat(np.arange(n_cells), life)
+    starts = np.cumsum(life) - life
+    cycle_no = np.arange(len(cell), dtype=np.int32) - np.repeat(starts, life).astype(np.int32) + 1
+
+    # Q = Q_orig * (1 - (1 - EOL_FRACTION) * (n / life)^k), EOL reached at life
+    fade = (1 - EOL_FRACTION)*(cycle_no/life[cell])**exponent[cell]
+    qd = qd_orig[cell]*(1 - fade) + rng.normal(0, QD_NOISE, len(cell))
+
+    keep = (rng.random(len(cell)) >= missing_rate) | (cycle_no > MISSING_BEFORE*life[cell]) | (cycle_no == 1)
+    return pd.DataFrame({
+        'battery_name': names[cell[keep]],
+        'cycle_no': cycle_no[keep],
+        'cycle_life': life[cell[keep]],
+        'QD': np.round(qd[keep], 6).astype(np.float32),
+    })
+
+
+# Fleet size with about rows rows, for a fixed number of cells and cycles
+def fleet_for_rows(rows, cells, cycles):
+    return max(1, int(np.ceil(rows / (cells*cycles))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Writes a synthetic raw dataset for the processing plugin")
+    parser.add_argument("--batteries", type=int, default=10, help="number of batteries")
+    parser.add_argument("--cells", type=int, default=8, help="cells per battery")
+    parser.add_argument("--cycles", type=int, default=1000, help="mean cycle life")
+    parser.add_argument("--missing-rate", type=float, default=MISSING_RATE, help="share of early cycles missing")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--out", default="raw_dataset.csv", help="output CSV file")
+    args = parser.parse_args()
+
+    df = generate_fleet(args.batteries, args.cells, args.cycles, args.seed, args.missing_rate)
+    df.to_csv(args.out, index=False)
+    print(f"{len(df)} rows, {args.batteries*args.cells} cells written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
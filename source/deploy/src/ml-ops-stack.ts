@@ -52,6 +52,26 @@ export class MLOpsStack extends cdk.Stack {
     const forecastPrefix = "plot/predictions";
     const postProcessorKey = "post_processor.py";
     const postProcessorName = "PostProcessingJob";
+    const streamProcessorKey = "stream_processor.py";
+    const streamProcessorName = "StreamProcessingJob";
+    const datasetFrequency = "D";
+
+    // Shared python modules imported by the processing plugin and post processor
+    const pipelineLibraryKeys = [
+      "pipeline_core.py",
+      "spark_backend.py",
+      "health_metrics.py",
+      "s3_finalize.py",
+      "instrumentation.py",
+      "downsample.py",
+      "baseline_forecast.py",
+      "backtest.py",
+      "rollups.py",
+      "anomalies.py",
+    ];
+    const pipelineLibrary = pipelineLibraryKeys
+      .map((key) => `s3://${props.libraryBucket.bucketName}/CDK-${assetsPath}/${key}`)
+      .join(",");
 
     const glueRole = new iam.Role(this, "glueRole", {
       assumedBy: new iam.ServicePrincipal("glue.amazonaws.com"),
@@ -107,6 +127,8 @@ export class MLOpsStack extends cdk.Stack {
       lambdaPolicy: glueAuthPolicy,
       lambdaEnvConfig: {
         PLUGIN_SCRIPT_KEY: processingPluginKey,
+        PIPELINE_LIBRARY: pipelineLibrary,
+        DATASET_FREQUENCY: datasetFrequency,
       },
     });
 
@@ -122,7 +144,7 @@ export class MLOpsStack extends cdk.Stack {
       lambdaAsset: "importDataFn.ts",
       lambdaPolicy: forecastAuthPolicy,
       lambdaEnvConfig: {
-        DATASET_FREQUENCY: "D",
+        DATASET_FREQUENCY: datasetFrequency,
       },
     });
 
@@ -136,7 +158,7 @@ export class MLOpsStack extends cdk.Stack {
       lambdaAsset: "trainModelFn.ts",
       lambdaPolicy: forecastAuthPolicy,
       lambdaEnvConfig: {
-        DATASET_FREQUENCY: "D",
+        DATASET_FREQUENCY: datasetFrequency,
         FORECAST_HORIZON: "30",
       },
     });
@@ -193,6 +215,27 @@ export class MLOpsStack extends cdk.Stack {
         pythonVersion: "3",
         scriptLocation: `s3://${props.libraryBucket.bucketName}/CDK-${assetsPath}/${postProcessorKey}`,
       },
+      defaultArguments: {
+        "--extra-py-files": pipelineLibrary,
+        "--frequency": datasetFrequency,
+      },
+      glueVersion: "3.0",
+    });
+
+    // Long running job, started for a pipeline with --raw_prefix to process
+    // the raw files added under the prefix in micro-batches
+    new cdk.aws_glue.CfnJob(this, streamProcessorName, {
+      name: streamProcessorName,
+      role: glueRole.roleArn,
+      command: {
+        name: "gluestreaming",
+        pythonVersion: "3",
+        scriptLocation: `s3://${props.libraryBucket.bucketName}/CDK-${assetsPath}/${streamProcessorKey}`,
+      },
+      defaultArguments: {
+        "--extra-py-files": pipelineLibrary,
+        "--frequency": datasetFrequency,
+      },
       glueVersion: "3.0",
     });
 
@@ -0,0 +1,97 @@
+import os
+import sys
+
+import pytest
+
+# The pipeline modules are Glue job assets, imported by their file names
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'source', 'deploy', 'assets'))
+
+
+class FakeBody:
+
+    def __init__(self, data):
+        self.data = data
+
+    def iter_chunks(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+    def read(self):
+        return self.data
+
+
+class FakePaginator:
+
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def paginate(self, Bucket, Prefix):
+        keys = sorted(k for k in self.s3.objects if k.startswith(Prefix))
+        yield {'Contents': [{'Key': k} for k in keys]}
+
+
+# In-memory S3 client with the calls of the finalizer, one bucket
+class FakeS3:
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.calls = []
+
+    def _get(self, key):
+        if key not in self.objects:
+            from botocore.exceptions import ClientError
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return self.objects[key]
+
+    def put_object(self, Bucket, Key, Body):
+        self.calls.append('put_object')
+        self.objects[Key] = bytes(Body)
+
+    def get_object(self, Bucket, Key):
+        return {'Body': FakeBody(self._get(Key))}
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self._get(Key))}
+
+    def copy_object(self, Bucket, CopySource, Key):
+        self.objects[Key] = self._get(CopySource['Key'])
+
+    def delete_objects(self, Bucket, Delete):
+        self.calls.append('delete_objects')
+        for obj in Delete['Objects']:
+            self.objects.pop(obj['Key'], None)
+        return {}
+
+    def get_paginator(self, name):
+        return FakePaginator(self)
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.calls.append('create_multipart_upload')
+        upload_id = str(len(self.uploads))
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append('upload_part')
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': f"etag{PartNumber}"}
+
+    def upload_part_copy(self, Bucket, Key, UploadId, PartNumber, CopySource):
+        self.calls.append('upload_part_copy')
+        self.uploads[UploadId][PartNumber] = self._get(CopySource['Key'])
+        return {'CopyPartResult': {'ETag': f"etag{PartNumber}"}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b''.join(parts[p['PartNumber']] for p in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+        self.aborted.append(Key)
+
+
+@pytest.fixture
+def s3():
+    return FakeS3()
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from anomalies import ATTENTION, MAD_SCALE, MIN_PEERS, NOT_SCORED, OK, module_anomalies, peer_z, window_slope
+
+
+def test_window_slope_matches_polyfit():
+    rng = np.random.default_rng(0)
+    y = rng.normal(size=(5, 60)).cumsum(axis=1)
+    y[rng.random(y.shape) < 0.2] = np.nan
+    end = np.array([59, 30, 10, 1, 45])
+    slopes = window_slope(y, end, 20)
+    for row, (e, slope) in enumerate(zip(end, slopes)):
+        x = np.arange(max(e - 19, 0), e + 1)
+        v = y[row, x]
+        keep = ~np.isnan(v)
+        if keep.sum() < 2:
+            assert np.isnan(slope)
+        else:
+            assert abs(slope - np.polyfit(x[keep], v[keep], 1)[0]) < 1e-9
+
+
+def test_window_slope_needs_two_points():
+    y = np.array([[np.nan, 1.0, np.nan]])
+    assert np.isnan(window_slope(y, np.array([2]), 3)[0])
+
+
+def test_peer_z_per_battery():
+    values = pd.Series([1.0, 2.0, 3.0, 4.0, 100.0, 5.0, 5.0, 5.0])
+    batt = pd.Series(['aa']*5 + ['ab']*3)
+    z = peer_z(values, batt, 1e-9)
+    # median 3, MAD 1
+    np.testing.assert_allclose(z[:5], (values[:5] - 3)/MAD_SCALE)
+    # identical peers fall back to the smallest spread
+    np.testing.assert_allclose(peer_z(values, batt, 0.5)[5:], 0.0)
+
+
+def battery(batt, modules, fast=(), seed=3):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for module in range(modules):
+        fade = 5e-3 if module in fast else 1e-4
+        cycles = np.arange(1, 201)
+        qd = 1.1*(1 - fade*cycles) + rng.normal(0, 5e-4, len(cycles))
+        rows.append(pd.DataFrame({'batt': batt, 'cell': f"{batt}c{module}", 'module': module + 1,
+                                  'modules': modules, 'cycle': cycles, 'qd': qd}))
+    return pd.concat(rows, ignore_index=True)
+
+
+def test_flags_fast_fading_module():
+    out = module_anomalies(battery('aa', 8, fast=[2]), 50).set_index('cell')
+    assert out.loc['aac2', 'status'] == ATTENTION
+    assert (out.drop('aac2')['status'] == OK).all()
+    assert (out['cycle'] == 200).all()
+
+
+# Too few peers for a median and MAD to mean anything
+def test_small_batteries_not_scored():
+    df = pd.concat([battery('aa', MIN_PEERS - 1, fast=[0]), battery('ab', MIN_PEERS, fast=[0])])
+    out = module_anomalies(df, 50)
+    small = out[out['batt'] == 'aa']
+    assert (small['status'] == NOT_SCORED).all()
+    assert small[['fade_z', 'loss_z']].isna().all().all()
+    assert small['fade'].notna().all()
+    assert (out[out['batt'] == 'ab']['status'] != NOT_SCORED).all()
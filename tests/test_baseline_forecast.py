@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+from baseline_forecast import (DAMPING, SMOOTHING_LEVELS, SMOOTHING_TRENDS, damped_trend_forecast, damped_trend_origins,
+                               forecast_frame)
+
+
+def cells(seed=0, n=6, length=120):
+    rng = np.random.default_rng(seed)
+    y = 1.1 - np.outer(rng.uniform(1e-4, 1e-3, n), np.arange(length)) + rng.normal(0, 1e-3, (n, length))
+    y[rng.random(y.shape) < 0.1] = np.nan
+    y[:, 0] = 1.1
+    return y
+
+
+# Damped trend smoothing of one series, one smoothing pair at a time
+def reference_forecast(series, horizon):
+    best = None
+    for alpha in SMOOTHING_LEVELS:
+        for beta in SMOOTHING_TRENDS:
+            level, trend, sse, seen = series[0], 0.0, 0.0, 0
+            for value in series[1:]:
+                pred = level + DAMPING*trend
+                err = 0.0 if np.isnan(value) else value - pred
+                level, trend = pred + alpha*err, DAMPING*trend + alpha*beta*err
+                sse, seen = sse + err*err, seen + (not np.isnan(value))
+            if best is None or sse < best[0]:
+                best = (sse, level, trend, seen)
+    sse, level, trend, seen = best
+    steps = np.cumsum(DAMPING**np.arange(1, horizon + 1))
+    return level + trend*steps, np.sqrt(sse/max(seen, 1))
+
+
+def test_matches_reference():
+    y = cells()
+    p50, err = damped_trend_forecast(y, 30)
+    for row in range(len(y)):
+        ref_p50, ref_err = reference_forecast(y[row], 30)
+        np.testing.assert_allclose(p50[row], ref_p50, rtol=1e-9)
+        assert abs(err[row] - ref_err) < 1e-12
+
+
+def test_last_origin_is_the_forecast():
+    y = cells()
+    p50, err = damped_trend_forecast(y, 30)
+    (o_p50, o_err), = damped_trend_origins(y, [y.shape[1] - 1], 30)
+    np.testing.assert_array_equal(p50, o_p50)
+    np.testing.assert_array_equal(err, o_err)
+
+
+# Forecasts from an origin only see the columns up to it
+def test_origins_ignore_later_columns():
+    y = cells(seed=1)
+    origins = [40, 80, 119]
+    full = damped_trend_origins(y, origins, 20)
+    for origin, (p50, err) in zip(origins, full):
+        cut = y.copy()
+        cut[:, origin + 1:] = 5.0
+        (cut_p50, cut_err), = damped_trend_origins(cut, [origin], 20)
+        np.testing.assert_allclose(p50, cut_p50)
+        np.testing.assert_allclose(err, cut_err)
+
+        alone, = damped_trend_origins(y[:, :origin + 1], [origin], 20)
+        np.testing.assert_allclose(p50, alone[0])
+
+
+def test_linear_series_continue_their_trend():
+    y = 1.0 - 0.001*np.arange(200)[None, :]
+    p50, err = damped_trend_forecast(y, 10)
+    assert err[0] < 1e-3
+    assert np.all(np.diff(p50[0]) < 0)
+    assert abs(p50[0, 0] - (1.0 - 0.001*200)) < 1e-3
+
+
+def test_series_starting_after_an_origin():
+    y = cells(seed=2)
+    y[0, :60] = np.nan
+    (early, _), (late, _) = damped_trend_origins(y, [30, 100], 5)
+    assert np.isnan(early[0]).all()
+    assert not np.isnan(early[1:]).any()
+    assert not np.isnan(late).any()
+
+
+def test_forecast_frame():
+    df = pd.DataFrame({'item_id': ['aac0']*50 + ['aac1']*40, 'cycle': list(range(1, 51)) + list(range(1, 41)),
+                       'qd': np.linspace(1.1, 1.0, 90)})
+    out = forecast_frame(df, 5)
+    assert len(out) == 10
+    assert out.groupby('item_id')['cycle'].apply(list).to_dict() == {'aac0': list(range(51, 56)),
+                                                                     'aac1': list(range(51, 56))}
+    assert (out['p10'] <= out['p50']).all() and (out['p50'] <= out['p90']).all()
+    assert forecast_frame(df, 5, end=60)['cycle'].min() == 61
@@ -0,0 +1,92 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from local_backend import cycles_to_dates, dates_to_cycles
+from pipeline_core import FREQUENCY_MONTHS, FREQUENCY_SECONDS, INIT_YEAR, cycle_to_date, date_to_cycle
+
+FREQUENCIES = list(FREQUENCY_SECONDS) + list(FREQUENCY_MONTHS)
+
+# Largest cycle tested, short of the last year of a timestamp string
+MAX_CYCLE = 200000
+
+
+def last_cycle(frequency):
+    if frequency in FREQUENCY_MONTHS:
+        limit = (9999 - INIT_YEAR + 1)*12 // FREQUENCY_MONTHS[frequency]
+    else:
+        span = datetime(9999, 12, 31) - datetime(INIT_YEAR, 1, 1)
+        limit = int(span.total_seconds()) // FREQUENCY_SECONDS[frequency] + 1
+    return min(limit, MAX_CYCLE)
+
+
+def cycles(frequency):
+    last = last_cycle(frequency)
+    return np.unique(np.concatenate([np.arange(1, 50), np.geomspace(50, last, 200).astype(np.int64), [last]]))
+
+
+# Forecast export timestamp of a forecast input timestamp
+def export_date(date):
+    return date.replace(' ', 'T') + 'Z'
+
+
+def test_first_cycle_is_init_year():
+    for frequency in FREQUENCIES:
+        assert cycle_to_date(1, INIT_YEAR, frequency) == f"{INIT_YEAR}-01-01 00:00:00"
+
+
+def test_known_dates():
+    assert cycle_to_date(2, 2000, 'D') == '2000-01-02 00:00:00'
+    assert cycle_to_date(25, 2000, 'H') == '2000-01-02 00:00:00'
+    assert cycle_to_date(14, 2000, 'M') == '2001-02-01 00:00:00'
+    assert cycle_to_date(3, 2000, 'Y') == '2002-01-01 00:00:00'
+    assert cycle_to_date(200000, 2000, 'D') == '2547-07-31 00:00:00'
+
+
+@pytest.mark.parametrize('frequency', FREQUENCIES)
+def test_cycle_to_date_inverse(frequency):
+    for cycle in cycles(frequency):
+        assert date_to_cycle(export_date(cycle_to_date(cycle, INIT_YEAR, frequency)), INIT_YEAR, frequency) == cycle
+
+
+@pytest.mark.parametrize('frequency', FREQUENCIES)
+def test_vectorized_matches_scalar(frequency):
+    steps = cycles(frequency)
+    dates = cycles_to_dates(steps, INIT_YEAR, frequency)
+    assert list(dates) == [cycle_to_date(c, INIT_YEAR, frequency) for c in steps]
+    np.testing.assert_array_equal(dates_to_cycles([export_date(d) for d in dates], INIT_YEAR, frequency), steps)
+
+
+def test_vectorized_empty():
+    assert len(cycles_to_dates([], INIT_YEAR, 'D')) == 0
+
+
+def test_unsupported_frequency():
+    with pytest.raises(ValueError):
+        cycle_to_date(1, INIT_YEAR, '2D')
+
+
+@pytest.fixture(scope='module')
+def spark():
+    pytest.importorskip('pyspark')
+    from pyspark.sql import SparkSession
+    session = (SparkSession.builder.master('local[1]')
+               .config('spark.sql.session.timeZone', 'UTC').getOrCreate())
+    yield session
+    session.stop()
+
+
+@pytest.mark.parametrize('frequency', FREQUENCIES)
+def test_spark_columns_match_scalar(spark, frequency):
+    from pyspark.sql import functions as F
+    from spark_backend import cycle_to_date_col, date_to_cycle_col
+
+    steps = [int(c) for c in cycles(frequency)]
+    df = spark.createDataFrame([(c,) for c in steps], 'cycle int')
+    df = df.withColumn('date', cycle_to_date_col(F.col('cycle'), INIT_YEAR, frequency))
+    df = df.withColumn('back', date_to_cycle_col(
+        F.concat(F.regexp_replace('date', ' ', 'T'), F.lit('Z')), INIT_YEAR, frequency))
+    rows = sorted(df.collect())
+    assert [r['date'] for r in rows] == [cycle_to_date(c, INIT_YEAR, frequency) for c in steps]
+    assert [r['back'] for r in rows] == steps
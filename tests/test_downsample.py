@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from downsample import downsample_frame, lttb_indices
+
+
+# Textbook LTTB of a single series, one bucket at a time
+def lttb_reference(x, y, n_out):
+    n = len(x)
+    if n <= max(n_out, 2):
+        return list(range(n))
+    edges = [1 + (k*(n - 2)) // (n_out - 2) for k in range(n_out - 1)]
+    kept = [0]
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        nlo, nhi = (edges[b + 1], edges[b + 2]) if b < n_out - 3 else (n - 1, n)
+        cx, cy = np.mean(x[nlo:nhi]), np.mean(y[nlo:nhi])
+        ax, ay = x[kept[-1]], y[kept[-1]]
+        area = [abs((ax - cx)*(y[i] - ay) - (ax - x[i])*(cy - ay)) for i in range(lo, hi)]
+        kept.append(lo + int(np.argmax(area)))
+    kept.append(n - 1)
+    return kept
+
+
+def series(lengths, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.concatenate([np.sort(rng.choice(10*n + 1, n, replace=False)) for n in lengths]).astype(float)
+    y = rng.normal(size=len(x)).cumsum()
+    return x, y
+
+
+def test_matches_reference():
+    lengths = [1, 2, 5, 10, 11, 57, 300, 1000]
+    x, y = series(lengths)
+    for n_out in (3, 4, 10, 100):
+        starts = np.cumsum(lengths) - lengths
+        expected = np.concatenate([s + np.array(lttb_reference(x[s:s + n], y[s:s + n], n_out), dtype=np.int64)
+                                   for s, n in zip(starts, lengths)])
+        np.testing.assert_array_equal(lttb_indices(lengths, x, y, n_out), expected)
+
+
+def test_keeps_ends_and_size():
+    lengths = [3, 50, 400]
+    x, y = series(lengths, seed=1)
+    kept = lttb_indices(lengths, x, y, 20)
+    starts = np.cumsum(lengths) - lengths
+    for s, n in zip(starts, lengths):
+        mine = kept[(kept >= s) & (kept < s + n)]
+        assert len(mine) == min(n, 20)
+        assert mine[0] == s and mine[-1] == s + n - 1
+
+
+def test_two_points_keeps_ends():
+    lengths = [10, 4]
+    x, y = series(lengths)
+    np.testing.assert_array_equal(lttb_indices(lengths, x, y, 2), [0, 9, 10, 13])
+
+
+def test_downsample_frame_per_key():
+    df = pd.DataFrame({'cell': ['b']*30 + ['a']*5, 'cycle': list(range(30, 0, -1)) + list(range(5)),
+                       'qd': np.linspace(1, 0.8, 35)})
+    out = downsample_frame(df, 'cell', 10)
+    assert out.groupby('cell').size().to_dict() == {'a': 5, 'b': 10}
+    assert out[out['cell'] == 'b']['cycle'].is_monotonic_increasing
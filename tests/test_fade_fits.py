@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from health_metrics import EOL_FRACTION, best_fade_fits, calc_fitted_rul, fade_eol_cycle, fade_fits, fade_ratio
+
+CYCLES = np.arange(1, 101, dtype=np.float64)
+
+# Known curves of each model as (model, c0, c1) and their end of life
+# cycle. A line through r = 1 at cycle 0 is a power curve as well.
+CURVES = [
+    ('linear', 0.99, -1e-3, (0.99 - EOL_FRACTION)/1e-3),
+    ('exponential', 0.0, -2e-3, np.log(EOL_FRACTION)/-2e-3),
+    ('power', np.log(1e-4), 1.5, ((1 - EOL_FRACTION)/1e-4)**(1/1.5)),
+]
+
+
+def test_recovers_known_curves():
+    n = len(CURVES)
+    group = np.repeat(np.arange(n), len(CYCLES))
+    cycle = np.tile(CYCLES, n)
+    ratio = np.concatenate([fade_ratio(m, c0, c1, CYCLES) for m, c0, c1, _ in CURVES])
+    model, c0, c1, rmse, eol = best_fade_fits(group, cycle, ratio, n)
+    assert model.tolist() == [m for m, *_ in CURVES]
+    np.testing.assert_allclose(c0, [c for _, c, _, _ in CURVES], rtol=1e-6, atol=1e-9)
+    np.testing.assert_allclose(c1, [c for _, _, c, _ in CURVES], rtol=1e-6)
+    np.testing.assert_allclose(eol, [e for *_, e in CURVES], rtol=1e-6)
+    assert np.all(rmse < 1e-9)
+
+
+def test_noisy_curve_stays_close():
+    rng = np.random.default_rng(0)
+    ratio = fade_ratio('linear', 0.99, -1e-3, CYCLES) + rng.normal(0, 5e-4, len(CYCLES))
+    *_, rmse, eol = best_fade_fits(np.zeros(len(CYCLES)), CYCLES, ratio, 1)
+    assert abs(eol[0] - 190) < 10
+    assert rmse[0] < 1e-3
+
+
+def test_no_decay_has_no_eol():
+    eol = fade_eol_cycle(['linear', 'exponential', 'power', 'linear'], [1.0, 0.0, -9.0, 1.0], [0.0, 1e-3, -0.5, 1e-3])
+    assert np.isnan(eol).all()
+    np.testing.assert_array_equal(calc_fitted_rul(eol, 50), 100.0)
+
+
+def test_fitted_rul():
+    np.testing.assert_allclose(calc_fitted_rul([200.0, 200.0, 200.0], [50, 200, 300]), [75.0, 0.0, -50.0])
+
+
+def test_fade_fits_per_cell_and_battery():
+    rows = []
+    for cell, slope in (('aac0', 1e-3), ('aac1', 2e-3)):
+        rows.append(pd.DataFrame({'batt': 'aa', 'cell': cell, 'cycle': CYCLES,
+                                  'qd': 1.1*(0.99 - slope*CYCLES), 'qd_orig': 1.1, 'batt_qd_orig': 1.1}))
+    fits = fade_fits(pd.concat(rows, ignore_index=True))
+    cells = fits[fits['cell'].notna()].set_index('cell')
+    battery = fits[fits['cell'].isna()].iloc[0]
+    assert cells['model'].tolist() == ['linear', 'linear']
+    np.testing.assert_allclose(cells['eol_cycle'], [190, 95], rtol=1e-6)
+    np.testing.assert_allclose(battery['eol_cycle'], (0.99 - EOL_FRACTION)/1.5e-3, rtol=1e-6)
+    assert cells['points'].tolist() == [100, 100] and battery['points'] == 100
@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from health_store import ArrayCache, HealthStore, LocalSource, make_handler
+
+PIPELINE = 'u/p'
+
+
+def write(root, key, df):
+    path = os.path.join(root, PIPELINE, 'plot', key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_csv(path, index=False)
+
+
+def battery_frame(cycles, soh=90.0):
+    cycles = np.asarray(cycles)
+    return pd.DataFrame({'cycle': cycles, 'soh': soh, 'rul': 50.0, 'qd': 1.0 - 1e-3*cycles})
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = str(tmp_path)
+    write(root, 'past/aa.csv', battery_frame(np.arange(50, 0, -1)))
+    write(root, 'past/ab.csv', battery_frame(np.arange(1, 21)))
+    write(root, 'past/aac0.csv', pd.DataFrame({'cycle_no': np.arange(1, 31), 'qd': np.linspace(1.1, 1.0, 30)}))
+    return root
+
+
+def test_batteries(root):
+    assert HealthStore(LocalSource(root)).batteries(PIPELINE, 'past') == ['aa', 'ab']
+
+
+def test_battery_cycle_range(root):
+    store = HealthStore(LocalSource(root))
+    full = store.battery(PIPELINE, 'past', 'aa')
+    assert full['cycle'].tolist() == list(range(1, 51))
+    part = store.battery(PIPELINE, 'past', 'aa', 10, 19)
+    assert part['cycle'].tolist() == list(range(10, 20))
+    np.testing.assert_allclose(part['qd'], 1.0 - 1e-3*np.arange(10, 20))
+    assert set(part) == {'cycle', 'soh', 'rul', 'qd'}
+    assert store.battery(PIPELINE, 'past', 'zz') is None
+
+
+def test_cell(root):
+    store = HealthStore(LocalSource(root))
+    cell = store.cell(PIPELINE, 'past', 'aac0', start=25)
+    assert cell['cycle'].tolist() == list(range(25, 31))
+    assert set(cell) == {'cycle', 'qd'}
+    assert store.cell(PIPELINE, 'past', 'aac9') is None
+
+
+def test_parquet_cell_battery_from_cell_ids(root):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # The battery of the lookup, not the first characters of the name
+    pd.DataFrame({'cell_id': [0], 'battery_name': ['aac5'], 'batt_id': [0], 'batt': ['07']}) \
+        .to_csv(os.path.join(root, PIPELINE, 'cell_ids.csv'), index=False)
+    path = os.path.join(root, PIPELINE, 'plot', 'actual', 'cells', 'batt=07', 'part-0.parquet')
+    os.makedirs(os.path.dirname(path))
+    pq.write_table(pa.table({'cell': ['aac5']*3, 'cycle': [3, 1, 2], 'qd': [0.9, 1.0, 0.95]}), path)
+
+    cell = HealthStore(LocalSource(root)).cell(PIPELINE, 'actual', 'aac5')
+    assert cell['cycle'].tolist() == [1, 2, 3]
+    assert HealthStore(LocalSource(root)).cell(PIPELINE, 'actual', 'aac9') is None
+
+
+def test_unknown_split(root):
+    with pytest.raises(ValueError):
+        HealthStore(LocalSource(root)).battery(PIPELINE, 'future', 'aa')
+
+
+def test_repeated_reads_hit_the_cache(root):
+    store = HealthStore(LocalSource(root))
+    for _ in range(3):
+        store.battery(PIPELINE, 'past', 'aa')
+    assert (store.cache.hits, store.cache.misses) == (2, 1)
+
+
+def test_lru_eviction_bound():
+    arrays = {'cycle': np.zeros(100)}
+    cache = ArrayCache(max_bytes=3*arrays['cycle'].nbytes)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, 1, arrays)
+    assert cache.get('a', 1) is not None
+    cache.put('d', 1, arrays)
+    assert cache.size <= cache.max_bytes
+    assert sorted(cache.entries) == ['a', 'c', 'd']
+    assert cache.get('b', 1) is None
+    cache.put('big', 1, {'cycle': np.zeros(400)})
+    assert 'big' not in cache.entries and cache.size <= cache.max_bytes
+
+
+def test_stale_version_is_a_miss():
+    cache = ArrayCache()
+    cache.put('a', 1, {'cycle': np.zeros(3)})
+    assert cache.get('a', 2) is None
+
+
+def test_invalidate_after_rewrite(root):
+    store = HealthStore(LocalSource(root), listing_ttl=3600)
+    assert store.battery(PIPELINE, 'past', 'ab')['soh'][0] == 90.0
+    write(root, 'past/ab.csv', battery_frame(np.arange(1, 31), soh=85.0))
+    # The listing is still trusted, so is the cached entry
+    assert len(store.battery(PIPELINE, 'past', 'ab')['cycle']) == 20
+    store.invalidate(f"{PIPELINE}/plot/past")
+    rewritten = store.battery(PIPELINE, 'past', 'ab')
+    assert len(rewritten['cycle']) == 30 and rewritten['soh'][0] == 85.0
+
+
+def test_rewrite_seen_after_listing_ttl(root):
+    store = HealthStore(LocalSource(root), listing_ttl=0)
+    store.battery(PIPELINE, 'past', 'ab')
+    write(root, 'past/ab.csv', battery_frame(np.arange(1, 31), soh=85.0))
+    assert len(store.battery(PIPELINE, 'past', 'ab')['cycle']) == 30
+    os.remove(os.path.join(root, PIPELINE, 'plot', 'past', 'ab.csv'))
+    assert store.battery(PIPELINE, 'past', 'ab') is None
+    assert not any(k.endswith('ab.csv') for k in store.cache.entries)
+
+
+@pytest.fixture
+def server(root):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(HealthStore(LocalSource(root))))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get(url, method='GET'):
+    try:
+        with urlopen(Request(url, method=method)) as response:
+            return response.status, json.load(response)
+    except HTTPError as err:
+        return err.code, json.load(err)
+
+
+def test_http_battery(server):
+    code, body = get(f"{server}/battery?pipeline={PIPELINE}&split=past&battery=aa&start=10&end=12")
+    assert code == 200
+    assert body['cycle'] == [10, 11, 12]
+    assert get(f"{server}/batteries?pipeline={PIPELINE}&split=past") == (200, ['aa', 'ab'])
+    assert get(f"{server}/cell?pipeline={PIPELINE}&split=past&cell=aac9")[0] == 404
+
+
+def test_http_bad_requests(server):
+    for query in ('battery?pipeline=u/p&split=past&battery=aa&start=ten',
+                  'cell?pipeline=u/p&split=past&cell=aac0&end=1.5',
+                  'battery?pipeline=u/p&split=past',
+                  'battery?pipeline=u/p&split=future&battery=aa'):
+        code, body = get(f"{server}/{query}")
+        assert code == 400 and 'error' in body
+    assert get(f"{server}/unknown")[0] == 404
+
+
+def test_http_invalidate(server):
+    assert get(f"{server}/invalidate?prefix={PIPELINE}", 'POST') == (200, {'invalidated': PIPELINE})
@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+
+import pandas as pd
+import pytest
+
+from benchmark import write_forecast_export
+from instrumentation import InstrumentedBackend
+from local_backend import LocalBackend
+from pipeline_core import FORECAST_HORIZON, Backend, run_pipelines, run_post_processing, run_processing
+from synthetic_fleet import generate_fleet
+
+BASE = 'u/p'
+RAW_KEY = f"{BASE}/raw_dataset.csv"
+
+
+@pytest.fixture(scope='module')
+def run(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('fleet'))
+    raw = generate_fleet(3, 6, 300, seed=1)
+    os.makedirs(os.path.join(root, BASE))
+    raw.to_csv(os.path.join(root, RAW_KEY), index=False)
+
+    backend = InstrumentedBackend(LocalBackend(root))
+    run_processing(backend, RAW_KEY)
+    write_forecast_export(root, BASE)
+    run_post_processing(backend, f"{BASE}/plot/predictions")
+    return root, raw, backend
+
+
+def read(root, key, **kwargs):
+    return pd.read_csv(os.path.join(root, BASE, key), **kwargs)
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        Backend()
+
+
+def test_processing_outputs(run):
+    root, raw, _ = run
+    test_ids = read(root, 'test_ids.csv', header=None)[0].tolist()
+    train = read(root, 'train_dataset.csv', header=None, names=['date', 'item_id', 'qd'])
+    test = read(root, 'test_dataset.csv', header=None, names=['date', 'item_id', 'qd'])
+    assert test_ids
+    assert set(train['item_id']) == set(raw['battery_name'])
+    assert set(test['item_id']) == set(test_ids)
+    assert set(read(root, 'cell_ids.csv')['battery_name']) == set(raw['battery_name'])
+
+    for cell in test_ids:
+        past = read(root, f"plot/past/{cell}.csv")
+        actual = read(root, f"plot/actual/{cell}.csv")
+        assert list(past.columns) == ['cycle_no', 'qd']
+        assert past['cycle_no'].max() < actual['cycle_no'].min()
+        assert 0 < len(actual) <= FORECAST_HORIZON
+        cycles = set(raw.loc[raw['battery_name'] == cell, 'cycle_no'])
+        assert set(past['cycle_no']) | set(actual['cycle_no']) <= cycles
+
+
+def test_instrumented_write_stats(tmp_path):
+    class FinalizingBackend(LocalBackend):
+        def save_data(self, frame, path, *args, **kwargs):
+            super().save_data(frame, path, *args, **kwargs)
+            return {'path': path, 'merged': 1}
+
+    backend = InstrumentedBackend(FinalizingBackend(str(tmp_path)))
+    backend.save_data(pd.DataFrame({'a': [1]}), f"{BASE}/a.csv", header=True)
+    assert backend.stages[0]['finalize'] == {'path': f"{BASE}/a.csv", 'merged': 1}
+    # Rows are only counted on request
+    assert 'input' not in backend.stages[0] and 'output' not in backend.stages[0]
+
+
+def test_run_pipelines_logs_each_pipeline(caplog):
+    def run(key):
+        if key == 'b':
+            raise ValueError(key)
+
+    with caplog.at_level(logging.INFO, logger='pipeline_core'), pytest.raises(RuntimeError, match='1 of 2'):
+        run_pipelines(run, ['a', 'b'], lambda key: key)
+    assert {r.getMessage() for r in caplog.records} == {'Pipeline a done', 'Pipeline b failed'}
+    assert [r.exc_info[0] for r in caplog.records if r.levelno == logging.ERROR] == [ValueError]
+
+
+def test_rerun_keeps_cell_ids(tmp_path):
+    root = str(tmp_path)
+    raw = generate_fleet(2, 4, 200, seed=2)
+    os.makedirs(os.path.join(root, BASE))
+    backend = LocalBackend(root)
+
+    raw[~raw['battery_name'].isin(['aac3', 'abc0'])].to_csv(os.path.join(root, RAW_KEY), index=False)
+    run_processing(backend, RAW_KEY)
+    first = read(root, 'cell_ids.csv')
+    raw.to_csv(os.path.join(root, RAW_KEY), index=False)
+    run_processing(backend, RAW_KEY)
+    ids = read(root, 'cell_ids.csv')
+
+    # Known cells keep their rows, new ones are appended after them
+    pd.testing.assert_frame_equal(ids.iloc[:len(first)], first)
+    fresh = ids.iloc[len(first):].set_index('battery_name')
+    assert sorted(fresh.index) == ['aac3', 'abc0']
+    assert fresh['cell_id'].min() > first['cell_id'].max()
+    assert fresh.loc['aac3', 'batt_id'] == first.loc[first['batt'] == 'aa', 'batt_id'].iloc[0]
+    assert ids['cell_id'].is_unique
+
+
+def test_post_processing_outputs(run):
+    root, raw, _ = run
+    batteries = sorted(raw['battery_name'].str[:2].unique())
+    test_batteries = sorted({c[:2] for c in read(root, 'test_ids.csv', header=None)[0]})
+    for split in ('past', 'actual', 'predictions'):
+        for batt in test_batteries:
+            stats = read(root, f"plot/{split}/{batt}.csv")
+            assert list(stats.columns) == ['cycle', 'soh', 'rul', 'qd']
+            assert stats['cycle'].is_monotonic_increasing
+            assert stats[['soh', 'qd']].notna().all().all()
+
+    with open(os.path.join(root, BASE, 'summary.json')) as f:
+        summary = json.load(f)
+    assert sorted(summary['batteries']) == test_batteries
+    assert set(read(root, 'rollups/battery.csv', dtype={'batt': str})['batt']) == set(batteries)
+    assert set(read(root, 'backtest.csv')['model']) == {'forecast', 'baseline'}
+
+
+# Every cell is scored, not only the test cells
+def test_anomalies_cover_every_cell(run):
+    root, raw, _ = run
+    anomalies = read(root, 'anomalies.csv')
+    assert sorted(anomalies['cell']) == sorted(raw['battery_name'].unique())
+    assert (anomalies['status'] != 'not_scored').all()
+    with open(os.path.join(root, BASE, 'module_warnings.json')) as f:
+        warnings = json.load(f)
+    assert sorted(warnings) == sorted(raw['battery_name'].str[:2].unique())
+    assert all(w['numberOfModules'] == 6 for w in warnings.values())
+
+
+def test_instrumented_stages(run):
+    _, _, backend = run
+    summary = backend.summary()
+    for stage in ('read_raw', 'convert_ts', 'convert_forecasts', 'add_stats'):
+        assert summary[stage]['calls'] >= 1
+
+
+# Each branch counts the scans behind the plan fields it read
+def test_plan_scans_avoided(run):
+    _, _, backend = run
+    plans = backend.report('processing')['plans']
+    assert len(plans) == 1
+    branches = {b['branch']: b['reads'] for b in plans[0]['branches']}
+    assert branches['extract_test'] == ['cutoff', 'cutoffs', 'frame', 'test_set']
+    assert branches['extract_ids'] == ['test_set']
+    assert branches['rollups'] == ['frame']
+    assert plans[0]['source_scans'] == 3
+    assert plans[0]['branch_scans'] == sum(len(set(b['reads']) - {'cutoffs'}) for b in plans[0]['branches'])
+    assert plans[0]['scans_avoided'] == plans[0]['branch_scans'] - 3 > 0
@@ -0,0 +1,99 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+from benchmark import write_forecast_export
+from local_backend import LocalBackend
+from pipeline_core import FORECAST_HORIZON, PipelineConfig, run_post_processing, run_processing
+from synthetic_fleet import generate_fleet
+
+BASE = 'u/p'
+RAW_KEY = f"{BASE}/raw_dataset.csv"
+OUTPUT_PATH = f"{BASE}/plot/predictions"
+
+
+def process_and_post(root, raw, config, export=True):
+    raw.to_csv(os.path.join(root, RAW_KEY), index=False)
+    run_processing(LocalBackend(str(root)), RAW_KEY, config)
+    if export:
+        write_forecast_export(str(root), BASE)
+    run_post_processing(LocalBackend(str(root)), OUTPUT_PATH, config)
+
+
+def battery_stats(root, split, config):
+    if config.output_format == 'parquet':
+        return pd.read_parquet(os.path.join(root, BASE, 'plot', split, 'stats'))
+    files = glob.glob(os.path.join(root, BASE, 'plot', split, '??.csv'))
+    return pd.concat([pd.read_csv(f) for f in files], ignore_index=True)
+
+
+@pytest.fixture
+def raw():
+    return generate_fleet(3, 6, 300, seed=1)
+
+
+@pytest.fixture
+def root(tmp_path):
+    os.makedirs(tmp_path / BASE)
+    return tmp_path
+
+
+# A second post run finds the battery files of the first one next to the
+# cell files and the new export
+@pytest.mark.parametrize('output_format', ['csv', 'parquet'])
+def test_incremental_rerun_keeps_predictions(root, raw, output_format):
+    config = PipelineConfig(output_format=output_format, incremental=True)
+    process_and_post(root, raw[raw['cycle_no'] <= 400], config)
+    process_and_post(root, raw, config)
+
+    for split in ('past', 'actual', 'predictions'):
+        stats = battery_stats(root, split, config)
+        assert len(stats)
+        assert stats[['cycle', 'soh', 'qd']].notna().all().all(), split
+
+
+def cell_series(root, split, config, cell):
+    if config.output_format == 'parquet':
+        cells = pd.read_parquet(os.path.join(root, BASE, 'plot', split, 'cells'))
+        return cells[cells['cell'] == cell]['cycle'].sort_values().tolist()
+    return pd.read_csv(os.path.join(root, BASE, 'plot', split, f"{cell}.csv"))['cycle_no'].tolist()
+
+
+# Test cells seen past the first run's horizon move their cutoff, so their
+# last horizon cycles are the actual ones and every earlier cycle is past
+@pytest.mark.parametrize('output_format', ['csv', 'parquet'])
+def test_incremental_rerun_moves_cutoff(root, raw, output_format):
+    config = PipelineConfig(output_format=output_format, incremental=True, rollups=False, anomaly_window=0)
+    process_and_post(root, raw[raw['cycle_no'] <= 400], config)
+    first = pd.read_csv(os.path.join(root, BASE, 'manifest.csv'))
+    process_and_post(root, raw, config)
+    manifest = pd.read_csv(os.path.join(root, BASE, 'manifest.csv'))
+
+    tests = manifest[manifest['test'] == 1]
+    assert len(tests)
+    for _, cell in tests.iterrows():
+        cycles = sorted(raw.loc[raw['battery_name'] == cell['battery_name'], 'cycle_no'])
+        cutoff = cycles[-1] - FORECAST_HORIZON
+        assert cutoff > first['cutoff'].max()
+        assert cell['cutoff'] == cutoff
+        assert cell_series(root, 'past', config, cell['battery_name']) == [c for c in cycles if c <= cutoff]
+        assert cell_series(root, 'actual', config, cell['battery_name']) == [c for c in cycles if c > cutoff]
+
+    test = pd.read_csv(os.path.join(root, BASE, 'test_dataset.csv'), header=None, names=['date', 'item_id', 'qd'])
+    train = pd.read_csv(os.path.join(root, BASE, 'train_dataset.csv'), header=None, names=['date', 'item_id', 'qd'])
+    assert len(test) == FORECAST_HORIZON*len(tests)
+    assert not train.duplicated(['date', 'item_id']).any()
+    assert set(manifest.loc[manifest['test'] == 0, 'cutoff']) == set(first['cutoff'])
+
+
+def test_full_rerun_without_new_export(root, raw):
+    config = PipelineConfig()
+    process_and_post(root, raw, config)
+    before = battery_stats(root, 'predictions', config).sort_values(['cycle', 'qd'], ignore_index=True)
+
+    run_post_processing(LocalBackend(str(root)), OUTPUT_PATH, config)
+    after = battery_stats(root, 'predictions', config).sort_values(['cycle', 'qd'], ignore_index=True)
+    pd.testing.assert_frame_equal(before, after)
+    assert before['qd'].notna().all()
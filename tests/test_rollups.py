@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from rollups import LEVEL_KEYS, QUANTILES, SKETCH_STEPS, rollup_frame
+
+
+def fleet(seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for site, batteries in (('north', ['aa', 'ab']), ('south', ['ac'])):
+        for batt in batteries:
+            for cell in range(int(rng.integers(3, 12))):
+                cycles = np.arange(1, int(rng.integers(20, 40)))
+                qd = 1.1 - rng.uniform(1e-4, 3e-3)*cycles + rng.normal(0, 2e-3, len(cycles))
+                rows.append(pd.DataFrame({'site': site, 'batt': batt, 'cell': f"{batt}c{cell}",
+                                          'cycle': cycles, 'qd': qd, 'soh': 100*qd/1.1}))
+    df = pd.concat(rows, ignore_index=True)
+    df['soh'] = (df['soh']/SKETCH_STEPS['soh']).round()*SKETCH_STEPS['soh']
+    return df
+
+
+# Inverted CDF quantile, the definition the sketches follow
+def exact_quantile(values, q):
+    values = np.sort(values)
+    return values[max(int(np.ceil(q*len(values))), 1) - 1]
+
+
+def test_levels_against_exact_aggregates():
+    df = fleet()
+    out = rollup_frame(df)
+    for level, keys in LEVEL_KEYS:
+        rows = out[out['level'] == level].set_index(keys)
+        groups = df.groupby(keys)
+        assert len(rows) == groups.ngroups
+        for key, group in groups:
+            row = rows.loc[key if len(keys) > 1 else key[0]]
+            assert row['cells'] == len(group)
+            for c in ('qd', 'soh'):
+                assert abs(row[f"{c}_mean"] - group[c].mean()) < 1e-6
+                assert abs(row[f"{c}_min"] - group[c].min()) < 1e-6
+                for name, q in QUANTILES.items():
+                    assert abs(row[f"{c}_{name}"] - exact_quantile(group[c], q)) <= SKETCH_STEPS[c]/2 + 1e-9
+
+
+def test_level_columns():
+    out = rollup_frame(fleet(seed=1))
+    assert out[out['level'] == 'fleet'][['site', 'batt']].isna().all().all()
+    assert out[out['level'] == 'site']['batt'].isna().all()
+    assert out[out['level'] == 'battery'][['site', 'batt']].notna().all().all()
+    assert set(out[out['level'] == 'site']['site']) == {'north', 'south'}
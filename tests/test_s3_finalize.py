@@ -0,0 +1,143 @@
+import pytest
+
+pytest.importorskip('botocore')
+
+import s3_finalize  # noqa: E402
+from s3_finalize import DELETE_BATCH, MIN_PART_SIZE, MultipartWriter, S3Finalizer, staging_key, target_key  # noqa: E402
+
+BUCKET = 'bucket'
+
+
+def test_target_key():
+    assert target_key('p/past/battery_name=b1c0/part-00000-x.csv') == 'p/past/b1c0.csv'
+    assert target_key('p/train_dataset.csv/part-00000-x.csv') == 'p/train_dataset.csv'
+
+
+def test_small_output_is_a_single_put(s3):
+    upload = MultipartWriter(S3Finalizer(s3, BUCKET), 'out.csv')
+    upload.write(b'a,b\n')
+    upload.write(b'1,2\n')
+    upload.close()
+    assert s3.objects['out.csv'] == b'a,b\n1,2\n'
+    assert s3.calls == ['put_object']
+
+
+def test_large_output_is_uploaded_in_parts(s3):
+    s3.objects['big.csv'] = b'x'*MIN_PART_SIZE
+    upload = MultipartWriter(S3Finalizer(s3, BUCKET), 'out.csv')
+    upload.copy_part('big.csv')
+    upload.write(b'y'*MIN_PART_SIZE)
+    upload.write(b'z'*10)
+    upload.close()
+    assert s3.objects['out.csv'] == b'x'*MIN_PART_SIZE + b'y'*MIN_PART_SIZE + b'z'*10
+    assert s3.calls.count('upload_part') == 2
+    assert not s3.uploads
+
+
+def test_concat_keeps_first_header(s3):
+    s3.objects.update({'p/1.csv': b'h1,h2\n1,2\n', 'p/2.csv': b'h1,h2\n3,4\n', 'p/3.csv': b'h1,h2\n'})
+    S3Finalizer(s3, BUCKET).concat('out.csv', ['p/1.csv', 'p/2.csv', 'p/3.csv'], header=True)
+    assert s3.objects['out.csv'] == b'h1,h2\n1,2\n3,4\n'
+
+
+# Headers longer than a read chunk are still dropped whole
+def test_concat_header_longer_than_chunk(s3, monkeypatch):
+    monkeypatch.setattr(s3_finalize, 'READ_CHUNK', 4)
+    head = b'battery_name,cycle_no,qd\n'
+    s3.objects.update({'p/1.csv': head + b'aac0,1,1.1\n', 'p/2.csv': head + b'aac0,2,1.0\n', 'p/3.csv': head})
+    S3Finalizer(s3, BUCKET).concat('out.csv', ['p/1.csv', 'p/2.csv', 'p/3.csv'], header=True)
+    assert s3.objects['out.csv'] == head + b'aac0,1,1.1\naac0,2,1.0\n'
+
+
+def test_concat_aborts_failed_upload(s3, monkeypatch):
+    s3.objects.update({'p/1.csv': b'x'*MIN_PART_SIZE, 'p/2.csv': b'y'})
+
+    def fail(**kwargs):
+        raise RuntimeError('upload failed')
+    monkeypatch.setattr(s3, 'upload_part', fail)
+    with pytest.raises(RuntimeError):
+        S3Finalizer(s3, BUCKET).concat('out.csv', ['p/1.csv', 'p/2.csv'])
+    assert s3.aborted == ['out.csv']
+    assert not s3.uploads
+    assert 'out.csv' not in s3.objects
+
+
+def test_merge_parts(s3):
+    staging = staging_key()
+    s3.objects.update({f"{staging}/part-0.csv": b'1,2\n', f"{staging}/part-1.csv": b'3,4\n',
+                       f"{staging}/_SUCCESS": b'', 'out.csv': b'0,0\n'})
+    finalizer = S3Finalizer(s3, BUCKET)
+    finalizer.merge_parts(staging, 'out.csv', append=True)
+    finalizer.discard(staging)
+    assert s3.objects == {'out.csv': b'0,0\n1,2\n3,4\n'}
+
+
+def test_finalize_partitions(s3):
+    staging = staging_key()
+    s3.objects.update({
+        f"{staging}/batt=aa/part-0.csv": b'cycle\n1\n',
+        f"{staging}/batt=aa/part-1.csv": b'cycle\n2\n',
+        f"{staging}/batt=ab/part-0.csv": b'cycle\n3\n',
+        f"{staging}/_SUCCESS": b'',
+        'plot/ab.csv': b'cycle\n0\n',
+        'plot/ac.csv': b'cycle\n0\n',
+        'plot/levels/200/ac.csv': b'cycle\n0\n',
+    })
+    finalizer = S3Finalizer(s3, BUCKET)
+    stats = finalizer.finalize(staging, 'plot', replace=True)
+    finalizer.discard(staging)
+    assert stats['copied'] == 2 and stats['deleted'] == 1
+    assert s3.objects == {
+        'plot/aa.csv': b'cycle\n1\n2\n',
+        'plot/ab.csv': b'cycle\n3\n',
+        'plot/levels/200/ac.csv': b'cycle\n0\n',
+    }
+
+
+def test_finalize_append(s3):
+    staging = staging_key()
+    s3.objects.update({f"{staging}/batt=aa/part-0.csv": b'cycle\n2\n', 'plot/aa.csv': b'cycle\n1\n',
+                       'plot/ab.csv': b'cycle\n0\n'})
+    S3Finalizer(s3, BUCKET).finalize(staging, 'plot', append=True)
+    assert s3.objects['plot/aa.csv'] == b'cycle\n1\n2\n'
+    assert s3.objects['plot/ab.csv'] == b'cycle\n0\n'
+
+
+def test_deletes_are_batched(s3):
+    staging = staging_key()
+    cells = DELETE_BATCH + 1
+    s3.objects.update({f"{staging}/battery_name=c{i}/part-0.csv": b'' for i in range(cells)})
+    finalizer = S3Finalizer(s3, BUCKET)
+    finalizer.finalize(staging, 'p/past')
+    finalizer.discard(staging)
+    assert len(s3.objects) == cells
+    assert s3.calls.count('delete_objects') == 2
+
+
+def test_throttled_copies_are_retried(s3, monkeypatch):
+    from botocore.exceptions import ClientError
+
+    monkeypatch.setattr(s3_finalize.time, 'sleep', lambda seconds: None)
+    copy = s3.copy_object
+    failures = []
+
+    def throttled(**kwargs):
+        if len(failures) < 2:
+            failures.append(kwargs['Key'])
+            raise ClientError({'Error': {'Code': 'SlowDown'}}, 'CopyObject')
+        return copy(**kwargs)
+
+    s3.copy_object = throttled
+    staging = staging_key()
+    s3.objects[f"{staging}/battery_name=b1c0/part-0.csv"] = b'x'
+    S3Finalizer(s3, BUCKET).finalize(staging, 'p/past')
+    assert s3.objects['p/past/b1c0.csv'] == b'x'
+    assert len(failures) == 2
+
+
+def test_other_errors_fail(s3):
+    staging = staging_key()
+    s3.objects[f"{staging}/battery_name=b1c0/part-0.csv"] = b'x'
+    s3.copy_object = lambda **kwargs: s3._get('missing')
+    with pytest.raises(Exception, match='NoSuchKey'):
+        S3Finalizer(s3, BUCKET).finalize(staging, 'p/past')
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from local_backend import LocalBackend, cell_hash
+from pipeline_core import CELLS_PER_BATTERY, HASH_MIX, HASH_SHIFTS, PipelineConfig, hash_offset, signed64
+
+CUTOFF = 100
+
+
+# SplitMix64 of a single value, in Python integers
+def splitmix64(value, seed):
+    z = (value + hash_offset(seed)) % 2**64
+    for shift, mix in zip(HASH_SHIFTS, HASH_MIX):
+        z = ((z ^ (z >> shift))*mix) % 2**64
+    return signed64(z ^ (z >> HASH_SHIFTS[-1]))
+
+
+# Rows over the whole horizon after the cutoff for batteries of cells
+# each, plus a battery with fewer cells than sampled
+def candidates(batteries=4, cells=12, short=2):
+    horizon = PipelineConfig().forecast_horizon
+    batt_id = np.repeat(np.arange(batteries), cells).tolist() + [batteries]*short
+    return pd.DataFrame({
+        'cell_id': np.repeat(np.arange(len(batt_id)), horizon),
+        'batt_id': np.repeat(batt_id, horizon),
+        'cycle_no': np.tile(np.arange(CUTOFF + 1, CUTOFF + horizon + 1), len(batt_id)),
+    })
+
+
+def test_cell_hash_is_splitmix64():
+    ids = np.array([0, 1, 2, 12345, 2**40])
+    for seed in (0, 7):
+        assert cell_hash(ids, seed).tolist() == [splitmix64(int(i), seed) for i in ids]
+
+
+def test_sampling_is_seeded():
+    df = candidates()
+    backend = LocalBackend('.')
+    sample = backend.get_test_set(df, CUTOFF, PipelineConfig(sampling=True, sampling_seed=3))
+    again = backend.get_test_set(df.sample(frac=1, random_state=1), CUTOFF,
+                                 PipelineConfig(sampling=True, sampling_seed=3))
+    other = backend.get_test_set(df, CUTOFF, PipelineConfig(sampling=True, sampling_seed=4))
+    assert sample == again
+    assert sample != other
+
+
+def test_cells_per_battery():
+    df = candidates()
+    test_set = LocalBackend('.').get_test_set(df, CUTOFF, PipelineConfig(sampling=True))
+    counts = df[df['cell_id'].isin(test_set)].groupby('batt_id')['cell_id'].nunique()
+    assert counts.to_dict() == {0: CELLS_PER_BATTERY, 1: CELLS_PER_BATTERY, 2: CELLS_PER_BATTERY,
+                                3: CELLS_PER_BATTERY, 4: 2}
+
+
+def test_no_sampling_keeps_every_candidate():
+    df = candidates()
+    assert LocalBackend('.').get_test_set(df, CUTOFF, PipelineConfig()) == sorted(df['cell_id'].unique())
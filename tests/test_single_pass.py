@@ -0,0 +1,76 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from local_backend import LocalBackend
+from pipeline_core import SPLITS, PipelineConfig, run_post_processing, run_processing
+
+BASE = 'u/p'
+RAW_KEY = f"{BASE}/raw_dataset.csv"
+
+
+# Two batteries of four cells fading linearly, half of them living long
+# enough past the cutoff to be test cells
+def raw_dataset():
+    rng = np.random.default_rng(0)
+    frames = []
+    for batt in ('aa', 'ab'):
+        for cell, life in enumerate((60, 90, 200, 240)):
+            cycles = np.arange(1, life + 1)
+            qd = 1.1*(1 - 0.2*cycles/life) + rng.normal(0, 1e-3, life)
+            frames.append(pd.DataFrame({'battery_name': f"{batt}c{cell}", 'cycle_no': cycles,
+                                        'cycle_life': life, 'QD': qd.round(6)}))
+    return pd.concat(frames, ignore_index=True)
+
+
+# Forecast export with the actual values as p50
+def write_export(root):
+    test = pd.read_csv(os.path.join(root, BASE, 'test_dataset.csv'), header=None, names=['date', 'item_id', 'qd'])
+    target = os.path.join(root, BASE, 'plot', 'predictions')
+    os.makedirs(target, exist_ok=True)
+    pd.DataFrame({
+        'item_id': test['item_id'],
+        'date': test['date'].str.replace(' ', 'T') + 'Z',
+        'p10': test['qd'] - 0.01,
+        'p50': test['qd'],
+        'p90': test['qd'] + 0.01,
+    }).to_csv(os.path.join(target, 'forecast_export_part0.csv'), index=False)
+
+
+@pytest.fixture(scope='module')
+def processed(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('processed'))
+    os.makedirs(os.path.join(root, BASE))
+    raw_dataset().to_csv(os.path.join(root, RAW_KEY), index=False)
+    run_processing(LocalBackend(root), RAW_KEY)
+    write_export(root)
+    return root
+
+
+def post_process(processed, tmp_path, single_pass):
+    root = str(tmp_path / ('single' if single_pass else 'splits'))
+    shutil.copytree(processed, root)
+    run_post_processing(LocalBackend(root), f"{BASE}/plot/predictions", PipelineConfig(single_pass=single_pass))
+    return root
+
+
+def battery_frames(root):
+    frames = {}
+    for split in SPLITS:
+        target = os.path.join(root, BASE, 'plot', split)
+        for name in sorted(os.listdir(target)):
+            if len(name.split('.')[0]) == 2:
+                frames[split, name] = pd.read_csv(os.path.join(target, name))
+    return frames
+
+
+def test_single_pass_matches_split_passes(processed, tmp_path):
+    single = battery_frames(post_process(processed, tmp_path, True))
+    splits = battery_frames(post_process(processed, tmp_path, False))
+    assert sorted(single) == sorted(splits)
+    assert {split for split, _ in single} == set(SPLITS)
+    for key, df in splits.items():
+        pd.testing.assert_frame_equal(single[key].reset_index(drop=True), df.reset_index(drop=True))
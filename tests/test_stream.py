@@ -0,0 +1,56 @@
+import os
+
+import pandas as pd
+
+from local_backend import LocalBackend, watch
+from pipeline_core import REJECTED_FILES_KEY, PipelineConfig
+from synthetic_fleet import generate_fleet
+
+RAW_COLUMNS = ['battery_name', 'cycle_no', 'cycle_life', 'QD']
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def test_raw_by_name(tmp_path):
+    write(tmp_path / 'ordered.csv', 'battery_name,cycle_no,cycle_life,QD\naac0,1,300,1.1\n')
+    write(tmp_path / 'shuffled.csv', 'QD,cycle_no,battery_name,cycle_life\n1.0,2,aac0,300\n0.9,3,aac0,\n')
+    write(tmp_path / 'renamed.csv', 'battery,cycle_no,cycle_life,QD\naac1,1,300,1.1\n')
+    write(tmp_path / 'extra.csv', 'battery_name,cycle_no,cycle_life,QD,temp\naac2,1,300,1.1,25\n')
+    write(tmp_path / 'short.csv', 'battery_name,cycle_no,QD\naac3,1,1.1\n')
+    write(tmp_path / 'headerless.csv', 'aac4,1,300,1.1\n')
+
+    backend = LocalBackend(str(tmp_path))
+    files = sorted(str(f) for f in tmp_path.iterdir())
+    frame, read, rejected = backend.raw_by_name(backend.read_raw_stream(files))
+
+    assert read == [str(tmp_path / 'ordered.csv'), str(tmp_path / 'shuffled.csv')]
+    assert sorted(rejected) == sorted(str(tmp_path / f) for f in ('renamed.csv', 'extra.csv', 'short.csv',
+                                                                  'headerless.csv'))
+    rows = frame.sort_values('cycle_no')[RAW_COLUMNS].fillna('').to_numpy().tolist()
+    assert rows == [['aac0', '1', '300', '1.1'], ['aac0', '2', '300', '1.0'], ['aac0', '3', '', '0.9']]
+
+
+# A file with shuffled columns is read by name, a file with other columns
+# is rejected and the stream goes on
+def test_watch_rejects_mismatched_headers(tmp_path):
+    raw = generate_fleet(2, 4, 100, seed=2)
+    os.makedirs(tmp_path / 'u/p/raw')
+    raw.to_csv(tmp_path / 'u/p/raw/part0.csv', index=False, columns=['QD', 'cycle_life', 'battery_name', 'cycle_no'])
+    raw.rename(columns={'QD': 'capacity'}).to_csv(tmp_path / 'u/p/raw/part1.csv', index=False)
+
+    backend = LocalBackend(str(tmp_path))
+    watch(backend, 'u/p/raw', PipelineConfig(), once=True)
+
+    assert backend.read_text(f"u/p/{REJECTED_FILES_KEY}").split() == [str(tmp_path / 'u/p/raw/part1.csv')]
+    live = pd.read_csv(tmp_path / 'u/p/live/cells.csv').set_index('battery_name').sort_index()
+    last = raw.sort_values('cycle_no').groupby('battery_name').last()
+    assert (live['cycle'] == last['cycle_no']).all()
+    assert ((live['qd'] - last['QD']).abs() < 1e-6).all()
+
+    # Only rejected files in a batch
+    write(tmp_path / 'u/p/raw/part2.csv', 'a,b\n1,2\n')
+    watch(backend, 'u/p/raw', PipelineConfig(), once=True)
+    assert len(backend.read_text(f"u/p/{REJECTED_FILES_KEY}").split()) == 2
@@ -0,0 +1,71 @@
+import math
+
+import pytest
+
+from health_metrics import EOL_FRACTION, calc_eol, calc_eol_cycle, calc_rul, calc_rul2
+from pipeline_core import build_summary, fitted_eol_cycles
+
+
+# qd 0.95 at cycle 100 reaches 0.8 at cycle 400 under a linear fade
+def test_linear_eol():
+    assert float(calc_eol(0.95, 100, 1.0)) == pytest.approx(400)
+    assert calc_eol_cycle(100, 95.0) == 400
+
+
+# The RUL models' c_dead is the number of cycles left to end of life
+@pytest.mark.parametrize('model, calc', [('linear', calc_rul), ('log', calc_rul2)])
+def test_eol_matches_rul_model(model, calc):
+    qd, cycle = 0.9, 150
+    remaining = float(calc_eol(qd, cycle, 1.0, model)) - cycle
+    assert float(calc(qd, cycle, 1.0)) == round((remaining - cycle)*100/remaining, 2)
+
+
+def test_log_eol():
+    eol = float(calc_eol(0.95, 100, 1.0, 'log'))
+    assert eol == pytest.approx(100*math.log(EOL_FRACTION)/math.log(0.95))
+    assert 0.95**(eol/100) == pytest.approx(EOL_FRACTION)
+    assert calc_eol_cycle(100, 95.0, 'log') == round(eol)
+
+
+def test_fitted_eol():
+    assert calc_eol_cycle(100, 95.0, 'fit', 512.4) == 512
+    assert calc_eol_cycle(100, 95.0, 'fit', 80.0) == 100
+    assert calc_eol_cycle(100, 95.0, 'fit', None) is None
+    assert calc_eol_cycle(100, 95.0, 'fit', float('nan')) is None
+
+
+# Close to end of life the linear model still puts it ahead of cycle
+def test_eol_cycle_never_in_the_past():
+    assert calc_eol_cycle(356, 81.98) == round(356*20/18.02)
+    assert calc_eol_cycle(333, 85.47) == round(333*20/14.53)
+
+
+def test_eol_cycle_null():
+    assert calc_eol_cycle(100, 100.0) is None
+    assert calc_eol_cycle(100, 80.0) is None
+    assert calc_eol_cycle(100, 75.0) is None
+    assert calc_eol_cycle(100, None) is None
+    assert calc_eol_cycle(100, float('nan')) is None
+
+
+def test_summary_clamps_rul():
+    latest = {
+        'past': [('aa', 300, 90.0, 40.0), ('ab', 300, 81.98, -810.5)],
+        'actual': [('aa', 330, 89.0, 35.0), ('ab', 330, 79.5, 120.0)],
+        'predictions': [('aa', 330, 88.5, -10.0)],
+    }
+    batteries = build_summary(latest, {})['batteries']
+    aa, ab = batteries['aa'], batteries['ab']
+    assert (aa['cycle'], aa['rul'], aa['forecast_rul']) == (330, 35.0, 0.0)
+    assert aa['eol_cycle'] == round(330*20/11.5)
+    assert ab['cycle'] == 330 and ab['eol_cycle'] is None
+
+
+def test_summary_fitted_eol():
+    fitted = fitted_eol_cycles("batt,model,c0,c1,rmse,eol_cycle,points\n"
+                               "aa,linear,1.0,-0.0005,0.01,400.0,30\nab,linear,1.0,0.0,0.01,,30\n")
+    assert fitted == {'aa': 400.0}
+    latest = {'past': [('aa', 300, 90.0, 40.0), ('ab', 300, 95.0, 100.0)]}
+    batteries = build_summary(latest, {}, model='fit', fitted=fitted)['batteries']
+    assert batteries['aa']['eol_cycle'] == 400
+    assert batteries['ab']['eol_cycle'] is None
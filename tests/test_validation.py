@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from local_backend import LocalBackend
+from pipeline_core import QUALITY_REPORT_KEY, QUARANTINE_KEY, PipelineConfig, run_processing
+
+
+def cell(name, cycles, life=100, qd=None):
+    cycles = np.asarray(cycles)
+    qd = 1.1 - 1e-3*cycles if qd is None else qd
+    return pd.DataFrame({'battery_name': name, 'cycle_no': cycles.astype(str), 'cycle_life': str(life),
+                         'QD': np.round(qd, 6).astype(str)})
+
+
+def validate(df, **config):
+    validation = LocalBackend('.').validate(df, PipelineConfig(**config))
+    return validation, validation.report.set_index('battery_name')
+
+
+def test_bad_rows_are_dropped():
+    df = pd.concat([
+        cell('aac0', range(1, 11)),
+        pd.DataFrame({'battery_name': ['aac0']*3, 'cycle_no': ['x', '5', '11'], 'cycle_life': ['100']*3,
+                      'QD': ['1.0', '1.2', '7.5']}),
+    ], ignore_index=True)
+    validation, report = validate(df)
+    row = report.loc['aac0']
+    assert (row['rows'], row['invalid'], row['duplicates'], row['out_of_range']) == (13, 1, 1, 1)
+    assert row['status'] == 'ok'
+    frame = validation.frame.sort_values('cycle_no')
+    assert frame['cycle_no'].tolist() == list(range(1, 11))
+    # The first row of a repeated cycle is kept
+    assert abs(frame.loc[frame['cycle_no'] == 5, 'QD'].item() - (1.1 - 5e-3)) < 1e-6
+
+
+def test_bad_cells_are_quarantined():
+    df = pd.concat([
+        cell('aac0', range(1, 21)),
+        cell('aac1', range(1, 11), life=100),
+        cell('aac1', range(11, 21), life=120),
+        cell('aac2', [1, 2, 10, 20]),
+        cell('aac3', [1]),
+    ], ignore_index=True)
+    validation, report = validate(df)
+    assert report['status'].to_dict() == {'aac0': 'ok', 'aac1': 'quarantined', 'aac2': 'quarantined',
+                                          'aac3': 'quarantined'}
+    assert set(validation.frame['battery_name']) == {'aac0'}
+    assert sorted(validation.quarantine['battery_name'].unique()) == ['aac1', 'aac2', 'aac3']
+    assert len(validation.quarantine) == 25
+    assert validation.statuses == {'ok': 1, 'quarantined': 3}
+
+
+def test_small_gaps_are_interpolated():
+    cycles = [c for c in range(1, 31) if c not in (5, 6, 20, 21, 22)]
+    validation, report = validate(cell('aac0', cycles), repair_gaps=2)
+    row = report.loc['aac0']
+    assert (row['status'], row['filled'], row['missing'], row['max_gap']) == ('repaired', 2, 5, 3)
+    frame = validation.frame.sort_values('cycle_no')
+    assert frame['cycle_no'].tolist() == [c for c in range(1, 31) if c not in (20, 21, 22)]
+    np.testing.assert_allclose(frame.loc[frame['cycle_no'].isin([5, 6]), 'QD'], [1.1 - 5e-3, 1.1 - 6e-3], atol=1e-6)
+
+
+def test_gaps_are_kept_by_default():
+    cycles = [c for c in range(1, 31) if c not in (5, 6)]
+    validation, report = validate(cell('aac0', cycles))
+    assert report.loc['aac0', 'status'] == 'ok'
+    assert len(validation.frame) == 28
+
+
+def test_processing_writes_report_and_quarantine(tmp_path):
+    root = str(tmp_path)
+    os.makedirs(os.path.join(root, 'u/p'))
+    raw = pd.concat([cell(f"aac{i}", range(1, 101 + 40*i), life=100 + 40*i) for i in range(4)]
+                    + [cell('abc0', [1, 2, 50], life=50)], ignore_index=True)
+    raw.to_csv(os.path.join(root, 'u/p/raw_dataset.csv'), index=False)
+    run_processing(LocalBackend(root), 'u/p/raw_dataset.csv')
+
+    report = pd.read_csv(os.path.join(root, 'u/p', QUALITY_REPORT_KEY))
+    assert dict(zip(report['battery_name'], report['status'])) == {
+        'aac0': 'ok', 'aac1': 'ok', 'aac2': 'ok', 'aac3': 'ok', 'abc0': 'quarantined'}
+    quarantine = pd.read_csv(os.path.join(root, 'u/p', QUARANTINE_KEY))
+    assert quarantine['battery_name'].unique().tolist() == ['abc0']
+    train = pd.read_csv(os.path.join(root, 'u/p/train_dataset.csv'), header=None, names=['date', 'item_id', 'qd'])
+    assert 'abc0' not in set(train['item_id'])